@@ -0,0 +1,45 @@
+import hashlib
+from typing import Optional, Tuple
+
+from fastapi import Header, HTTPException, Request
+
+from app.config import get_settings
+from app.exceptions import LLMProviderUnavailableError, RateLimitExceededError
+from app.services.ratelimit import rate_limiter
+
+settings = get_settings()
+
+
+def retry_later(e: Exception) -> HTTPException:
+    """限流返回 429，供应商熔断或超时返回 503，都带上 Retry-After"""
+    status_code = 429 if isinstance(e, RateLimitExceededError) else 503
+    headers = {"Retry-After": str(max(1, round(e.retry_after)))} if e.retry_after else None
+    return HTTPException(status_code=status_code, detail=e.message, headers=headers)
+
+
+def client_identity(request: Request, api_key: Optional[str]) -> Tuple[str, int]:
+    """
+    调用方标识和每分钟请求数配额
+
+    X-API-Key 没有经过鉴权，只有在 client_quotas 中配置过的 key 才按 key 区分，
+    否则按 IP 区分，避免随意更换请求头绕过配额。标识中的 key 只保留摘要，不出现在错误信息中。
+    """
+    if api_key and api_key in settings.client_quotas:
+        return f"key:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]}", settings.client_quotas[api_key]
+    return f"ip:{request.client.host if request.client else 'anonymous'}", settings.client_rpm
+
+
+async def admit_client(request: Request, x_api_key: Optional[str] = Header(default=None)):
+    """按调用方（见 client_identity）做请求频率和并发准入"""
+    client, rpm = client_identity(request, x_api_key)
+    try:
+        await rate_limiter.acquire_client(client, rpm)
+    except RateLimitExceededError as e:
+        raise retry_later(e)
+    try:
+        yield
+    finally:
+        rate_limiter.release_client(client)
+
+
+RETRY_LATER_ERRORS = (LLMProviderUnavailableError, RateLimitExceededError)
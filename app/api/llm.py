@@ -1,58 +1,231 @@
-from fastapi import APIRouter, HTTPException
-from typing import List,Dict
+import json
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from typing import List,Dict,Any,AsyncIterator,Optional
+from pydantic import ValidationError
 from enum import Enum
 from loguru import logger
 from app.schemas.llm import (
     StoryGenerationResponse,
     StoryGenerationRequest,
     ImageGenerationRequest,
-    ImageGenerationResponse
+    ImageGenerationResponse,
+    StoryBatchRequest,
+    StoryBatchResultResponse,
+    StoryBatchSubmitResponse,
+    StorySegmentRegenerateRequest,
 )
+from app.models.const import BatchMode
+from app.exceptions import LLMProviderError, StorySessionConflictError, StorySessionNotFoundError
+from app.services import batch
 from app.services.llm import llm_service
+from app.services.cache import generation_cache
+from app.services.asset import asset_store
+from app.services.resilience import resilience
+from app.services.ratelimit import rate_limiter
+from app.services.routing import provider_router
+from app.services.session import story_sessions
+from app.api.deps import RETRY_LATER_ERRORS, admit_client, retry_later
+from app.config import get_settings
+from app.utils.static import sign_url, sign_urls
 
 
 router = APIRouter()
+settings = get_settings()
+
+def ndjson_response(events: AsyncIterator[Dict[str, Any]]) -> StreamingResponse:
+    async def body():
+        async for event in events:
+            yield json.dumps(sign_urls(event), ensure_ascii=False) + "\n"
+        yield json.dumps({"event": "done"}) + "\n"
+    return StreamingResponse(body(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
 
 class LLMType(str, Enum):
     TEXT = "text"
     IMAGE = "image"
     VIDEO = "video"
     
-@router.post("/story",response_model=StoryGenerationResponse)
+@router.post("/story",response_model=StoryGenerationResponse, dependencies=[Depends(admit_client)])
 async def generate_story(request: StoryGenerationRequest) -> StoryGenerationResponse:
     """根据给定的prompt生成故事"""
     try:
         resp = await llm_service.generate_story(request)
         return StoryGenerationResponse(segments=resp)
+    except RETRY_LATER_ERRORS as e:
+        raise retry_later(e)
     except Exception as e:
         logger.error(f"Error generating story: {e}")
         raise HTTPException(status_code=500, detail=f"Error generating story, err msg:{e}")
     
-@router.post("/image",response_model=ImageGenerationResponse)
+@router.post("/story/stream", dependencies=[Depends(admit_client)])
+async def stream_story(request: StoryGenerationRequest) -> StreamingResponse:
+    """流式生成故事，每行一个 JSON（NDJSON），场景生成完就返回"""
+    async def events():
+        index = 0
+        try:
+            async for segment in llm_service.stream_story(request):
+                yield {"event": "segment", "index": index, "segment": segment}
+                index += 1
+        except Exception as e:
+            logger.error(f"Error streaming story: {e}")
+            yield {"event": "error", "message": str(e)}
+    return ndjson_response(events())
+
+async def _story_batch(requests: List[StoryGenerationRequest], concurrency: Optional[int], mode: BatchMode):
+    if len(requests) > settings.batch_max_items:
+        raise HTTPException(status_code=413, detail=f"Batch too large, at most {settings.batch_max_items} requests")
+    if mode == BatchMode.online:
+        return ndjson_response(batch.stream_story_batch(requests, concurrency))
+    try:
+        return StoryBatchSubmitResponse(**await batch.submit_offline_batch(requests))
+    except LLMProviderError as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    except RETRY_LATER_ERRORS as e:
+        raise retry_later(e)
+    except Exception as e:
+        logger.error(f"Failed to submit offline story batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/story/batch", dependencies=[Depends(admit_client)])
+async def story_batch(request: StoryBatchRequest):
+    """批量生成故事
+
+    online 模式按完成顺序返回 NDJSON，每行带输入序号 index；offline 模式提交到供应商的离线批处理，
+    返回 batch_id，通过 GET /story/batch/{batch_id} 查询结果。
+    """
+    return await _story_batch(request.requests, request.concurrency, request.mode)
+
+@router.post("/story/batch/upload", dependencies=[Depends(admit_client)])
+async def story_batch_upload(
+    file: UploadFile = File(..., description="JSONL 文件，每行一个故事生成请求"),
+    concurrency: Optional[int] = Query(default=None, ge=1),
+    mode: BatchMode = Query(default=BatchMode.online),
+):
+    """上传 JSONL 批量生成故事，返回格式同 /story/batch"""
+    requests, errors = [], []
+    for line_no, line in enumerate((await file.read()).decode("utf-8").splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            requests.append(StoryGenerationRequest.model_validate_json(line))
+        except ValidationError as e:
+            errors.append({"line": line_no, "errors": e.errors(include_url=False, include_context=False)})
+    if errors:
+        raise HTTPException(status_code=422, detail=errors[:20])
+    if not requests:
+        raise HTTPException(status_code=422, detail="Empty batch")
+    return await _story_batch(requests, concurrency, mode)
+
+@router.get("/story/batch/{batch_id}", response_model=StoryBatchResultResponse)
+async def get_story_batch(batch_id: str) -> StoryBatchResultResponse:
+    """查询离线批处理的状态和结果"""
+    try:
+        result = await batch.get_offline_batch(batch_id)
+    except Exception as e:
+        logger.error(f"Failed to get offline story batch {batch_id}: {e}")
+        raise HTTPException(status_code=502, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return StoryBatchResultResponse(**result)
+
+@router.post("/image",response_model=ImageGenerationResponse, dependencies=[Depends(admit_client)])
 async def generate_image(request: ImageGenerationRequest) -> ImageGenerationResponse:
     """根据给定的prompt生成图片"""
     try:
-        image_url = await llm_service.generate_image(prompt=request.prompt, image_llm_provider=request.image_llm_provider, image_llm_model=request.image_llm_model, resolution=request.resolution)
-        return ImageGenerationResponse(image_url=image_url)
+        image_url = await llm_service.generate_image(prompt=request.prompt, image_llm_provider=request.image_llm_provider, image_llm_model=request.image_llm_model, resolution=request.resolution, use_cache=request.use_cache)
+        thumbnail_url = asset_store.thumbnail_url(image_url, settings.asset_thumbnail_widths[0]) if settings.asset_thumbnail_widths else None
+        return ImageGenerationResponse(image_url=sign_url(image_url), thumbnail_url=sign_url(thumbnail_url) if thumbnail_url else None)
+    except RETRY_LATER_ERRORS as e:
+        raise retry_later(e)
     except Exception as e:
         logger.error(f"Error generating story: {e}")
         raise HTTPException(status_code=500, detail=f"Error generating story,err msg:{e}")
     
 
-@router.post("/story-with-images", response_model=StoryGenerationResponse)
+@router.post("/story-with-images", response_model=StoryGenerationResponse, dependencies=[Depends(admit_client)])
 async def generate_story_with_images(request: StoryGenerationRequest) -> StoryGenerationResponse:
     """生成故事和配图"""
     try:
-        segments = await llm_service.generate_story_with_images(request)
-        return StoryGenerationResponse(segments=segments)
+        result = await llm_service.generate_story_with_images(request)
+        return StoryGenerationResponse(**sign_urls(result))
+    except RETRY_LATER_ERRORS as e:
+        raise retry_later(e)
     except Exception as e:
         logger.error(f"Failed to generate story with images: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/story-with-images/stream", dependencies=[Depends(admit_client)])
+async def stream_story_with_images(request: StoryGenerationRequest) -> StreamingResponse:
+    """流式生成故事和配图（NDJSON），每个场景返回后立即开始生成对应图片"""
+    return ndjson_response(llm_service.stream_story_with_images(request))
+
+@router.post("/story/sessions", response_model=StoryGenerationResponse, dependencies=[Depends(admit_client)])
+async def create_story_session(request: StoryGenerationRequest) -> StoryGenerationResponse:
+    """生成故事和配图并保存为会话，返回 session_id 和带 ID 的场景，之后可以只重新生成部分场景"""
+    try:
+        result = await llm_service.generate_story_with_images(request)
+        session = await story_sessions.create(request, result)
+        return StoryGenerationResponse(**sign_urls(session))
+    except RETRY_LATER_ERRORS as e:
+        raise retry_later(e)
+    except Exception as e:
+        logger.error(f"Failed to create story session: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/story/sessions/{session_id}", response_model=StoryGenerationResponse)
+async def get_story_session(session_id: str) -> StoryGenerationResponse:
+    """查询故事会话的当前内容"""
+    session = await story_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Story session {session_id} not found")
+    return StoryGenerationResponse(**sign_urls(session))
+
+@router.post("/story/sessions/{session_id}/regenerate", response_model=StoryGenerationResponse, dependencies=[Depends(admit_client)])
+async def regenerate_story_segments(session_id: str, request: StorySegmentRegenerateRequest) -> StoryGenerationResponse:
+    """只重新生成会话中选中场景的文本和 / 或配图，其他场景和配图原样保留"""
+    try:
+        session = await story_sessions.regenerate(session_id, request.segment_ids, request.target, request.instruction, request.version)
+        return StoryGenerationResponse(**sign_urls(session))
+    except StorySessionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=e.message)
+    except StorySessionConflictError as e:
+        raise HTTPException(status_code=409, detail=e.message)
+    except RETRY_LATER_ERRORS as e:
+        raise retry_later(e)
+    except Exception as e:
+        logger.error(f"Failed to regenerate segments of story session {session_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/providers", response_model=Dict[str, List[str]])
 async def get_llm_providers():
     """
     获取 LLM Provider 列表
     """
     # 这里将实现获取 LLM Provider 的逻辑
-    return llm_service.get_llm_providers()
\ No newline at end of file
+    return llm_service.get_llm_providers()
+
+@router.get("/cache/stats", response_model=Dict[str, Any])
+async def get_cache_stats():
+    """缓存命中及请求合并统计"""
+    return {
+        **generation_cache.snapshot(),
+        "assets": asset_store.snapshot(),
+        "inflight": llm_service.flight.inflight,
+        "coalesced": llm_service.flight.stats["shared"],
+        "coalesce_cancelled": llm_service.flight.stats["cancelled"],
+    }
+
+@router.get("/resilience/stats", response_model=Dict[str, Any])
+async def get_resilience_stats():
+    """各供应商的熔断状态、重试次数和 p95 延迟"""
+    return resilience.snapshot()
+
+@router.get("/ratelimit/stats", response_model=Dict[str, Any])
+async def get_ratelimit_stats():
+    """准入统计和各供应商令牌桶余量"""
+    return rate_limiter.snapshot()
+
+@router.get("/routing/stats", response_model=Dict[str, Any])
+async def get_routing_stats():
+    """供应商池的路由决策、各供应商延迟 / 错误率 EWMA 和延迟直方图"""
+    return provider_router.snapshot()
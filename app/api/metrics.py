@@ -0,0 +1,102 @@
+from typing import List
+
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from app.services.asset import asset_store
+from app.services.cache import generation_cache
+from app.services.llm import llm_service
+from app.services.ratelimit import rate_limiter
+from app.services.resilience import CircuitBreaker, resilience
+from app.services.routing import provider_router
+from app.services.session import story_sessions
+from app.services.storage import storage_manager
+from app.services.task import task_manager
+from app.utils.metrics import Sample, registry
+
+router = APIRouter()
+
+BREAKER_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+def _cache_samples() -> List[Sample]:
+    stats = generation_cache.snapshot()
+    flight = llm_service.flight
+    return [
+        ("generation_cache_lookups_total", "counter", "Generation cache lookups by result", [
+            ({"result": "memory_hit"}, stats["memory_hits"]),
+            ({"result": "disk_hit"}, stats["disk_hits"]),
+            ({"result": "miss"}, stats["misses"]),
+            ({"result": "bypass"}, stats["bypass"]),
+        ]),
+        ("generation_cache_hit_ratio", "gauge", "Share of cache lookups served from memory or disk", [({}, stats["hit_ratio"])]),
+        ("generation_cache_memory_bytes", "gauge", "Bytes held by the in-memory cache", [({}, stats["memory_bytes"])]),
+        ("generation_cache_evictions_total", "counter", "In-memory cache evictions", [({}, stats["evictions"])]),
+        ("singleflight_inflight", "gauge", "Distinct generations currently in flight", [({}, flight.inflight)]),
+        ("singleflight_coalesced_total", "counter", "Callers that joined an identical in-flight generation", [({}, flight.stats["shared"])]),
+        ("asset_events_total", "counter", "Asset store downloads, dedup hits and thumbnails", [
+            ({"event": name}, value) for name, value in asset_store.snapshot().items()
+        ]),
+        ("story_session_events_total", "counter", "Story sessions created, partial regenerations and segments regenerated or reused", [
+            ({"event": name}, value) for name, value in story_sessions.snapshot().items()
+        ]),
+    ]
+
+
+def _provider_samples() -> List[Sample]:
+    health = resilience.snapshot()
+    return [
+        ("provider_breaker_state", "gauge", "Circuit breaker state (0 closed, 1 half open, 2 open)", [
+            ({"provider": provider}, BREAKER_STATES[item["breaker"]]) for provider, item in health.items()
+        ]),
+        ("provider_resilience_events_total", "counter", "Provider calls, retries, timeouts and hedges", [
+            ({"provider": provider, "event": name}, value)
+            for provider, item in health.items()
+            for name, value in item.items() if name not in ("breaker", "p95_ms")
+        ]),
+        ("admission_total", "counter", "Client admission decisions", [
+            ({"result": name}, value) for name, value in rate_limiter.stats.items()
+        ]),
+        ("routing_decisions_total", "counter", "Provider pool routing decisions", [
+            ({"pool": pool, "provider": key.split(":")[0], "reason": key.split(":")[1]}, value)
+            for pool, counters in provider_router.stats.items()
+            for key, value in counters.items()
+        ]),
+        ("tasks_running", "gauge", "Background tasks currently running", [({}, task_manager.stats()["running"])]),
+    ]
+
+
+def _storage_samples() -> List[Sample]:
+    stats = storage_manager.snapshot()
+    last = stats["last_gc"] or {}
+    return [
+        ("storage_bytes", "gauge", "Bytes under the tasks directory by area at the last scan", [
+            ({"area": area}, item["bytes"]) for area, item in last.get("usage", {}).items()
+        ]),
+        ("storage_files", "gauge", "Files under the tasks directory by area at the last scan", [
+            ({"area": area}, item["files"]) for area, item in last.get("usage", {}).items()
+        ]),
+        ("storage_quota_bytes", "gauge", "Configured tasks directory quota (0 means unlimited)", [({}, stats["max_bytes"])]),
+        ("storage_referenced_units", "gauge", "Shared assets currently held by a cache entry or task result", [({}, last.get("referenced", 0))]),
+        ("storage_evictions_total", "counter", "Evicted storage units by area and reason", [
+            ({"area": key.split(":")[0], "reason": key.split(":")[1]}, value) for key, value in stats["evictions"].items()
+        ]),
+        ("storage_evicted_bytes_total", "counter", "Bytes freed by storage garbage collection", [({}, stats["evicted_bytes"])]),
+        ("storage_gc_runs_total", "counter", "Storage garbage collection runs by result", [
+            ({"result": "run"}, stats["runs"]),
+            ({"result": "skipped"}, stats["skipped"]),
+            ({"result": "error"}, stats["errors"]),
+        ]),
+        ("storage_gc_duration_seconds", "gauge", "Duration of the last storage garbage collection", [({}, last.get("duration_ms", 0) / 1000)]),
+    ]
+
+
+registry.collector(_cache_samples)
+registry.collector(_provider_samples)
+registry.collector(_storage_samples)
+
+
+@router.get("/metrics", response_class=Response)
+async def metrics() -> Response:
+    """Prometheus 文本格式的指标"""
+    return Response(registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,9 +1,13 @@
 from fastapi import APIRouter
-from app.api import llm
+from app.api import llm, metrics, storage, task, video
 
 router = APIRouter(
     prefix="/api",
 )
 
 router.include_router(llm.router, prefix="/llm", tags=["llm"])
+router.include_router(task.router, prefix="/task", tags=["task"])
+router.include_router(video.router, prefix="/video", tags=["video"])
+router.include_router(storage.router, prefix="/storage", tags=["storage"])
+router.include_router(metrics.router, tags=["metrics"])
 
@@ -0,0 +1,19 @@
+from typing import Any, Dict
+
+from fastapi import APIRouter
+
+from app.services.storage import storage_manager
+
+router = APIRouter()
+
+
+@router.get("/stats", response_model=Dict[str, Any])
+async def get_storage_stats():
+    """tasks 目录的磁盘占用和清理统计"""
+    return storage_manager.snapshot()
+
+
+@router.post("/gc", response_model=Dict[str, Any])
+async def run_storage_gc():
+    """立即执行一次清理，其他 worker 正在清理时返回 skipped"""
+    return await storage_manager.collect()
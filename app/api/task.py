@@ -0,0 +1,63 @@
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from pydantic import ValidationError
+
+from app.api.deps import admit_client
+from app.models.const import TASK_STATE_PENDING, TASK_STATE_PROCESSING
+from app.schemas.task import (
+    TaskResultResponse,
+    TaskStatusResponse,
+    TaskSubmitRequest,
+    TaskSubmitResponse,
+)
+from app.services.task import task_manager
+from app.utils.static import sign_urls
+
+router = APIRouter()
+
+
+@router.post("", response_model=TaskSubmitResponse, dependencies=[Depends(admit_client)])
+async def submit_task(request: TaskSubmitRequest, x_tenant_id: Optional[str] = Header(default=None)) -> TaskSubmitResponse:
+    """提交后台任务，立即返回任务ID"""
+    try:
+        params = task_manager.validate(request.kind, request.params)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    tenant = request.tenant or x_tenant_id or "default"
+    task_id = await task_manager.submit(request.kind, params, tenant=tenant, priority=request.priority)
+    return TaskSubmitResponse(task_id=task_id)
+
+
+@router.get("/stats", response_model=Dict[str, Any])
+async def get_task_stats():
+    """任务队列运行状态"""
+    return task_manager.stats()
+
+
+@router.get("/{task_id}", response_model=TaskStatusResponse)
+async def get_task(task_id: str) -> TaskStatusResponse:
+    """查询任务状态"""
+    task = await task_manager.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+    return TaskStatusResponse(task_id=task["id"], **{k: v for k, v in task.items() if k in TaskStatusResponse.model_fields})
+
+
+@router.get("/{task_id}/result", response_model=TaskResultResponse)
+async def get_task_result(task_id: str, response: Response) -> TaskResultResponse:
+    """获取任务结果，任务未结束时返回 202"""
+    task = await task_manager.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+    if task["state"] in (TASK_STATE_PENDING, TASK_STATE_PROCESSING):
+        response.status_code = 202
+    return TaskResultResponse(task_id=task_id, state=task["state"], result=sign_urls(task["result"]), error=task["error"])
+
+
+@router.delete("/{task_id}")
+async def cancel_task(task_id: str) -> Dict[str, bool]:
+    """取消排队中或执行中的任务"""
+    if not await task_manager.cancel(task_id):
+        raise HTTPException(status_code=409, detail=f"Task {task_id} is not pending or running")
+    return {"cancelled": True}
@@ -1,8 +1,14 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, Header
+from app.api.deps import admit_client
+from typing import Optional
+from app.models.const import TaskKind
 from app.schemas.video import VideoGenerateRequest, VideoGenerateResponse
+from app.services.task import task_manager
 
 router = APIRouter()
 
-@router.post("/generater",response_class=VideoGenerateResponse)
-async def generater(request: VideoGenerateRequest) -> VideoGenerateResponse:
-    
\ No newline at end of file
+@router.post("/generater",response_model=VideoGenerateResponse, dependencies=[Depends(admit_client)])
+async def generater(request: VideoGenerateRequest, x_tenant_id: Optional[str] = Header(default=None)) -> VideoGenerateResponse:
+    """提交视频生成任务，通过 /api/task/{task_id} 查询进度和结果"""
+    task_id = await task_manager.submit(TaskKind.video, request, tenant=x_tenant_id or "default")
+    return VideoGenerateResponse(success=True, data={"task_id": task_id}, message="video task submitted")
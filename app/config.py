@@ -1,5 +1,33 @@
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Dict, List, Optional
+
+
+class ProviderSettings(BaseModel):
+    """单个供应商的配置"""
+    base_url: str
+    api_key: str = ""
+    # 是否提供文本生成（OpenAI 兼容的 chat.completions 接口）
+    text: bool = True
+    # 图片接口类型：openai / dashscope，None 表示不支持图片
+    image_api: Optional[str] = None
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    http2: bool = True
+    # 同时发往该供应商的最大请求数
+    max_concurrency: int = 16
+    # 是否支持 OpenAI 兼容的离线批处理接口（/v1/files + /v1/batches）
+    batch_api: bool = False
+    # 严格模式下的结构化输出方式：json_schema（response_format 约束解码）/ tools（强制工具调用）/ json_object（不支持约束时）
+    structured_output: str = "json_object"
+
+
+class RateLimit(BaseModel):
+    """每分钟请求数 / token 数，0 表示不限制"""
+    rpm: int = 0
+    tpm: int = 0
+
 
 class Settings(BaseSettings):
     app_name: str = "Story Flicks"
@@ -22,10 +50,161 @@ class Settings(BaseSettings):
     text_llm_model: str = "gpt-4o"
     image_llm_model: str = "dall-e-3"
 
+    # 额外的供应商，环境变量中以 JSON 配置，例如
+    # providers='{"moonshot": {"base_url": "https://api.moonshot.cn/v1", "api_key": "sk-..."}}'
+    # 与内置供应商同名时覆盖内置配置
+    providers: Dict[str, ProviderSettings] = {}
+
+    # 生产环境启动（python serve.py）：监听地址、端口和 worker 进程数，0 表示 CPU 核数
+    server_host: str = "0.0.0.0"
+    server_port: int = 18000
+    server_workers: int = 0
+    # 启动时预先导入供应商 SDK 并建立连接（每个 worker 各自执行），单个供应商最多等待 warmup_timeout 秒
+    warmup: bool = False
+    warmup_timeout: float = 10.0
+
+    # 上游 HTTP 连接池
+    http_keepalive_expiry: float = 30.0
+    http_timeout: float = 120.0
+    # 没有异步客户端的 SDK（dashscope 图片）使用的线程池大小
+    blocking_executor_workers: int = 8
+
+    # 供应商调用：总截止时间、单次尝试超时、重试和退避（秒）
+    llm_deadline: float = 180.0
+    llm_attempt_timeout: float = 90.0
+    llm_max_retries: int = 3
+    llm_backoff_base: float = 0.5
+    llm_backoff_max: float = 8.0
+    # 熔断：连续失败次数阈值和打开后的冷却时间（秒）
+    breaker_failure_threshold: int = 5
+    breaker_reset_timeout: float = 30.0
+    # 对冲请求：主供应商 -> "供应商:模型"，例如 {"openai": "deepseek:deepseek-chat"}；
+    # 主请求超过该供应商 p95 延迟仍未返回时发起，至少需要 hedge_min_samples 个样本
+    hedge_providers: Dict[str, str] = {}
+    hedge_min_samples: int = 20
+
+    # 限流：供应商或 "供应商:模型" -> RateLimit，例如 {"openai": {"rpm": 500, "tpm": 200000}}
+    rate_limits: Dict[str, RateLimit] = {}
+    # 预估 token 时为输出预留的 token 数
+    rate_limit_completion_tokens: int = 1000
+    # 调用方默认每分钟请求数、按 X-API-Key 单独配置的配额和并发上限，rpm 为 0 表示不限制；
+    # 请求头中的 key 在 client_quotas 中配置过时按 key 区分调用方，否则按 IP 区分
+    client_rpm: int = 60
+    client_quotas: Dict[str, int] = {}
+    client_max_concurrency: int = 8
+    # 超出配额时最多排队等待的秒数，超过后返回 429
+    admission_max_wait: float = 5.0
+
+    # 供应商池：请求中的供应商名称为池名时在成员之间路由和故障切换，成员格式 "供应商:模型"，
+    # 例如 {"cheap": ["ollama:qwen2.5", "deepseek:deepseek-chat", "openai:gpt-4o-mini"]}
+    provider_pools: Dict[str, List[str]] = {}
+    # priority: 按池中顺序优先，满载或超配额时溢出到后面的供应商；latency: 按延迟 / 错误率 EWMA 选择
+    routing_strategy: str = "priority"
+    routing_ewma_alpha: float = 0.2
+    # 错误率 EWMA 达到该值的供应商排到健康供应商之后
+    routing_max_error_rate: float = 0.5
+
+    # 日志：enqueue 时由后台线程写日志；log_json 输出结构化 JSON；log_file 为空时只输出到 stderr，
+    # 文件按追加方式写入，轮转交给 logrotate 等外部工具
+    log_level: str = "INFO"
+    log_enqueue: bool = True
+    log_json: bool = False
+    log_file: str = ""
+    # prompt / 响应等大块内容：hash 只记录摘要和长度，full 按采样率记录完整内容，off 不记录
+    log_prompts: str = "hash"
+    log_payload_sample_rate: float = 0.01
+
+    # OpenTelemetry trace 导出地址（OTLP/HTTP，如 http://localhost:4318/v1/traces），为空时不导出
+    otel_endpoint: str = ""
+    otel_service_name: str = "story-generate"
+
+    # 故事提示词模板版本（见 app/services/prompt.py），参与故事缓存 key
+    prompt_version: str = "v2"
+    # 故事主题最多的 token 数，超出部分截断
+    prompt_topic_max_tokens: int = 1000
+
+    # 故事严格模式：按供应商支持的方式使用 JSON Schema 约束输出，默认关闭（请求中的 strict 可以单独开启）；
+    # 场景数不足时最多补生成几次
+    story_strict_output: bool = False
+    story_regenerate_attempts: int = 1
+    # 故事会话：保存的场景可以单独重新生成，超过 story_session_ttl 秒没有修改的会话被清理；
+    # 改写场景时把前后各 story_session_context 个场景作为上下文
+    story_session_ttl: int = 7 * 24 * 3600
+    story_session_context: int = 1
+
+    # 批量生成：单个批量请求最多的条目数和同时生成的故事数
+    batch_max_items: int = 5000
+    batch_concurrency: int = 8
+
+    # 内置的离线假供应商，text_provider / image_provider 设为 fake 时启用，用于本地开发和压测，不访问网络。
+    # 延迟分布 fixed / uniform / lognormal：fake_latency 为中位数（秒），fake_latency_spread 为 uniform 的半宽或 lognormal 的 sigma；
+    # fake_error_rate 为注入 429 / 500 的比例，fake_malformed_rate 为返回格式有问题的 JSON 的比例
+    fake_provider: bool = False
+    fake_latency_distribution: str = "lognormal"
+    fake_latency: float = 0.5
+    fake_latency_spread: float = 0.3
+    fake_image_latency: float = 1.0
+    fake_error_rate: float = 0.0
+    fake_malformed_rate: float = 0.0
+    fake_image_size: int = 256
+    fake_seed: int = 0
+
+    # 故事配图流水线：每个请求的图片 worker 数和待生成队列长度
+    image_pipeline_workers: int = 4
+    image_pipeline_queue_size: int = 10
+
+    # 后台任务：并发 worker 数，单个租户同时运行的任务上限
+    task_workers: int = 4
+    task_max_running_per_tenant: int = 2
+
+    # 视频渲染进程池大小和帧率
+    video_render_workers: int = 2
+    video_fps: int = 24
+
+    # 生成结果缓存
+    cache_enabled: bool = True
+    cache_ttl: int = 7 * 24 * 3600
+    cache_max_entries: int = 1024
+    cache_max_bytes: int = 64 * 1024 * 1024
+    cache_disk_enabled: bool = True
+    # 本地资源：缩略图宽度和处理线程数
+    asset_thumbnail_widths: List[int] = [256, 512]
+    asset_workers: int = 4
+    # /tasks 下文件对外访问的前缀，例如 https://cdn.example.com，为空时返回相对路径
+    asset_base_url: str = ""
+    # 配置后 /tasks 下的文件只能通过带签名且未过期的地址访问，接口返回的地址自动签名，有效期 asset_url_ttl 到 2 倍 asset_url_ttl 秒
+    asset_signing_key: str = ""
+    asset_url_ttl: int = 3600
+    # 预生成的变体：图片同尺寸的 WebP（支持 WebP 的客户端请求原图时返回），视频按高度生成低码率版本，如 [480]
+    asset_webp_variant: bool = False
+    video_variants: List[int] = []
+    video_variant_bitrate: str = "600k"
+    # tasks 目录的容量和清理：storage_max_bytes 为 0 时不限制总大小，超出时按最后访问时间淘汰到 storage_low_watermark 比例；
+    # storage_max_age（秒）为 0 时不按时间清理，否则清理超过这个时间未被访问的文件；最近 storage_min_age 秒内写入的文件不清理
+    storage_max_bytes: int = 0
+    storage_low_watermark: float = 0.9
+    storage_max_age: int = 0
+    storage_min_age: int = 600
+    storage_gc_interval: int = 300
+    # 任务结果引用的图片等资源至少保留的时间（秒）
+    storage_task_ref_ttl: int = 24 * 3600
+
     class Config:
         env_file = ".env"
+
+    def provider_configs(self) -> Dict[str, ProviderSettings]:
+        """内置供应商 + 自定义供应商"""
+        configs = {
+            "openai": ProviderSettings(base_url=self.openai_base_url or "https://api.chatanywhere.tech/v1", api_key=self.openai_api_key, image_api="openai", batch_api=True, structured_output="json_schema"),
+            "aliyun": ProviderSettings(base_url=self.aliyun_base_url or "https://dashscope.aliyuncs.com/compatible-mode/v1", api_key=self.aliyun_api_key, image_api="dashscope"),
+            "deepseek": ProviderSettings(base_url=self.deepseek_base_url or "https://api.deepseek.com/v1", api_key=self.deepseek_api_key),
+            "ollama": ProviderSettings(base_url=self.ollama_base_url or "http://localhost:11434/v1", api_key=self.ollama_api_key),
+        }
+        if self.fake_provider or "fake" in (self.text_provider, self.image_provider):
+            configs["fake"] = ProviderSettings(base_url="fake://local", api_key="fake", image_api="openai", http2=False, max_concurrency=1000, structured_output="json_schema")
+        configs.update(self.providers)
+        return configs
       
 @lru_cache()
 def get_settings() -> Settings:
     return Settings()
-
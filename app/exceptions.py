@@ -2,4 +2,43 @@ class LLMResponseValidationError(Exception):
     """LLM 响应验证错误"""
     def __init__(self, message: str):
         self.message = message
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+class LLMProviderError(Exception):
+    """LLM 供应商未配置或不存在"""
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+class LLMUpstreamError(Exception):
+    """上游供应商返回错误状态"""
+    def __init__(self, message: str, status_code: int = None):
+        self.message = message
+        self.status_code = status_code
+        super().__init__(self.message)
+
+class LLMProviderUnavailableError(Exception):
+    """供应商熔断中或超过截止时间"""
+    def __init__(self, message: str, retry_after: float = None):
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+class StorySessionNotFoundError(Exception):
+    """故事会话或场景不存在（会话可能已过期被清理）"""
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+class StorySessionConflictError(Exception):
+    """故事会话已被其他请求修改"""
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+class RateLimitExceededError(Exception):
+    """超出限流配额"""
+    def __init__(self, message: str, retry_after: float = None):
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(self.message)
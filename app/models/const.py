@@ -16,6 +16,29 @@ class ImageStyle(str, Enum):
     watercolor = "watercolor"  # 水彩风格
     oil_painting = "oil_painting"  # 油画风格
 
+class SegmentStatus(str, Enum):
+    """故事场景配图状态"""
+    pending = "pending"  # 图片生成中
+    success = "success"  # 图片生成成功
+    failed = "failed"  # 图片生成失败
+
+class RegenerateTarget(str, Enum):
+    """重新生成故事场景的哪一部分"""
+    text = "text"  # 只改写文本，保留图片描述和配图
+    image = "image"  # 按原来的图片描述重新生成配图
+    both = "both"  # 改写文本和图片描述，并按新的描述生成配图
+
+class TaskKind(str, Enum):
+    """后台任务类型"""
+    story = "story"  # 生成故事
+    story_with_images = "story_with_images"  # 生成故事和配图
+    video = "video"  # 生成视频
+
+class BatchMode(str, Enum):
+    """批量生成方式"""
+    online = "online"  # 实时并发生成，NDJSON 流式返回
+    offline = "offline"  # 提交到供应商的离线批处理接口，稍后查询结果
+
 class Language(str, Enum):
     """支持的语言"""
     CHINESE_CN = "zh-CN"      # 中文（简体）
@@ -52,9 +75,14 @@ PUNCTUATIONS = [
     "...",
 ]
 
+TASK_STATE_CANCELLED = -2
 TASK_STATE_FAILED = -1
+TASK_STATE_PENDING = 0
 TASK_STATE_COMPLETE = 1
 TASK_STATE_PROCESSING = 4
 
 FILE_TYPE_VIDEOS = ["mp4", "mov", "mkv", "webm"]
 FILE_TYPE_IMAGES = ["jpg", "jpeg", "png", "bmp"]
+
+# serve.py 启动时写入的时间戳（环境变量），多 worker 共享任务库时用于判断哪些处理中的任务是上次退出时遗留的
+SERVER_STARTED_AT_ENV = "STORY_SERVER_STARTED_AT"
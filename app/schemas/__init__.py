@@ -1,2 +1,3 @@
 import app.schemas.video
-import app.schemas.llm
\ No newline at end of file
+import app.schemas.llm
+import app.schemas.task
\ No newline at end of file
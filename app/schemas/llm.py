@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import List, Dict, Any
-from app.models.const import Language
+from app.models.const import BatchMode, Language, RegenerateTarget, SegmentStatus, StoryType
 from typing import Optional
 
 class StoryGenerationRequest(BaseModel):
@@ -12,20 +12,63 @@ class StoryGenerationRequest(BaseModel):
     segments: int = Field(...,ge=1,le=10, description="story segments")
     story_prompt: str = Field(..., min_length=5,max_length=4000,description="story prompt")
     language: Language = Field(default=Language.CHINESE_CN, description="story language")
+    story_type: StoryType = Field(default=StoryType.custom, description="故事类型")
+    strict: Optional[bool] = Field(default=None, description="是否使用 JSON Schema 约束模型输出，为空时使用服务端配置")
+    use_cache: bool = Field(default=True, description="是否读取缓存的生成结果")
 
 class StorySegment(BaseModel):
+    id: Optional[str] = Field(default=None, description="场景ID，保存为故事会话后才有")
     text: str = Field(..., description="story text")
     image_prompt: str = Field(..., description="Image generation prompt")
     url: str = Field(None, description="generation image url")
+    thumbnail_url: Optional[str] = Field(default=None, description="缩略图地址（WebP）")
+    status: Optional[SegmentStatus] = Field(default=None, description="配图状态")
+    error: Optional[str] = Field(default=None, description="配图失败原因")
+    text_ms: Optional[int] = Field(default=None, description="从请求开始到该场景文本生成完成的耗时（毫秒）")
+    image_ms: Optional[int] = Field(default=None, description="配图耗时（毫秒）")
     
 class StoryGenerationResponse(BaseModel):
      segments: List[StorySegment] = Field(..., description="Generated story segments")
+     status: Optional[str] = Field(default=None, description="complete: 全部配图成功, partial: 部分配图失败, failed: 全部配图失败")
+     timings: Optional[Dict[str, Optional[int]]] = Field(default=None, description="各阶段耗时（毫秒）")
+     session_id: Optional[str] = Field(default=None, description="故事会话ID，可用于重新生成部分场景")
+     version: Optional[int] = Field(default=None, description="故事会话版本，每次修改加 1")
+     regenerated: Optional[List[str]] = Field(default=None, description="本次重新生成的场景ID")
+
+class StorySegmentRegenerateRequest(BaseModel):
+    """重新生成故事会话中的部分场景，其他场景及其配图原样保留"""
+    segment_ids: List[str] = Field(..., min_length=1, max_length=10, description="要重新生成的场景ID")
+    target: RegenerateTarget = Field(default=RegenerateTarget.both, description="text: 只改写文本, image: 只重新生成配图, both: 改写文本和图片描述并重新生成配图")
+    instruction: Optional[str] = Field(default=None, max_length=1000, description="改写要求，只用于文本")
+    version: Optional[int] = Field(default=None, description="客户端看到的会话版本，与当前版本不一致时返回 409")
+
+class StoryBatchRequest(BaseModel):
+    """批量生成故事，相同的请求只生成一次"""
+    requests: List[StoryGenerationRequest] = Field(..., min_length=1, description="故事生成请求列表")
+    concurrency: Optional[int] = Field(default=None, ge=1, description="同时生成的故事数，不超过服务端配置")
+    mode: BatchMode = Field(default=BatchMode.online, description="online: 实时生成并流式返回, offline: 提交到供应商离线批处理")
+
+class StoryBatchSubmitResponse(BaseModel):
+    """离线批处理提交结果"""
+    batch_id: str = Field(..., description="供应商的批处理ID")
+    provider: str = Field(..., description="文本模型供应商")
+    total: int = Field(..., description="请求条数")
+    submitted: int = Field(..., description="去重并排除已缓存后实际提交的条数")
+    status: str = Field(..., description="供应商返回的批处理状态")
+
+class StoryBatchResultResponse(BaseModel):
+    """离线批处理结果，未完成时 results 为空"""
+    batch_id: str
+    status: str = Field(..., description="供应商返回的批处理状态，completed 时 results 可用")
+    results: List[Dict[str, Any]] = Field(default_factory=list, description="按输入序号排列，每项为 {index, segments} 或 {index, error}")
 
 class ImageGenerationRequest(BaseModel):
     resolution: Optional[str] = Field(default="1024*1024", description="分辨率")
     image_llm_provider: Optional[str] = Field(default=None, description="图像模型供应商")
     image_llm_model: Optional[str] = Field(default=None, description="图像模型名称")
     prompt: str = Field(..., min_length=20,max_length=4000,description="story prompt")
+    use_cache: bool = Field(default=True, description="是否读取缓存的生成结果")
 
 class ImageGenerationResponse(BaseModel):
-    image_url: str = Field(..., description="generation image url")
\ No newline at end of file
+    image_url: str = Field(..., description="generation image url")
+    thumbnail_url: Optional[str] = Field(default=None, description="缩略图地址（WebP）")
\ No newline at end of file
@@ -0,0 +1,32 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Optional
+from app.models.const import TaskKind
+
+
+class TaskSubmitRequest(BaseModel):
+    """提交后台任务"""
+    kind: TaskKind = Field(..., description="任务类型")
+    params: Dict[str, Any] = Field(..., description="任务参数，与对应同步接口的请求体一致")
+    priority: int = Field(default=0, ge=-10, le=10, description="优先级，越大越先执行")
+    tenant: Optional[str] = Field(default=None, max_length=64, description="租户，为空时使用请求头 X-Tenant-Id")
+
+class TaskSubmitResponse(BaseModel):
+    task_id: str = Field(..., description="任务ID")
+
+class TaskStatusResponse(BaseModel):
+    """任务状态"""
+    task_id: str
+    kind: TaskKind
+    state: int = Field(..., description="-2: 已取消, -1: 失败, 0: 排队中, 1: 完成, 4: 处理中")
+    tenant: str
+    priority: int
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+class TaskResultResponse(BaseModel):
+    task_id: str
+    state: int
+    result: Optional[Any] = None
+    error: Optional[str] = None
@@ -1,6 +1,7 @@
 from pydantic import BaseModel,Field
-from typing import Optional,Dict,Any
-from app.models.const import Language, ImageStyle
+from typing import Optional,Dict,Any,List
+from app.models.const import Language, ImageStyle, StoryType
+from app.schemas.llm import StorySegment
 
 
 class VideoGenerateRequest(BaseModel):
@@ -10,14 +11,16 @@ class VideoGenerateRequest(BaseModel):
     text_llm_model: Optional[str] = Field(default=None, description="Text LLM model")
     image_llm_model: Optional[str] = Field(default=None, description="Image LLM model")
     test_mode: bool = Field(default=False, description="是否为测试模式")
-    task_id: Optional[str] = Field(default=None, description="任务ID")
+    task_id: Optional[str] = Field(default=None, pattern=r"^[A-Za-z0-9_-]{1,64}$", description="任务ID（后台任务中由服务端生成，忽略传入的值）")
     segments: int = Field(default=3, ge=1, le=10, description="分段数量")
     language: Language = Field(default=Language.CHINESE_CN, description="故事语言")
+    story_type: StoryType = Field(default=StoryType.custom, description="故事类型")
     story_prompt: Optional[str] = Field(default=None, description="故事提示词")
     image_style: ImageStyle = Field(default=ImageStyle.realistic, description="图片风格")
     voice_name: str = Field(default="zh-CN-XiaoxiaoNeural", description="语音名称")
-    voice_rate: float = Field(default=1.0, description="语音速率")
+    voice_rate: float = Field(default=1.0, gt=0, le=3.0, description="语音速率，1.0 为正常语速")
     resolution: Optional[str] = Field(default="1024*1024", description="分辨率")
+    story_segments: Optional[List[StorySegment]] = Field(default=None, description="已有的故事场景，传入时不再生成故事；场景带 url（本服务生成的 /tasks 图片地址）时直接使用该图片，只修改部分场景时其余场景的片段会被复用")
 
 class VideoGenerateResponse(BaseModel):
     """视频生成响应"""
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import io
+import mimetypes
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from app.config import get_settings
+from app.services.provider import provider_registry
+from app.services.storage import storage_manager
+from app.utils.utils import get_uuid, task_path, task_url
+
+settings = get_settings()
+
+# 资源文件名：<sha256>.<ext> 或缩略图 <sha256>.<宽度>.webp
+ASSET_NAME = re.compile(r"^(?P<hash>[0-9a-f]{64})(\.(?P<width>\d+))?\.\w+$")
+
+
+class AssetStore:
+    """本地资源存储
+
+    生成的图片下载一次后按内容 sha256 存放在 tasks/assets/<hash[:2]>/<hash>.<ext>，
+    内容相同的图片只保存一份，并预生成 WebP 缩略图（asset_webp_variant 时还有同尺寸的 WebP）。文件名即内容哈希，
+    通过 /tasks 静态目录以强 ETag 和长期缓存返回。
+    同一份资源可能被多个缓存条目和任务结果引用，由 StorageManager 按引用计数清理。
+    """
+
+    def __init__(self, thumbnail_widths: List[int], workers: int):
+        self.thumbnail_widths = thumbnail_widths
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="asset")
+        self.stats = {"downloads": 0, "download_errors": 0, "dedup_hits": 0, "thumbnails": 0}
+
+    def _path(self, digest: str, ext: str) -> str:
+        return os.path.join(storage_manager.shard_dir("assets", digest), f"{digest}{ext}")
+
+    async def store_url(self, url: str) -> str:
+        """下载并保存资源，返回本地访问地址；已经是本地资源时直接返回"""
+        if task_path(url) is not None:
+            return url
+        resp = await provider_registry.download_client().get(url)
+        resp.raise_for_status()
+        self.stats["downloads"] += 1
+        content_type = resp.headers.get("content-type", "").split(";")[0]
+        return await self.store_bytes(resp.content, mimetypes.guess_extension(content_type) or ".png")
+
+    async def store_bytes(self, data: bytes, ext: str) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest, ext)
+        if os.path.exists(path):
+            self.stats["dedup_hits"] += 1
+            storage_manager.touch(path)
+        else:
+            await self._run(_write_atomic, path, data)
+            if ext in (".png", ".jpg", ".jpeg", ".webp"):
+                await self._make_thumbnails(path, digest)
+        return task_url(path)
+
+    def thumbnail_url(self, url: str, width: int) -> Optional[str]:
+        """资源地址对应的缩略图地址，不是本地资源或缩略图不存在时返回 None"""
+        path = task_path(url)
+        if path is None:
+            return None
+        match = ASSET_NAME.match(os.path.basename(path))
+        if match is None:
+            return None
+        thumb = self._path(match.group("hash"), f".{width}.webp")
+        return task_url(thumb) if os.path.exists(thumb) else None
+
+    async def _make_thumbnails(self, path: str, digest: str) -> None:
+        targets = [(width, self._path(digest, f".{width}.webp")) for width in self.thumbnail_widths]
+        if settings.asset_webp_variant and not path.endswith(".webp"):
+            # 同尺寸的 WebP，/tasks 对支持 WebP 的客户端返回它
+            targets.append((0, self._path(digest, ".webp")))
+        try:
+            await self._run(_write_thumbnails, path, targets)
+            self.stats["thumbnails"] += len(targets)
+        except Exception as e:
+            # 缩略图失败不影响原图
+            logger.warning(f"Failed to create thumbnails for {path}: {e}")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self.stats)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = f"{path}.{get_uuid(True)}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _write_thumbnails(path: str, targets: List[tuple]) -> None:
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image = image.convert("RGB")
+        for width, target in targets:
+            if width and image.width > width:
+                thumb = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+            else:
+                thumb = image
+            buf = io.BytesIO()
+            thumb.save(buf, format="WEBP", quality=80)
+            _write_atomic(target, buf.getvalue())
+
+
+asset_store = AssetStore(settings.asset_thumbnail_widths, settings.asset_workers)
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.config import get_settings
+from app.exceptions import LLMProviderError, LLMResponseValidationError
+from app.schemas.llm import StoryGenerationRequest
+from app.services.cache import generation_cache
+from app.services.llm import llm_service
+from app.services.provider import provider_registry
+from app.services.routing import provider_router
+from app.utils.json_repair import repair_json
+from app.utils.utils import state_dir
+
+settings = get_settings()
+
+# 批处理输出中无法解析的行里的 custom_id
+_CUSTOM_ID = re.compile(r'"custom_id"\s*:\s*"([^"]+)"')
+
+
+def _group(requests: List[StoryGenerationRequest]) -> Tuple[List[Tuple[str, StoryGenerationRequest]], Dict[str, List[int]]]:
+    """按缓存 key 去重，返回 [(key, 请求)] 和 key -> 输入序号列表"""
+    unique, indexes = [], {}
+    for index, request in enumerate(requests):
+        key = llm_service._story_cache_key(request)
+        if key not in indexes:
+            indexes[key] = []
+            unique.append((key, request))
+        indexes[key].append(index)
+    return unique, indexes
+
+
+async def stream_story_batch(requests: List[StoryGenerationRequest], concurrency: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    批量生成故事，按完成顺序返回
+
+    相同的请求只生成一次，结果按输入序号分别返回；固定数量的 worker 从队列中取请求，
+    调用方断开时取消未完成的生成。
+
+    Args:
+        requests (List[StoryGenerationRequest]): 故事生成请求列表
+        concurrency (Optional[int]): 同时生成的故事数，不超过 settings.batch_concurrency
+
+    Yields:
+        Dict[str, Any]: {"event": "result", "index", "segments"} 或 {"event": "error", "index", "message"}，
+            最后是 {"event": "summary", ...}
+    """
+    start = time.perf_counter()
+    unique, indexes = _group(requests)
+    concurrency = min(concurrency or settings.batch_concurrency, settings.batch_concurrency, len(unique))
+    jobs: asyncio.Queue = asyncio.Queue()
+    for item in unique:
+        jobs.put_nowait(item)
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def worker() -> None:
+        while True:
+            try:
+                key, request = jobs.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                segments = await llm_service.generate_story(request)
+                await results.put((key, segments, None))
+            except Exception as e:
+                await results.put((key, None, e))
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    succeeded = failed = 0
+    try:
+        for _ in range(len(unique)):
+            key, segments, error = await results.get()
+            for index in indexes[key]:
+                if error is None:
+                    succeeded += 1
+                    yield {"event": "result", "index": index, "segments": segments}
+                else:
+                    failed += 1
+                    yield {"event": "error", "index": index, "message": str(error)}
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    elapsed_ms = int((time.perf_counter() - start) * 1000)
+    logger.info(f"story batch finished: {len(requests)} requests, {len(unique)} unique, {failed} failed, {elapsed_ms}ms")
+    yield {"event": "summary", "total": len(requests), "unique": len(unique), "succeeded": succeeded, "failed": failed, "elapsed_ms": elapsed_ms}
+
+
+def _manifest_path(batch_id: str) -> str:
+    return os.path.join(state_dir("batches"), f"{os.path.basename(batch_id)}.json")
+
+
+async def submit_offline_batch(requests: List[StoryGenerationRequest]) -> Dict[str, Any]:
+    """
+    提交到供应商的离线批处理接口（OpenAI 兼容的 /v1/files + /v1/batches），价格更低但结果最长 24 小时返回
+
+    所有请求必须使用同一个支持批处理的供应商；已缓存的请求不再提交，查询结果时直接从缓存读取。
+
+    Returns:
+        Dict[str, Any]: batch_id, provider, total, submitted, status
+    """
+    providers = {request.text_llm_provider or settings.text_provider for request in requests}
+    if len(providers) != 1:
+        raise LLMProviderError("Offline batch requires all requests to use the same text provider")
+    provider = providers.pop()
+    if provider_router.is_pool(provider) or not provider_registry.config(provider).batch_api:
+        raise LLMProviderError(f"Provider {provider} does not support offline batch")
+
+    unique, indexes = _group(requests)
+    lines, cached = [], {}
+    for key, request in unique:
+        if request.use_cache and await generation_cache.get("story", key) is not None:
+            cached[key] = indexes[key]
+            continue
+        lines.append(json.dumps({
+            "custom_id": key,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": request.text_llm_model or settings.text_llm_model,
+                "messages": llm_service._build_story_messages(request),
+                **llm_service._output_format(provider, "json_object", llm_service._story_schema(request)),
+            },
+        }, ensure_ascii=False))
+
+    manifest = {
+        "provider": provider,
+        "total": len(requests),
+        "indexes": indexes,
+        "segments": {key: request.segments for key, request in unique},
+        "cached": list(cached),
+    }
+    if not lines:
+        # 全部命中缓存，不需要提交
+        batch_id, status = f"cached-{generation_cache.key('batch', keys=sorted(indexes))[:32]}", "completed"
+    else:
+        client = provider_registry.text_client(provider)
+        file = await client.files.create(file=("stories.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+        batch = await client.batches.create(input_file_id=file.id, endpoint="/v1/chat/completions", completion_window="24h")
+        batch_id, status = batch.id, batch.status
+    await asyncio.to_thread(_write_json, _manifest_path(batch_id), manifest)
+    logger.info(f"submitted offline story batch {batch_id} to {provider}: {len(lines)}/{len(requests)} requests")
+    return {"batch_id": batch_id, "provider": provider, "total": len(requests), "submitted": len(lines), "status": status}
+
+
+async def get_offline_batch(batch_id: str) -> Optional[Dict[str, Any]]:
+    """
+    查询离线批处理，完成后解析结果、写入缓存并按输入序号返回
+
+    Returns:
+        Optional[Dict[str, Any]]: batch_id, status, results；批处理不存在时返回 None
+    """
+    path = _manifest_path(batch_id)
+    if not os.path.exists(path):
+        return None
+    manifest = await asyncio.to_thread(_read_json, path)
+    outputs: Dict[str, Any] = {}
+    status = "completed"
+    if len(manifest["cached"]) < len(manifest["indexes"]):
+        client = provider_registry.text_client(manifest["provider"])
+        batch = await client.batches.retrieve(batch_id)
+        status = batch.status
+        if status != "completed":
+            return {"batch_id": batch_id, "status": status, "results": []}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = await client.files.content(file_id)
+                outputs.update(await _parse_batch_output(content.text, manifest.get("segments", {})))
+
+    results = []
+    for key, indexes in manifest["indexes"].items():
+        if key in outputs:
+            outcome = outputs[key]
+        else:
+            segments = await generation_cache.get("story", key)
+            outcome = {"segments": segments} if segments is not None else {"error": "missing from batch output"}
+        results.extend({"index": index, **outcome} for index in indexes)
+    results.sort(key=lambda item: item["index"])
+    return {"batch_id": batch_id, "status": status, "results": results}
+
+
+async def _parse_batch_output(text: str, segments_by_key: Dict[str, int]) -> Dict[str, Dict[str, Any]]:
+    """解析批处理输出文件，每行一个请求的响应，成功的结果写入缓存"""
+    outputs = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        key = None
+        try:
+            item = json.loads(line)
+            key = item["custom_id"]
+            if item.get("error"):
+                raise LLMProviderError(item["error"].get("message", str(item["error"])))
+            body = item["response"]["body"]
+            if item["response"].get("status_code", 200) != 200:
+                raise LLMProviderError(body.get("error", {}).get("message", str(body)))
+            message = body["choices"][0]["message"]
+            content = message["tool_calls"][0]["function"]["arguments"] if message.get("tool_calls") else message["content"]
+            try:
+                data = json.loads(content)
+            except ValueError:
+                data = repair_json(content)
+            # 离线批处理无法补生成缺少的场景，只做本地修复
+            segments, _ = llm_service.repair_story(data, segments_by_key.get(key, sys.maxsize))
+            if not segments:
+                raise LLMResponseValidationError("Model output contains no valid story segment")
+            llm_service._validate_story_response(segments)
+        except (LLMProviderError, LLMResponseValidationError, KeyError, ValueError, TypeError) as e:
+            if key is None:
+                # 这一行本身无法解析时尽量取出 custom_id，只把对应的条目标记为失败
+                match = _CUSTOM_ID.search(line)
+                if match is None:
+                    logger.warning(f"Skipping unreadable batch output line: {e}")
+                    continue
+                key = match.group(1)
+            outputs[key] = {"error": str(e)}
+            continue
+        await generation_cache.set("story", key, segments)
+        outputs[key] = {"segments": segments}
+    return outputs
+
+
+def _read_json(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
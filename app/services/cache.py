@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from loguru import logger
+
+from app.config import get_settings
+from app.services.storage import storage_manager
+from app.utils.utils import get_uuid
+
+settings = get_settings()
+
+
+class GenerationCache:
+    """生成结果缓存
+
+    以规范化请求参数的 sha256 作为 key，分两级：
+    - 内存 LRU：按条数和总字节数淘汰，带 TTL
+    - 磁盘：tasks/cache/<kind>/<key[:2]>/<key>.json，重启后仍然有效
+    图片缓存的是本地资源地址（见 AssetStore），而不是供应商会过期的 URL；
+    缓存条目持有它引用的资源，条目过期或被清理之前资源不会被 StorageManager 清理。
+    """
+
+    def __init__(self, *, ttl: int, max_entries: int, max_bytes: int, disk_enabled: bool = True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_enabled = disk_enabled
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._memory_bytes = 0
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bypass": 0,
+            "writes": 0,
+            "evictions": 0,
+        }
+
+    @staticmethod
+    def key(kind: str, **params: Any) -> str:
+        """规范化参数后计算 key，字符串去掉首尾空白，枚举取值"""
+        normalized = {}
+        for k, v in params.items():
+            if hasattr(v, "value"):
+                v = v.value
+            if isinstance(v, str):
+                v = v.strip()
+            normalized[k] = v
+        raw = json.dumps({"kind": kind, **normalized}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, kind: str, key: str) -> str:
+        return os.path.join(storage_manager.shard_dir(f"cache/{kind}", key), f"{key}.json")
+
+    @staticmethod
+    def _owner(kind: str, key: str) -> str:
+        return f"cache:{kind}:{key}"
+
+    async def get(self, kind: str, key: str) -> Optional[Any]:
+        if not settings.cache_enabled:
+            return None
+        now = time.time()
+        item = self._memory.get(key)
+        if item is not None:
+            expires_at, raw = item
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                if self.disk_enabled:
+                    storage_manager.touch_key(f"cache/{kind}", key)
+                return json.loads(raw)
+            self._evict(key)
+
+        if self.disk_enabled:
+            entry = await asyncio.to_thread(self._read_disk, kind, key)
+            if entry is not None and entry["expires_at"] > now:
+                self.stats["disk_hits"] += 1
+                storage_manager.touch_key(f"cache/{kind}", key)
+                raw = json.dumps(entry["value"], ensure_ascii=False)
+                self._put_memory(key, entry["expires_at"], raw)
+                return entry["value"]
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, kind: str, key: str, value: Any) -> None:
+        if not settings.cache_enabled:
+            return
+        expires_at = time.time() + self.ttl
+        raw = json.dumps(value, ensure_ascii=False)
+        self._put_memory(key, expires_at, raw)
+        if self.disk_enabled:
+            try:
+                await asyncio.to_thread(self._write_disk, kind, key, {"expires_at": expires_at, "value": value})
+            except OSError as e:
+                logger.warning(f"Failed to write cache file for {key}: {e}")
+            else:
+                storage_manager.retain_all(value, self._owner(kind, key), self.ttl)
+        self.stats["writes"] += 1
+
+    def bypass(self) -> None:
+        """记录一次调用方要求跳过缓存"""
+        self.stats["bypass"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {
+            **self.stats,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+        }
+
+    def _put_memory(self, key: str, expires_at: float, raw: str) -> None:
+        if key in self._memory:
+            self._evict(key)
+        size = len(raw)
+        if size > self.max_bytes:
+            return
+        self._memory[key] = (expires_at, raw)
+        self._memory_bytes += size
+        while len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes:
+            oldest = next(iter(self._memory))
+            self._evict(oldest)
+            self.stats["evictions"] += 1
+
+    def _evict(self, key: str) -> None:
+        _, raw = self._memory.pop(key)
+        self._memory_bytes -= len(raw)
+
+    def _read_disk(self, kind: str, key: str) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(kind, key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Broken cache file {path}: {e}")
+            return None
+        if entry["expires_at"] <= time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            storage_manager.release(self._owner(kind, key))
+            return None
+        return entry
+
+    def _write_disk(self, kind: str, key: str, entry: Dict[str, Any]) -> None:
+        path = self._disk_path(kind, key)
+        tmp = f"{path}.{get_uuid(True)}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+
+
+generation_cache = GenerationCache(
+    ttl=settings.cache_ttl,
+    max_entries=settings.cache_max_entries,
+    max_bytes=settings.cache_max_bytes,
+    disk_enabled=settings.cache_disk_enabled,
+)
@@ -0,0 +1,223 @@
+"""内置的离线假供应商
+
+text_provider / image_provider 设为 fake 时使用，接口与 AsyncOpenAI 相同（chat.completions、images），
+不访问网络：按配置的延迟分布等待后返回合法的故事 JSON，按比例注入上游错误和格式有问题的输出，
+图片是本地生成的纯色占位图。相同的请求（包括第几次重试）得到相同的延迟、错误和输出，结果可以复现。
+"""
+import asyncio
+import hashlib
+import io
+import json
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+import openai
+from openai.types import ImagesResponse
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from PIL import Image
+
+from app.config import get_settings
+from app.services.asset import asset_store
+from app.utils.tokens import count_tokens
+
+settings = get_settings()
+
+FAKE_BASE_URL = "fake://local"
+
+# 格式有问题的输出类型，覆盖 json_repair 和 repair_story 能处理的情况
+MALFORMED_KINDS = ("fence", "prose", "trailing_comma", "truncated", "aliases", "short")
+# 约束解码（json_schema / tools）下语法总是合法的，只可能场景数不足
+CONSTRAINED_MALFORMED_KINDS = ("short",)
+
+
+def placeholder_png(seed: str, size: int = 64) -> bytes:
+    """按 seed 生成纯色占位图"""
+    digest = hashlib.md5(seed.encode("utf-8")).digest()
+    buf = io.BytesIO()
+    Image.new("RGB", (size, size), tuple(digest[:3])).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def sample_latency(rng: random.Random, median: float) -> float:
+    """
+    按 fake_latency_distribution 采样一次延迟（秒）
+
+    Args:
+        rng (random.Random): 随机数生成器
+        median (float): 中位数；fixed 时即为延迟
+    """
+    spread = settings.fake_latency_spread
+    distribution = settings.fake_latency_distribution
+    if median <= 0:
+        return 0.0
+    if distribution == "uniform":
+        return max(0.0, rng.uniform(median - spread, median + spread))
+    if distribution == "lognormal":
+        # 中位数为 median，sigma 为 spread，长尾接近真实的模型延迟
+        return rng.lognormvariate(0, spread) * median if spread > 0 else median
+    return median
+
+
+class FakeProvider:
+    """请求级别的随机数：按 seed + 请求内容 + 第几次调用派生，与并发下的调用顺序无关"""
+
+    def __init__(self):
+        self._calls: Dict[str, int] = {}
+        self.stats = {"calls": 0, "errors": 0, "malformed": 0, "images": 0}
+
+    def rng(self, kind: str, payload: Any) -> random.Random:
+        digest = hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        key = f"{kind}:{digest}"
+        if len(self._calls) >= 100_000:
+            # 只用于区分同一请求的重试，压测时不让计数无限增长
+            self._calls.clear()
+        n = self._calls.get(key, 0)
+        self._calls[key] = n + 1
+        self.stats["calls"] += 1
+        return random.Random(f"{settings.fake_seed}:{key}:{n}")
+
+    def maybe_fail(self, rng: random.Random, path: str) -> None:
+        """按 fake_error_rate 抛出与真实 SDK 相同类型的 429 / 500 错误，可以被重试"""
+        if rng.random() >= settings.fake_error_rate:
+            return
+        self.stats["errors"] += 1
+        request = httpx.Request("POST", f"{FAKE_BASE_URL}{path}")
+        if rng.random() < 0.5:
+            response = httpx.Response(429, headers={"retry-after": "0.1"}, request=request)
+            raise openai.RateLimitError("injected rate limit", response=response, body=None)
+        raise openai.InternalServerError("injected server error", response=httpx.Response(500, request=request), body=None)
+
+
+fake_provider = FakeProvider()
+
+
+def _scene_count(messages: List[Dict[str, Any]]) -> int:
+    """从提示词中取要求的场景数，补生成时取缺少的场景数"""
+    content = str(messages[-1].get("content", ""))
+    match = (re.search(r"remaining (\d+) scenes", content) or re.search(r"divided into (\d+) scenes", content)
+             or re.search(r"exactly (\d+) rewritten scenes", content))
+    return int(match.group(1)) if match else 3
+
+
+def _topic(messages: List[Dict[str, Any]]) -> str:
+    for message in messages:
+        if message.get("role") == "user":
+            match = re.search(r"(?:Topic: |主题是:)(.*)", str(message.get("content", "")))
+            if match:
+                return match.group(1).strip()[:80]
+    return "a story"
+
+
+def story_scenes(messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    topic = _topic(messages)
+    content = str(messages[-1].get("content", ""))
+    rewrite = re.search(r"Rewrite scenes ([\d, ]+) so", content)
+    if rewrite:
+        # 改写部分场景时按要求的场景编号返回
+        return [
+            {"text": f"Scene {n} of the story about {topic}, rewritten.", "image_prompt": f"A fresh, colorful illustration of scene {n}: {topic}"}
+            for n in (int(number) for number in rewrite.group(1).split(","))
+        ]
+    # 补生成时从缺少的第一个场景开始编号
+    match = re.search(r"\(scenes (\d+) to", content)
+    first = int(match.group(1)) if match else 1
+    return [
+        {"text": f"Scene {n} of the story about {topic}.", "image_prompt": f"A calm, colorful illustration of scene {n}: {topic}"}
+        for n in range(first, first + _scene_count(messages))
+    ]
+
+
+def _malformed(kind: str, scenes: List[Dict[str, str]]) -> str:
+    """生成一种常见的问题输出"""
+    if kind == "fence":
+        return "```json\n" + json.dumps({"list": scenes}, ensure_ascii=False) + "\n```"
+    if kind == "prose":
+        return "Here is your story:\n" + json.dumps({"list": scenes}, ensure_ascii=False) + "\nHope you enjoy it!"
+    if kind == "trailing_comma":
+        return json.dumps({"list": scenes}, ensure_ascii=False)[:-2] + ",]}"
+    if kind == "truncated":
+        text = json.dumps({"list": scenes}, ensure_ascii=False)
+        return text[:int(len(text) * 0.8)]
+    if kind == "aliases":
+        return json.dumps({"scenes": [{"content": s["text"], "prompt": s["image_prompt"]} for s in scenes]}, ensure_ascii=False)
+    # short: 少一半场景
+    return json.dumps({"list": scenes[:max(1, len(scenes) // 2)]}, ensure_ascii=False)
+
+
+class _Completions:
+    async def create(self, *, model: str, messages: List[Dict[str, Any]], stream: bool = False, tools: Optional[List[Dict[str, Any]]] = None, response_format: Optional[Dict[str, Any]] = None, **kwargs) -> Any:
+        rng = fake_provider.rng("text", {"model": model, "messages": messages})
+        delay = sample_latency(rng, settings.fake_latency)
+        if not stream:
+            await asyncio.sleep(delay)
+        fake_provider.maybe_fail(rng, "/chat/completions")
+
+        scenes = story_scenes(messages)
+        constrained = bool(tools) or (response_format or {}).get("type") == "json_schema"
+        if rng.random() < settings.fake_malformed_rate:
+            fake_provider.stats["malformed"] += 1
+            content = _malformed(rng.choice(CONSTRAINED_MALFORMED_KINDS if constrained else MALFORMED_KINDS), scenes)
+        else:
+            content = json.dumps({"list": scenes}, ensure_ascii=False)
+
+        prompt_tokens = sum(count_tokens(str(message.get("content", ""))) for message in messages)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": count_tokens(content), "total_tokens": prompt_tokens + count_tokens(content)}
+        if stream:
+            return self._stream(model, content, bool(tools), delay)
+        message: Dict[str, Any] = {"role": "assistant", "content": content}
+        if tools:
+            name = tools[0]["function"]["name"]
+            message = {"role": "assistant", "content": None, "tool_calls": [{"id": "call_fake", "type": "function", "function": {"name": name, "arguments": content}}]}
+        return ChatCompletion.model_validate({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    async def _stream(self, model: str, content: str, tool_call: bool, delay: float, size: int = 16) -> AsyncIterator[ChatCompletionChunk]:
+        """把延迟平摊到各个分片上"""
+        pieces = [content[i:i + size] for i in range(0, len(content), size)] or [""]
+        for i, piece in enumerate(pieces):
+            await asyncio.sleep(delay / len(pieces))
+            if tool_call:
+                delta = {"tool_calls": [{"index": 0, "id": "call_fake" if i == 0 else None, "type": "function", "function": {"arguments": piece}}]}
+            else:
+                delta = {"content": piece}
+            yield ChatCompletionChunk.model_validate({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": "stop" if i == len(pieces) - 1 else None}],
+            })
+
+
+class _Chat:
+    def __init__(self):
+        self.completions = _Completions()
+
+
+class _Images:
+    async def generate(self, *, model: str, prompt: str, size: str = "1024x1024", **kwargs) -> ImagesResponse:
+        rng = fake_provider.rng("image", {"model": model, "prompt": prompt})
+        await asyncio.sleep(sample_latency(rng, settings.fake_image_latency))
+        fake_provider.maybe_fail(rng, "/images/generations")
+        width = int(re.split(r"[x*]", size)[0]) if re.match(r"^\d+[x*]\d+$", size or "") else 1024
+        data = await asyncio.to_thread(placeholder_png, prompt, min(width, settings.fake_image_size))
+        fake_provider.stats["images"] += 1
+        url = await asset_store.store_bytes(data, ".png")
+        return ImagesResponse.model_validate({"created": int(time.time()), "data": [{"url": url}]})
+
+
+class FakeClient:
+    """与 AsyncOpenAI 相同的调用方式，只实现本项目用到的接口"""
+
+    def __init__(self):
+        self.chat = _Chat()
+        self.images = _Images()
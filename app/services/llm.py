@@ -1,127 +1,397 @@
 import json
 from app.config import get_settings
-from openai import OpenAI
-import dashscope
+from app.services.provider import provider_registry
+from app.services.cache import generation_cache
+from app.utils.singleflight import SingleFlight
+from app.utils.json_stream import StoryListParser
+from app.services.asset import asset_store
+from app.services.resilience import resilience
+from app.services.ratelimit import rate_limiter, estimate_tokens
+from app.services.routing import provider_router
+from app.services.prompt import STORY_SCHEMA, story_continue_message, story_messages, story_rewrite_messages
+from app.utils.utils import task_path
+from app.utils.log import log_payload
+from app.utils.metrics import IMAGE_FAILURES, OUTPUT_REPAIRS, STAGE_DURATION, STORY_OUTPUTS, TOKENS, span, upstream_call
+from app.utils.json_repair import repair_json
 from app.schemas.llm import StoryGenerationRequest
-from typing import List, Dict, Any
-from app.models.const import Language,LANGUAGE_NAMES
+from typing import List, Dict, Any, AsyncIterator, Awaitable, Callable, Optional, Tuple
+from app.models.const import SegmentStatus
 from loguru import logger
-from app.exceptions import LLMResponseValidationError
-from dashscope import ImageSynthesis
+from app.exceptions import LLMResponseValidationError, LLMProviderError, LLMUpstreamError
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
 import asyncio
+import copy
+import time
+import hashlib
+import os
 
 
 settings = get_settings()
-openai_client = None
-aliyun_text_client = None
-if settings.openai_api_key:
-    openai_client = OpenAI(api_key=settings.openai_api_key, base_url=settings.openai_base_url or "https://api.chatanywhere.tech/v1")
 
-if settings.aliyun_api_key:
-    dashscope.api_key = settings.aliyun_api_key
-    aliyun_text_client = OpenAI(api_key=settings.aliyun_api_key, base_url=settings.aliyun_base_url  or "https://dashscope.aliyuncs.com/compatible-mode/v1")
+# dashscope 的图片接口只有同步实现，放到有界线程池里执行，不阻塞事件循环
+blocking_executor = ThreadPoolExecutor(max_workers=settings.blocking_executor_workers, thread_name_prefix="llm-blocking")
 
-if settings.deepseek_api_key:
-    deepseek_client = OpenAI(api_key=settings.deepseek_api_key, base_url=settings.deepseek_base_url or "https://api.deepseek.com/v1")
+def images_status(segments: List[Dict[str, Any]]) -> str:
+    """故事配图的整体状态：complete 全部成功，partial 部分失败，failed 全部失败"""
+    failed = sum(1 for segment in segments if segment["status"] == SegmentStatus.failed)
+    if failed == 0:
+        return "complete"
+    if failed < len(segments):
+        return "partial"
+    return "failed"
 
-if settings.ollama_api_key:
-    ollama_client = OpenAI(api_key=settings.ollama_api_key, base_url=settings.ollama_base_url or "http://localhost:11434/v1")
 
 class LLMService:
     def __init__(self):
-        self.openai_client = openai_client
-        self.aliyun_text_client = aliyun_text_client
+        self.providers = provider_registry
+        # 合并并发的相同请求，key 与缓存 key 一致
+        self.flight = SingleFlight()
         self.text_llm_model = settings.text_llm_model
         self.image_llm_model = settings.image_llm_model
     
     def get_llm_providers(self) -> Dict[str, List[str]]:
-        imgLLMList = []
-        textLLMList = []
-        if settings.openai_api_key:
-            textLLMList.append("openai")
-            imgLLMList.append("openai")
-        if settings.aliyun_api_key:
-            textLLMList.append("aliyun")
-            imgLLMList.append("aliyun")
-        if settings.deepseek_api_key:
-            textLLMList.append("deepseek")
-        if settings.ollama_api_key:
-            textLLMList.append("ollama")
-        return { "textLLMProviders": textLLMList, "imageLLMProviders": imgLLMList }
-
-
-    async def generate_story_with_images(self, request: StoryGenerationRequest) -> List[Dict[str, Any]]: 
+        return { "textLLMProviders": self.providers.text_providers(), "imageLLMProviders": self.providers.image_providers(), "providerPools": provider_router.pools() }
+
+    async def warmup(self) -> None:
+        """预热默认的文本和图片供应商（供应商池时预热所有成员）"""
+        names = []
+        for provider in (settings.text_provider, settings.image_provider):
+            if provider_router.is_pool(provider):
+                names.extend(member for member, _ in provider_router.members(provider))
+            else:
+                names.append(provider)
+        await self.providers.warmup(names)
+
+    async def _route(self, provider: str, model: str, fn: Callable[[str, str], Awaitable[Any]]) -> Any:
+        """provider 为供应商池名时由路由器选择供应商并在失败时切换，否则直接调用 fn(provider, model)"""
+        if provider_router.is_pool(provider):
+            return await provider_router.call(provider, fn, model)
+        return await fn(provider, model)
+
+
+    async def generate_story_with_images(self, request: StoryGenerationRequest) -> Dict[str, Any]: 
         """生成故事和配图
+
+        文本以流式生成，每个场景一出来就交给图片工作池，图片按场景独立成功或失败。
+        并发的相同请求合并为一次生成，共享同一个结果。
+
         Args:
-            story_prompt (str, optional): 故事提示. Defaults to None.
-            language (Language, optional): 语言. Defaults to Language.CHINESE.
-            segments (int, optional): 故事分段数. Defaults to 3.
+            request (StoryGenerationRequest): 生成请求
 
         Returns:
-            List[Dict[str, Any]]: 故事场景列表，每个场景包含文本、图片提示词和图片URL
+            Dict[str, Any]: segments 为按顺序排列的场景（含图片URL、状态和耗时），
+                status 为 complete / partial / failed，timings 为各阶段耗时（毫秒）
+        """
+        key = generation_cache.key(
+            "story_images",
+            story=self._story_cache_key(request),
+            provider=request.image_llm_provider or settings.image_provider,
+            model=request.image_llm_model or settings.image_llm_model,
+            resolution=request.resolution,
+            use_cache=request.use_cache,
+        )
+        result = await self.flight.do(key, partial(self._generate_story_with_images, request))
+        # 合并的调用方共享同一个结果，返回副本避免互相修改
+        return copy.deepcopy(result)
+
+    async def _generate_story_with_images(self, request: StoryGenerationRequest) -> Dict[str, Any]:
+        start = time.perf_counter()
+        segments: List[Dict[str, Any]] = []
+        story_ms = None
+        async for event in self._story_image_pipeline(request):
+            index = event.get("index")
+            if event["event"] == "segment":
+                segment = event["segment"]
+                segment.update(status=SegmentStatus.pending, text_ms=event["text_ms"])
+                segments.append(segment)
+            elif event["event"] == "story_done":
+                story_ms = event["text_ms"]
+            elif event["event"] == "image":
+                segments[index].update(url=event["url"], thumbnail_url=event["thumbnail_url"], status=SegmentStatus.success, image_ms=event["image_ms"])
+            elif event["event"] == "image_error":
+                segments[index].update(status=SegmentStatus.failed, error=event["message"], image_ms=event["image_ms"])
+
+        total_ms = int((time.perf_counter() - start) * 1000)
+        return {"segments": segments, "status": images_status(segments), "timings": {"story_ms": story_ms, "total_ms": total_ms}}
+
+    async def _story_image_pipeline(self, request: StoryGenerationRequest) -> AsyncIterator[Dict[str, Any]]:
+        """故事配图流水线
+
+        生产者流式读取故事场景，放入有界队列；固定数量的图片 worker 消费队列生成图片，
+        同时受供应商并发上限约束。事件按产生顺序返回：
+        - {"event": "segment", "index": i, "segment": {...}, "text_ms": ...}
+        - {"event": "story_done", "text_ms": ...}
+        - {"event": "image", "index": i, "url": "...", "thumbnail_url": "...", "image_ms": ...}
+        - {"event": "image_error", "index": i, "message": "...", "image_ms": ...}
+        文本生成失败时抛出异常，单个图片失败不影响其他场景。
+        """
+        start = time.perf_counter()
+        events: asyncio.Queue = asyncio.Queue()
+        jobs: asyncio.Queue = asyncio.Queue(maxsize=settings.image_pipeline_queue_size)
+
+        def elapsed_ms(since: float) -> int:
+            return int((time.perf_counter() - since) * 1000)
+
+        async def worker() -> None:
+            while True:
+                job = await jobs.get()
+                if job is None:
+                    return
+                index, segment = job
+                image_start = time.perf_counter()
+                try:
+                    url = await self.generate_image(prompt=segment["image_prompt"], image_llm_provider=request.image_llm_provider or None, image_llm_model=request.image_llm_model or None, resolution=request.resolution, use_cache=request.use_cache)
+                    thumbnail_url = asset_store.thumbnail_url(url, settings.asset_thumbnail_widths[0]) if settings.asset_thumbnail_widths else None
+                    await events.put({"event": "image", "index": index, "url": url, "thumbnail_url": thumbnail_url, "image_ms": elapsed_ms(image_start)})
+                except Exception as e:
+                    logger.error(f"Failed to generate image for segment {index}: {e}")
+                    await events.put({"event": "image_error", "index": index, "message": str(e), "image_ms": elapsed_ms(image_start)})
+
+        async def produce() -> None:
+            workers = [asyncio.create_task(worker()) for _ in range(settings.image_pipeline_workers)]
+            try:
+                index = 0
+                async for segment in self.stream_story(request):
+                    await events.put({"event": "segment", "index": index, "segment": segment, "text_ms": elapsed_ms(start)})
+                    await jobs.put((index, copy.deepcopy(segment)))
+                    index += 1
+                await events.put({"event": "story_done", "text_ms": elapsed_ms(start)})
+                for _ in workers:
+                    await jobs.put(None)
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers:
+                    task.cancel()
+                await events.put(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+            # 文本生成失败时把异常抛给调用方
+            await producer
+        finally:
+            # 调用方提前退出（如客户端断开）时停止后续生成
+            producer.cancel()
+
+    async def stream_story(self, request: StoryGenerationRequest) -> AsyncIterator[Dict[str, Any]]:
+        """流式生成故事，每解析出一个完整且通过校验的场景就立即返回
+
+        流式请求不参与请求合并；完整生成后写入缓存，命中缓存时直接逐个返回缓存的场景。
+
+        Yields:
+            Dict[str, Any]: 故事场景
+        """
+        key = self._story_cache_key(request)
+        if request.use_cache:
+            cached = await generation_cache.get("story", key)
+            if cached is not None:
+                for segment in cached:
+                    yield segment
+                return
+        else:
+            generation_cache.bypass()
+
+        text_llm_provider = request.text_llm_provider or settings.text_provider
+        text_llm_model = request.text_llm_model or settings.text_llm_model
+        messages = self._build_story_messages(request)
+        schema = self._story_schema(request)
+        parser = StoryListParser()
+        segments = []
+        estimated = estimate_tokens(messages)
+
+        async def open_stream(provider: str, model: str):
+            await rate_limiter.acquire_provider(provider, model, estimated)
+            semaphore = self.providers.semaphore(provider)
+            await semaphore.acquire()
+            try:
+                # 只对建立流的请求做重试和供应商切换，流开始后出错直接抛出
+                with upstream_call("text_stream", provider, model):
+                    stream = await resilience.call(provider, partial(
+                        self.providers.text_client(provider).chat.completions.create,
+                        model=model,
+                        messages=messages,
+                        stream=True,
+                        **self._output_format(provider, "json_object", schema),
+                    ))
+            except BaseException:
+                semaphore.release()
+                raise
+            return stream, semaphore
+
+        start = time.perf_counter()
+        stream, semaphore = await self._route(text_llm_provider, text_llm_model, open_stream)
+        repaired = False
+
+        def accept(items: List[Any]) -> List[Dict[str, Any]]:
+            """修复解析出的元素，返回需要输出的新场景"""
+            nonlocal repaired
+            accepted = []
+            for item in items:
+                segment = self.repair_scene(item)
+                if segment is not item:
+                    repaired = True
+                if segment is None or len(segments) >= request.segments:
+                    continue
+                if not segments:
+                    STAGE_DURATION.observe(time.perf_counter() - start, "stream_first_segment")
+                segments.append(segment)
+                accepted.append(segment)
+            return accepted
+
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                # 工具调用模式下内容在调用参数中
+                content = delta.tool_calls[0].function.arguments if delta.tool_calls else delta.content
+                if not content:
+                    continue
+                for segment in accept(parser.feed(content)):
+                    yield copy.deepcopy(segment)
+        finally:
+            semaphore.release()
+        # 输出被截断时最后一个场景不完整；没有找到 list 数组时（根节点用了其他键名）按非流式的方式修复完整输出
+        tail = parser.close()
+        # repair_story 修复时已经计数，不再重复计数
+        counted = False
+        if not parser.started:
+            try:
+                tail, counted = self.repair_story(repair_json(parser.text), request.segments)
+            except ValueError:
+                tail = []
+            repaired = repaired or counted
+        for segment in accept(tail):
+            yield copy.deepcopy(segment)
+        if (repaired or parser.errors) and not counted:
+            OUTPUT_REPAIRS.inc("structure")
+
+        outcome = "repaired" if repaired else "clean"
+        if len(segments) < request.segments:
+            # 流中缺少的场景用非流式请求补齐
+            done = len(segments)
+            segments = await self._regenerate_missing(request, messages, segments, schema)
+            for segment in segments[done:]:
+                yield copy.deepcopy(segment)
+            outcome = "regenerated" if len(segments) >= request.segments else "incomplete"
+        STAGE_DURATION.observe(time.perf_counter() - start, "stream_complete")
+        if not segments:
+            STORY_OUTPUTS.inc("failed")
+            raise LLMResponseValidationError("Stream ended without any story segment")
+        STORY_OUTPUTS.inc(outcome)
+        await generation_cache.set("story", key, segments)
+
+    async def stream_story_with_images(self, request: StoryGenerationRequest) -> AsyncIterator[Dict[str, Any]]:
+        """流式生成故事和配图
+
+        每个场景解析出来后立即进入图片流水线，事件格式见 _story_image_pipeline，
+        文本生成失败时返回 {"event": "error", "message": "..."}。
         """
         try:
-            story_segments = await self.generate_story(request)
-            task_mapping = []
-            for segment in story_segments:
-                task = self.generate_image(prompt=segment["image_prompt"], image_llm_provider=request.image_llm_provider or None, image_llm_model=request.image_llm_model or None)
-                # 将 segment 和对应的任务添加到映射列表中
-                task_mapping.append((segment, task))
-            # 提取所有任务
-            tasks = [task for _, task in task_mapping]
-            # 使用 asyncio.gather() 并发运行所有任务并等待结果
-            results = await asyncio.gather(*tasks)
-            # 将结果赋值给对应的 segment
-            for (segment, _), url in zip(task_mapping, results):
-                segment["url"] = url
-            return story_segments
+            async for event in self._story_image_pipeline(request):
+                yield event
         except Exception as e:
-            logger.error(f"Failed to generate image for segment: {e}")
-            return story_segments
-    async def generate_image(self, *, prompt: str, image_llm_provider: str = None, image_llm_model: str = None, resolution: str = "1024*1024") -> str:
+            logger.error(f"Failed to stream story with images: {e}")
+            yield {"event": "error", "message": str(e)}
+
+    async def generate_image(self, *, prompt: str, image_llm_provider: str = None, image_llm_model: str = None, resolution: str = "1024*1024", use_cache: bool = True) -> str:
         # return "https://dashscope-result-bj.oss-cn-beijing.aliyuncs.com/1d/56/20250118/3c4cc727/4fc622b5-54a6-484c-bf1f-f1cfb66ace2d-1.png?Expires=1737290655&OSSAccessKeyId=LTAI5tQZd8AEcZX6KZV4G8qL&Signature=W8D4CN3uonQ2pL1e9xGMWufz33E%3D"
         """生成图片
 
         Args:
             prompt (str): 图片描述
             resolution (str): 图片分辨率，默认为 1024x1024
+            use_cache (bool): 是否读取缓存，为 False 时仍会写入新结果
 
         Returns:
-            str: 图片URL
+            str: 图片URL，缓存成功时为本地 /tasks 地址
         """
         if image_llm_provider == None:
             image_llm_provider = settings.image_provider
         if image_llm_model == None:
             image_llm_model = settings.image_llm_model
 
+        key = generation_cache.key("image", provider=image_llm_provider, model=image_llm_model, prompt=prompt, resolution=resolution)
+        if use_cache:
+            cached = await generation_cache.get("image", key)
+            # 本地文件可能已被清理，此时重新生成
+            if cached is not None and os.path.exists(task_path(cached["url"]) or ""):
+                return cached["url"]
+        else:
+            generation_cache.bypass()
+
+        return await self.flight.do(key, partial(self._generate_and_store_image, key=key, prompt=prompt, image_llm_provider=image_llm_provider, image_llm_model=image_llm_model, resolution=resolution))
+
+    async def _generate_and_store_image(self, *, key: str, prompt: str, image_llm_provider: str, image_llm_model: str, resolution: str) -> str:
+        """生成图片并保存到本地资源存储"""
+        with span("image_generation", provider=image_llm_provider):
+            url = await self._route(image_llm_provider, image_llm_model, lambda provider, model: self._call_image_provider(
+                prompt=prompt, image_llm_provider=provider, image_llm_model=model, resolution=resolution,
+            ))
+        try:
+            with span("image_store"):
+                local_url = await asset_store.store_url(url)
+        except Exception as e:
+            # 下载失败不影响本次结果，只是不缓存
+            asset_store.stats["download_errors"] += 1
+            logger.warning(f"Failed to download generated image {url}: {e}")
+            return url
+        await generation_cache.set("image", key, {"url": local_url})
+        return local_url
+
+    async def _call_image_provider(self, *, prompt: str, image_llm_provider: str, image_llm_model: str, resolution: str) -> str:
+        """调用供应商生成图片，返回供应商的图片地址"""
         try:
             safe_prompt = f"Create a safe, family-friendly illustration. {prompt} The image should be appropriate for all ages, non-violent, and non-controversial."
-            if image_llm_provider == "aliyun":
-                resp = ImageSynthesis.call(
-                    prompt=safe_prompt,
-                    size=resolution,
-                    model=image_llm_model,
-                )
-                if resp.status_code == 200:
-                    for item in resp.output.results:
-                        return item.url 
-                else:
-                    error_message = f'Failed, status_code: {resp.status_code}, code: {resp.code}, message: {resp.message}'
-                    logger.error(f"aliyun image generation error: {error_message}")
-                    raise LLMResponseValidationError(error_message)
-            elif image_llm_provider == "openai":
-                resp = self.openai_client.images.generate(
-                    model=image_llm_model,
-                    prompt=safe_prompt,
-                    n=1,
-                    size=resolution,
-                    quality="standard",
-                )
-                logger.info(f"openai image generation response: {json.dumps(resp, indent=4, ensure_ascii=False)}")
+            provider = self.providers.config(image_llm_provider)
+            if provider.image_api == "dashscope":
+                from dashscope import ImageSynthesis
+
+                async def attempt():
+                    loop = asyncio.get_running_loop()
+                    with upstream_call("image", image_llm_provider, image_llm_model):
+                        resp = await loop.run_in_executor(blocking_executor, partial(
+                            ImageSynthesis.call,
+                            api_key=provider.api_key,
+                            prompt=safe_prompt,
+                            size=resolution,
+                            model=image_llm_model,
+                        ))
+                    if resp.status_code != 200:
+                        error_message = f'Failed, status_code: {resp.status_code}, code: {resp.code}, message: {resp.message}'
+                        logger.error(f"aliyun image generation error: {error_message}")
+                        raise LLMUpstreamError(error_message, status_code=resp.status_code)
+                    return resp
+                resp = await resilience.call(image_llm_provider, attempt, slot=partial(self._provider_slot, image_llm_provider, image_llm_model, 0))
+                for item in resp.output.results:
+                    return item.url 
+                raise LLMResponseValidationError("aliyun image generation returned no result")
+            elif provider.image_api == "openai":
+                async def attempt():
+                    with upstream_call("image", image_llm_provider, image_llm_model):
+                        return await self.providers.text_client(image_llm_provider).images.generate(
+                            model=image_llm_model,
+                            prompt=safe_prompt,
+                            n=1,
+                            size=resolution,
+                            quality="standard",
+                        )
+                resp = await resilience.call(image_llm_provider, attempt, slot=partial(self._provider_slot, image_llm_provider, image_llm_model, 0))
+                log_payload("openai image response", resp, provider=image_llm_provider)
                 return resp.data[0].url
+            else:
+                raise LLMProviderError(f"Provider {image_llm_provider} does not support image generation")
         except Exception as e:
+            IMAGE_FAILURES.inc(image_llm_provider, type(e).__name__)
             logger.error(f"Failed to generate image: {e}")
-            raise ""    
+            raise e
+
     async def generate_story(self, request: StoryGenerationRequest) -> List[Dict[str, Any]]:
         """生成故事场景
 
@@ -132,48 +402,178 @@ class LLMService:
         Returns:
             List[Dict[str, Any]]: 故事场景列表
         """
-        messages = [
-            {"role": "system", "content": "你是一个专业的故事创作者，善于创作引人入胜的故事。请只返回JSON格式的内容。"},
-            {"role": "user", "content": await self._get_story_prompt(request.story_prompt,request.language,request.segments)}
-        ]
-        
-        logger.info(f"prompt messages: {json.dumps(messages, indent=4, ensure_ascii=False)}")
-        
-        response = await self._generate_response(text_llm_provider=request.text_llm_provider or None, text_llm_model=request.text_llm_model or None, messages=messages, response_format="json_object")
+        key = self._story_cache_key(request)
+        if request.use_cache:
+            cached = await generation_cache.get("story", key)
+            if cached is not None:
+                return cached
+        else:
+            generation_cache.bypass()
 
-        response = response["list"]
-        
-        response = self.normalize_keys(response)
-        
-        logger.info(f"Generate story: {json.dumps(response, indent=4, ensure_ascii=False)}")
-        
-        self._validate_story_response(response)
+        response = await self.flight.do(key, partial(self._create_and_store_story, key, request))
+        # 合并的调用方共享同一个结果，返回副本避免互相修改
+        return copy.deepcopy(response)
 
+    def _story_cache_key(self, request: StoryGenerationRequest) -> str:
+        return generation_cache.key(
+            "story",
+            provider=request.text_llm_provider or settings.text_provider,
+            model=request.text_llm_model or settings.text_llm_model,
+            language=request.language,
+            story_type=request.story_type,
+            prompt_version=settings.prompt_version,
+            segments=request.segments,
+            prompt=request.story_prompt,
+        )
+
+    async def _create_and_store_story(self, key: str, request: StoryGenerationRequest) -> List[Dict[str, Any]]:
+        response = await self._create_story(request)
+        await generation_cache.set("story", key, response)
         return response
+
+    def _build_story_messages(self, request: StoryGenerationRequest) -> List[Dict[str, str]]:
+        return story_messages(request.story_prompt, request.segments, request.language, request.story_type)
+
+    async def _create_story(self, request: StoryGenerationRequest) -> List[Dict[str, Any]]:
+        """调用文本模型生成故事"""
+        with span("prompt_build"):
+            messages = self._build_story_messages(request)
         
-    def normalize_keys(self,data):
+        log_payload("story prompt", messages, provider=request.text_llm_provider or settings.text_provider)
+
+        schema = self._story_schema(request)
+        with span("text_generation", provider=request.text_llm_provider or settings.text_provider):
+            response = await self._generate_response(text_llm_provider=request.text_llm_provider or None, text_llm_model=request.text_llm_model or None, messages=messages, response_format="json_object", schema=schema)
+
+        with span("normalize"):
+            response, repaired = self.repair_story(response, request.segments)
+
+        outcome = "repaired" if repaired else "clean"
+        if len(response) < request.segments:
+            with span("regenerate"):
+                response = await self._regenerate_missing(request, messages, response, schema)
+            outcome = "regenerated" if len(response) >= request.segments else "incomplete"
+        if not response:
+            STORY_OUTPUTS.inc("failed")
+            raise LLMResponseValidationError("Model output contains no valid story segment")
+        STORY_OUTPUTS.inc(outcome)
+
+        log_payload("story response", response, segments=len(response))
+
+        with span("validate"):
+            self._validate_story_response(response)
+
+        return response
+
+    def _story_schema(self, request: StoryGenerationRequest) -> Optional[Dict[str, Any]]:
+        strict = request.strict if request.strict is not None else settings.story_strict_output
+        return STORY_SCHEMA if strict else None
+
+    async def _regenerate_missing(self, request: StoryGenerationRequest, messages: List[Dict[str, str]], segments: List[Dict[str, Any]], schema: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """场景数不足时把已有场景作为上下文，只生成缺少的场景；补生成失败时返回已有场景"""
+        for _ in range(settings.story_regenerate_attempts):
+            missing = request.segments - len(segments)
+            if missing <= 0:
+                break
+            OUTPUT_REPAIRS.inc("regenerate")
+            follow_up = messages + [
+                {"role": "assistant", "content": json.dumps({"list": segments}, ensure_ascii=False)},
+                story_continue_message(len(segments), missing),
+            ]
+            try:
+                response = await self._generate_response(text_llm_provider=request.text_llm_provider or None, text_llm_model=request.text_llm_model or None, messages=follow_up, response_format="json_object", schema=schema)
+            except Exception as e:
+                logger.warning(f"Failed to regenerate {missing} missing segments: {e}")
+                break
+            extra, _ = self.repair_story(response, missing)
+            segments = segments + extra
+        return segments
+
+    async def rewrite_segments(self, request: StoryGenerationRequest, texts: List[str], indexes: List[int], instruction: Optional[str] = None) -> List[Dict[str, str]]:
         """
-        阿里云和 openai 的模型返回结果不一致，处理一下
-        修改对象中非 `text` 的键为 `image_prompt`
-        - 如果是字典，替换 `text` 以外的单个键为 `image_prompt`
-        - 如果是列表，对列表中的每个对象递归处理
+        只改写故事中的部分场景，一次调用改写所有选中的场景，前后各 story_session_context 个场景作为上下文
+
+        Args:
+            request (StoryGenerationRequest): 生成故事时的请求（主题、语言、供应商）
+            texts (List[str]): 所有场景的文本
+            indexes (List[int]): 要改写的场景序号（从 0 开始，升序）
+            instruction (Optional[str]): 改写要求
+
+        Returns:
+            List[Dict[str, str]]: 与 indexes 一一对应的 {"text", "image_prompt"}
+
+        Raises:
+            LLMResponseValidationError: 模型返回的场景数不足
+        """
+        with span("prompt_build"):
+            messages = story_rewrite_messages(request.story_prompt, texts, indexes, request.language, request.story_type, settings.story_session_context, instruction)
+        log_payload("story rewrite prompt", messages, provider=request.text_llm_provider or settings.text_provider)
+
+        with span("text_generation", provider=request.text_llm_provider or settings.text_provider):
+            response = await self._generate_response(text_llm_provider=request.text_llm_provider or None, text_llm_model=request.text_llm_model or None, messages=messages, response_format="json_object", schema=self._story_schema(request))
+        scenes, repaired = self.repair_story(response, len(indexes))
+        if len(scenes) < len(indexes):
+            STORY_OUTPUTS.inc("failed")
+            raise LLMResponseValidationError(f"Model returned {len(scenes)} of {len(indexes)} rewritten scenes")
+        STORY_OUTPUTS.inc("repaired" if repaired else "clean")
+        return scenes
+
+    def repair_story(self, data: Any, segments: int) -> Tuple[List[Dict[str, Any]], bool]:
         """
+        从模型输出中取出合法的场景
+
+        阿里云和 openai 的模型返回结果不一致，且可能缺少 `list`、键名拼错或带多余的键：
+        - 根对象没有 `list` 时使用唯一的数组字段，或把单个场景对象当作只有一个场景
+        - 每个场景由 repair_scene 修复，无法修复的场景丢弃
+        - 多于请求的场景数时截断
+
+        Returns:
+            Tuple[List[Dict[str, Any]], bool]: 场景列表，是否做过修复
+        """
+        items, repaired = data, False
         if isinstance(data, dict):
-            # 如果是字典，处理键值
-            if "text" in data:
-                # 找到非 `text` 的键
-                other_keys = [key for key in data.keys() if key != "text"]
-                if len(other_keys) == 1:
-                    data["image_prompt"] = data.pop(other_keys[0])
-                elif len(other_keys) > 1:
-                    raise ValueError(f"Unexpected extra keys: {other_keys}. Only one non-'text' key is allowed.")
-            return data
-        elif isinstance(data, list):
-            # 如果是列表，对列表中的每个对象递归处理
-            return [self.normalize_keys(item) for item in data]
-        else:
-            # 其他类型，直接返回
-            raise TypeError("Input must be a dict or list of dicts")
+            if isinstance(data.get("list"), list):
+                items = data["list"]
+            else:
+                repaired = True
+                arrays = [value for value in data.values() if isinstance(value, list)]
+                items = arrays[0] if len(arrays) == 1 else [data]
+        elif not isinstance(data, list):
+            items, repaired = [], True
+
+        scenes = []
+        for item in items:
+            scene = self.repair_scene(item)
+            if scene is None or scene is not item:
+                repaired = True
+            if scene is not None:
+                scenes.append(scene)
+        if len(scenes) > segments:
+            scenes, repaired = scenes[:segments], True
+        if repaired:
+            OUTPUT_REPAIRS.inc("structure")
+        return scenes, repaired
+
+    def repair_scene(self, item: Any) -> Optional[Dict[str, str]]:
+        """
+        修复单个场景：键名不是 text / image_prompt 时按别名或唯一的其他键取值，去掉多余的键
+
+        Returns:
+            Optional[Dict[str, str]]: 原对象（无需修复时）、修复后的新对象，无法修复时为 None
+        """
+        if not isinstance(item, dict):
+            return None
+        if set(item) == {"text", "image_prompt"} and all(isinstance(value, str) and value.strip() for value in item.values()):
+            return item
+        strings = {key: value for key, value in item.items() if isinstance(value, str) and value.strip()}
+        text_key = next((key for key in SCENE_TEXT_KEYS if key in strings), None)
+        image_key = "image_prompt" if "image_prompt" in strings else next((key for key in strings if key != text_key and ("image" in key.lower() or "prompt" in key.lower())), None)
+        if text_key is not None and image_key is None:
+            others = [key for key in strings if key != text_key]
+            image_key = others[0] if len(others) == 1 else None
+        if text_key is None or image_key is None:
+            return None
+        return {"text": strings[text_key], "image_prompt": strings[image_key]}
 
     def _validate_story_response(self,response:Any) -> None:
         """验证故事生成响应
@@ -200,12 +600,13 @@ class LLMService:
             if not isinstance(scene["text"], str):
                 raise LLMResponseValidationError(f"Scene {i} 'text' must be a string")
 
-    async def _generate_response(self, *, text_llm_provider: str = None, text_llm_model: str = None, messages: List[Dict[str, str]], response_format: str = "json_object") -> any:
+    async def _generate_response(self, *, text_llm_provider: str = None, text_llm_model: str = None, messages: List[Dict[str, str]], response_format: str = "json_object", schema: Optional[Dict[str, Any]] = None) -> any:
         """生成 LLM 响应
 
         Args:
             messages: 消息列表
             response_format: 响应格式，默认为 json_object
+            schema: 输出的 JSON Schema，传入时按供应商支持的方式约束输出（见 _output_format）
 
         Returns:
             Dict[str, Any]: 解析后的响应
@@ -215,86 +616,81 @@ class LLMService:
         """
         if text_llm_provider == None:
             text_llm_provider = settings.text_provider
-        if text_llm_provider == "aliyun":
-            text_client = aliyun_text_client
-        elif text_llm_provider == "openai":
-            text_client = self.openai_client
-        elif text_llm_provider == "deepseek":
-            text_client = deepseek_client
-        elif text_llm_provider == "ollama":
-            text_client = ollama_client
+        # 提前检查供应商是否已配置，供应商池由路由器检查成员
+        if not provider_router.is_pool(text_llm_provider):
+            self.providers.config(text_llm_provider)
         
         if text_llm_model == None:
             text_llm_model = settings.text_llm_model
-            
-        response = text_client.chat.completions.create(
-            model=text_llm_model,
-            messages=messages,
-            response_format={"type": response_format}
-        )
-        
-        try:
-          content = response.choices[0].message.content 
-          result = json.loads(content)
-          return result
-        except Exception as e:
-            logger.error(f"Failed to parse response: {e}")
-            raise e
-        
-    async def _get_story_prompt(self,story_prompt: str = None, language: Language = Language.CHINESE_CN, segments: int = 3, ) -> str:
-        """_summary_
 
-        Args:
-            story_prompt (str, optional): 故事提示. Defaults to None.
-            language (Language, optional): 故事语言. Defaults to Language.CHINESE_CN.
-            segments (int, optional): 故事分段数. Defaults to 3.
+        raw = json.dumps([text_llm_provider, text_llm_model, response_format, schema, messages], ensure_ascii=False)
+        key = "completion:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+        result = await self.flight.do(key, partial(self._route, text_llm_provider, text_llm_model, lambda provider, model: self._request_completion(
+            text_llm_provider=provider, text_llm_model=model, messages=messages, response_format=response_format, schema=schema,
+        )))
+        return copy.deepcopy(result)
 
-        Returns:
-            str: 完整的提示词
-        """
-        languageValue = LANGUAGE_NAMES[language]
-        if story_prompt:
-            base_prompt = f"讲一个故事，主题是:{story_prompt}"
+    async def _request_completion(self, *, text_llm_provider: str, text_llm_model: str, messages: List[Dict[str, str]], response_format: str, schema: Optional[Dict[str, Any]] = None) -> Any:
+        """请求上游并解析 JSON，超时、重试、熔断和对冲由 resilience 处理"""
+        estimated = estimate_tokens(messages)
+
+        async def attempt(provider: str, model: str):
+            with upstream_call("text", provider, model):
+                response = await self.providers.text_client(provider).chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    **self._output_format(provider, response_format, schema),
+                )
+            rate_limiter.record_usage(provider, model, estimated, response.usage.total_tokens if response.usage else None)
+            if response.usage:
+                TOKENS.inc(provider, model, "prompt", value=response.usage.prompt_tokens)
+                TOKENS.inc(provider, model, "completion", value=response.usage.completion_tokens)
+            return response
+
+        hedge = None
+        target = resilience.hedge_target(text_llm_provider)
+        if target is not None:
+            hedge_provider, hedge_model = target
+            hedge_model = hedge_model or text_llm_model
+            hedge = (hedge_provider, partial(attempt, hedge_provider, hedge_model), partial(self._provider_slot, hedge_provider, hedge_model, estimated))
+        response = await resilience.call(text_llm_provider, partial(attempt, text_llm_provider, text_llm_model), slot=partial(self._provider_slot, text_llm_provider, text_llm_model, estimated), hedge=hedge)
         
-        return f"""
-        {base_prompt}. The story needs to be divided into {segments} scenes, and each scene must include descriptive text and an image prompt.
-
-        Please return the result in the following JSON format, where the key `list` contains an array of objects:
-
-        **Expected JSON format**:
-        {{
-            "list": [
-                {{
-                    "text": "Descriptive text for the scene",
-                    "image_prompt": "Detailed image generation prompt, described in English"
-                }},
-                {{
-                    "text": "Another scene description text",
-                    "image_prompt": "Another detailed image generation prompt in English"
-                }}
-            ]
-        }}
+        message = response.choices[0].message
+        # 工具调用模式下结果在调用参数中
+        content = message.tool_calls[0].function.arguments if message.tool_calls else message.content
+        with span("json_parse"):
+            try:
+                return json.loads(content)
+            except (TypeError, ValueError):
+                pass
+            try:
+                result = repair_json(content)
+            except ValueError as e:
+                logger.error(f"Failed to parse response: {e}")
+                raise LLMResponseValidationError(f"Model output is not valid JSON: {e}")
+        OUTPUT_REPAIRS.inc("json_syntax")
+        return result
+
+    @asynccontextmanager
+    async def _provider_slot(self, provider: str, model: str, tokens: int) -> AsyncIterator[None]:
+        """发往供应商之前的限流和并发控制，由 resilience 在每次尝试计时之前进入"""
+        await rate_limiter.acquire_provider(provider, model, tokens)
+        async with self.providers.semaphore(provider):
+            yield
+
+    def _output_format(self, provider: str, response_format: str, schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """请求的输出格式参数：有 schema 时按供应商配置的 structured_output 约束输出，否则只要求 JSON"""
+        mode = self.providers.config(provider).structured_output if schema else response_format
+        if mode == "json_schema":
+            return {"response_format": {"type": "json_schema", "json_schema": {"name": "output", "strict": True, "schema": schema}}}
+        if mode == "tools":
+            return {
+                "tools": [{"type": "function", "function": {"name": "submit_output", "description": "Submit the result", "parameters": schema}}],
+                "tool_choice": {"type": "function", "function": {"name": "submit_output"}},
+            }
+        return {"response_format": {"type": "json_object" if mode == "json_object" else response_format}}
         
-        **Requirements**
-        1. The root object must contain a key named `list`, and its value must be an array of scene objects.
-        2. Each object in the `list` array must include:
-            - `text`: A descriptive text for the scene, written in {languageValue}.
-            - `image_prompt`: A detailed prompt for generating an image, written in English.
-        3. Ensure the JSON format matches the above example exactly. Avoid extra fields or incorrect key names like `cimage_prompt` or `inage_prompt`.
-
-        **Important**:
-        - If there is only one scene, the array under `list` should contain a single object.
-        - The output must be a valid JSON object. Do not include explanations, comments, or additional content outside the JSON.
-
-        Example output:
-        {{
-            "list": [
-                {{
-                    "text": "Scene description text",
-                    "image_prompt": "Detailed image generation prompt in English"
-                }}
-            ]
-        }}
-        """
-    
+# 场景文本可能使用的键名，按优先级排列
+SCENE_TEXT_KEYS = ("text", "content", "narration", "scene_text", "description", "story")
+
 llm_service = LLMService()
\ No newline at end of file
@@ -0,0 +1,229 @@
+"""故事提示词模板
+
+每个版本的模板按 (语言, 故事类型) 预编译一次：不变的说明全部放在 system 消息中，
+请求相关的主题和场景数放在最后的 user 消息里，同一语言和故事类型的请求共享完全相同的前缀，
+可以命中供应商的前缀缓存（prompt caching）。
+"""
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.config import get_settings
+from app.models.const import LANGUAGE_NAMES, Language, StoryType
+from app.utils.metrics import registry
+from app.utils.tokens import count_tokens, truncate_tokens
+
+settings = get_settings()
+
+PROMPT_TOKENS = registry.histogram("story_prompt_tokens", "Prompt tokens per story request", ["version"], buckets=(50, 100, 200, 300, 400, 600, 800, 1200, 1600, 3200))
+
+STORY_TYPE_GUIDANCE = {
+    StoryType.custom: "",
+    StoryType.bedtime: "This is a bedtime story: calm pacing, soothing imagery and a peaceful ending.",
+    StoryType.fairy_tale: "This is a fairy tale: a touch of magic, a clear hero and a happy ending.",
+    StoryType.adventure: "This is an adventure story: a journey, rising tension and a satisfying resolution.",
+    StoryType.science: "This is a science story for children: explain one real idea accurately and simply through the plot.",
+    StoryType.moral: "This is a fable: end with a clear, simple moral.",
+}
+
+
+class CompiledPrompt:
+    """某个版本、语言、故事类型下预先渲染好的提示词，每次请求只格式化 user 消息"""
+
+    def __init__(self, version: str, system: str, user: str):
+        self.version = version
+        self.system = system
+        self.user = user
+        self.system_tokens = count_tokens(system)
+
+    def messages(self, topic: str, segments: int) -> List[Dict[str, str]]:
+        topic = truncate_tokens(topic, settings.prompt_topic_max_tokens)
+        # 先替换场景数再替换主题，主题中的花括号原样保留
+        user = self.user.replace("{segments}", str(segments)).replace("{topic}", topic)
+        PROMPT_TOKENS.observe(self.system_tokens + count_tokens(user), self.version)
+        return [{"role": "system", "content": self.system}, {"role": "user", "content": user}]
+
+
+class PromptTemplate:
+    """一个版本的故事提示词
+
+    Args:
+        version (str): 版本号，参与故事缓存 key，修改模板内容时应新增版本
+        system (str): system 消息，可用占位符 {language}、{guidance}
+        user (str): user 消息，可用占位符 {topic}、{segments}，以及 {language}、{guidance}
+    """
+
+    def __init__(self, version: str, system: str, user: str):
+        self.version = version
+        self.system = system
+        self.user = user
+        self._compiled: Dict[Tuple[Language, StoryType], CompiledPrompt] = {}
+
+    def compile(self, language: Language, story_type: StoryType) -> CompiledPrompt:
+        compiled = self._compiled.get((language, story_type))
+        if compiled is None:
+            guidance = STORY_TYPE_GUIDANCE[story_type]
+            fields = {"language": LANGUAGE_NAMES[language], "guidance": f"{guidance}\n" if guidance else ""}
+            # user 消息中只保留请求参数的占位符
+            user = self.user.format(topic="{topic}", segments="{segments}", **fields)
+            compiled = CompiledPrompt(self.version, self.system.format(**fields), user)
+            self._compiled[(language, story_type)] = compiled
+        return compiled
+
+
+# v1: 原来的提示词，所有内容都在 user 消息中，保留用于对比和复现旧结果
+STORY_V1 = PromptTemplate(
+    version="v1",
+    system="你是一个专业的故事创作者，善于创作引人入胜的故事。请只返回JSON格式的内容。",
+    user="""
+        讲一个故事，主题是:{topic}. The story needs to be divided into {segments} scenes, and each scene must include descriptive text and an image prompt.
+
+        Please return the result in the following JSON format, where the key `list` contains an array of objects:
+
+        **Expected JSON format**:
+        {{
+            "list": [
+                {{
+                    "text": "Descriptive text for the scene",
+                    "image_prompt": "Detailed image generation prompt, described in English"
+                }},
+                {{
+                    "text": "Another scene description text",
+                    "image_prompt": "Another detailed image generation prompt in English"
+                }}
+            ]
+        }}
+
+        **Requirements**
+        1. The root object must contain a key named `list`, and its value must be an array of scene objects.
+        2. Each object in the `list` array must include:
+            - `text`: A descriptive text for the scene, written in {language}.
+            - `image_prompt`: A detailed prompt for generating an image, written in English.
+        3. Ensure the JSON format matches the above example exactly. Avoid extra fields or incorrect key names like `cimage_prompt` or `inage_prompt`.
+
+        **Important**:
+        - If there is only one scene, the array under `list` should contain a single object.
+        - The output must be a valid JSON object. Do not include explanations, comments, or additional content outside the JSON.
+
+        Example output:
+        {{
+            "list": [
+                {{
+                    "text": "Scene description text",
+                    "image_prompt": "Detailed image generation prompt in English"
+                }}
+            ]
+        }}
+        """,
+)
+
+# v2: 说明精简并全部放入 system 消息，user 消息只有主题和场景数
+STORY_V2 = PromptTemplate(
+    version="v2",
+    system=(
+        "You are a professional storyteller. Reply with a single JSON object and nothing else.\n"
+        "{guidance}"
+        'Format: {{"list": [{{"text": "...", "image_prompt": "..."}}]}}, one object per scene, no other keys.\n'
+        "text: the scene's narration, written in {language}.\n"
+        "image_prompt: a detailed, self-contained English description of the scene for an image model."
+    ),
+    user="Topic: {topic}\nThe story needs to be divided into {segments} scenes.",
+)
+
+# 严格模式下约束模型输出的 JSON Schema
+STORY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "list": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "text": {"type": "string"},
+                    "image_prompt": {"type": "string"},
+                },
+                "required": ["text", "image_prompt"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["list"],
+    "additionalProperties": False,
+}
+
+TEMPLATES: Dict[str, PromptTemplate] = {template.version: template for template in (STORY_V1, STORY_V2)}
+
+
+def story_template(version: str = None) -> PromptTemplate:
+    version = version or settings.prompt_version
+    if version not in TEMPLATES:
+        logger.warning(f"unknown prompt version {version}, falling back to {STORY_V2.version}")
+        return STORY_V2
+    return TEMPLATES[version]
+
+
+def story_continue_message(done: int, missing: int) -> Dict[str, str]:
+    """场景数不足时追加的 user 消息，只要求补齐缺少的场景"""
+    return {
+        "role": "user",
+        "content": f"Only {done} scenes were returned. Continue the same story with the remaining {missing} scenes "
+                   f"(scenes {done + 1} to {done + missing}). Reply in the same JSON format with only the new scenes.",
+    }
+
+
+def story_rewrite_messages(topic: str, texts: List[str], indexes: List[int], language: Language, story_type: StoryType = StoryType.custom,
+                           context: int = 1, instruction: Optional[str] = None, version: str = None) -> List[Dict[str, str]]:
+    """
+    只改写故事中部分场景的消息列表
+
+    system 消息与生成故事时相同（共享供应商的前缀缓存），user 消息给出要改写的场景和前后各 context 个场景，
+    其他场景不发送。
+
+    Args:
+        topic (str): 故事主题
+        texts (List[str]): 所有场景的文本
+        indexes (List[int]): 要改写的场景序号（从 0 开始，升序）
+        language (Language): 故事语言
+        story_type (StoryType): 故事类型
+        context (int): 每个场景前后作为上下文的场景数
+        instruction (Optional[str]): 改写要求
+        version (str): 模板版本，默认使用 settings.prompt_version
+
+    Returns:
+        List[Dict[str, str]]: system + user 两条消息
+    """
+    compiled = story_template(version).compile(language, story_type)
+    selected = set(indexes)
+    shown = sorted({j for i in indexes for j in range(max(0, i - context), min(len(texts), i + context + 1))})
+    lines, previous = [], None
+    for j in shown:
+        if previous is not None and j != previous + 1:
+            lines.append("...")
+        lines.append(f"Scene {j + 1}{' (rewrite)' if j in selected else ''}: {texts[j]}")
+        previous = j
+    numbers = ", ".join(str(i + 1) for i in indexes)
+    user = (
+        f"Topic: {truncate_tokens(topic, settings.prompt_topic_max_tokens)}\n"
+        f"The story has {len(texts)} scenes. Rewrite scenes {numbers} so that they read naturally with the scenes around them; "
+        f"the other scenes stay unchanged. Keep the text in {LANGUAGE_NAMES[language]}.\n" + "\n".join(lines) + "\n"
+        + (f"Changes requested: {instruction}\n" if instruction else "")
+        + f'Reply with {{"list": [{{"text": "...", "image_prompt": "..."}}]}} containing exactly {len(indexes)} rewritten scenes, in order.'
+    )
+    return [{"role": "system", "content": compiled.system}, {"role": "user", "content": user}]
+
+
+def story_messages(topic: str, segments: int, language: Language, story_type: StoryType = StoryType.custom, version: str = None) -> List[Dict[str, str]]:
+    """
+    生成故事的消息列表
+
+    Args:
+        topic (str): 故事主题，超过 prompt_topic_max_tokens 时截断
+        segments (int): 场景数
+        language (Language): 故事语言
+        story_type (StoryType): 故事类型
+        version (str): 模板版本，默认使用 settings.prompt_version
+
+    Returns:
+        List[Dict[str, str]]: system + user 两条消息
+    """
+    return story_template(version).compile(language, story_type).messages(topic, segments)
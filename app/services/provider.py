@@ -0,0 +1,143 @@
+import asyncio
+import importlib
+import importlib.util
+from typing import TYPE_CHECKING, Dict, Iterable, List
+
+import httpx
+from loguru import logger
+
+from app.config import ProviderSettings, get_settings
+from app.exceptions import LLMProviderError
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+settings = get_settings()
+
+# 安装了 h2 时才能启用 HTTP/2
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class ProviderRegistry:
+    """供应商客户端注册表
+
+    - 客户端在第一次使用时才创建，SDK 也在这时才导入，启动时不做任何网络相关的初始化（除非开启 warmup）
+    - 每个 base_url 共用一个 httpx 连接池（长连接，可选 HTTP/2）
+    - 每个供应商有独立的并发上限
+    新增 OpenAI 兼容的供应商只需要在 Settings.providers 中加一条配置。
+    """
+
+    def __init__(self, configs: Dict[str, ProviderSettings]):
+        self._configs = configs
+        self._http_clients: Dict[str, httpx.AsyncClient] = {}
+        self._text_clients: Dict[str, "AsyncOpenAI"] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._download_client: httpx.AsyncClient = None
+
+    def config(self, name: str) -> ProviderSettings:
+        cfg = self._configs.get(name)
+        if cfg is None:
+            raise LLMProviderError(f"Unknown provider: {name}")
+        if not cfg.api_key:
+            raise LLMProviderError(f"Provider {name} is not configured, missing api key")
+        return cfg
+
+    def text_providers(self) -> List[str]:
+        return [name for name, cfg in self._configs.items() if cfg.api_key and cfg.text]
+
+    def image_providers(self) -> List[str]:
+        return [name for name, cfg in self._configs.items() if cfg.api_key and cfg.image_api]
+
+    def http_client(self, name: str) -> httpx.AsyncClient:
+        """按 base_url 复用连接池"""
+        cfg = self.config(name)
+        client = self._http_clients.get(cfg.base_url)
+        if client is None:
+            http2 = cfg.http2 and HTTP2_AVAILABLE
+            client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=cfg.max_connections,
+                    max_keepalive_connections=cfg.max_keepalive_connections,
+                    keepalive_expiry=settings.http_keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(settings.http_timeout),
+            )
+            self._http_clients[cfg.base_url] = client
+            logger.info(f"created http pool for {cfg.base_url}, http2={http2}")
+        return client
+
+    def download_client(self) -> httpx.AsyncClient:
+        """下载生成结果（图片等）用的连接池，与供应商 API 的连接池分开"""
+        if self._download_client is None:
+            self._download_client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                follow_redirects=True,
+                limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=settings.http_keepalive_expiry),
+                timeout=httpx.Timeout(settings.http_timeout),
+            )
+        return self._download_client
+
+    def text_client(self, name: str) -> "AsyncOpenAI":
+        client = self._text_clients.get(name)
+        if client is None:
+            cfg = self.config(name)
+            if cfg.base_url.startswith("fake://"):
+                from app.services.fake import FakeClient
+                client = self._text_clients[name] = FakeClient()
+                return client
+            from openai import AsyncOpenAI
+
+            # 重试由 Resilience 统一处理，关闭 SDK 自带的重试
+            client = AsyncOpenAI(api_key=cfg.api_key, base_url=cfg.base_url, http_client=self.http_client(name), max_retries=0)
+            self._text_clients[name] = client
+        return client
+
+    def semaphore(self, name: str) -> asyncio.Semaphore:
+        """供应商级别的并发上限"""
+        sem = self._semaphores.get(name)
+        if sem is None:
+            sem = asyncio.Semaphore(self.config(name).max_concurrency)
+            self._semaphores[name] = sem
+        return sem
+
+    async def warmup(self, names: Iterable[str]) -> None:
+        """
+        预先导入 SDK 并建立到供应商的连接，减少每个 worker 第一个请求的延迟
+
+        Args:
+            names (Iterable[str]): 供应商名称，未配置的供应商跳过
+        """
+        for name in dict.fromkeys(names):
+            try:
+                cfg = self.config(name)
+            except LLMProviderError:
+                continue
+            if cfg.image_api == "dashscope":
+                # dashscope 的图片接口不走这里的连接池，只提前导入
+                await asyncio.to_thread(importlib.import_module, "dashscope")
+            if not cfg.text and cfg.image_api != "openai":
+                continue
+            await asyncio.to_thread(importlib.import_module, "openai")
+            client = self.text_client(name)
+            if cfg.base_url.startswith("fake://"):
+                continue
+            try:
+                # 一个轻量的请求，建立连接（TLS、HTTP/2）后放回连接池
+                await self.http_client(name).get(f"{cfg.base_url.rstrip('/')}/models", headers={"Authorization": f"Bearer {cfg.api_key}"}, timeout=settings.warmup_timeout)
+            except httpx.HTTPError as e:
+                logger.warning(f"warmup of provider {name} failed: {e}")
+                continue
+            logger.info(f"warmed up provider {name} ({type(client).__name__})")
+
+    async def aclose(self) -> None:
+        for client in self._http_clients.values():
+            await client.aclose()
+        if self._download_client is not None:
+            await self._download_client.aclose()
+            self._download_client = None
+        self._http_clients.clear()
+        self._text_clients.clear()
+
+
+provider_registry = ProviderRegistry(settings.provider_configs())
@@ -0,0 +1,194 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config import get_settings
+from app.exceptions import RateLimitExceededError
+
+settings = get_settings()
+
+
+class TokenBucket:
+    """令牌桶，rate 为每秒补充的令牌数，capacity 为桶容量（允许的突发量）"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, n: float = 1) -> float:
+        """还需要等待多久才能取到 n 个令牌，0 表示现在就可以"""
+        self._refill()
+        n = min(n, self.capacity)
+        if self.tokens >= n:
+            return 0.0
+        return (n - self.tokens) / self.rate
+
+    def take(self, n: float = 1) -> None:
+        self._refill()
+        self.tokens -= min(n, self.capacity)
+
+    def adjust(self, n: float) -> None:
+        """按实际用量修正预估值，n 为正时多扣，为负时退还"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - n)
+
+
+async def acquire_all(buckets: List[TokenBucket], amounts: List[float], max_wait: float, what: str) -> None:
+    """同时从多个桶取令牌；需要等待时最多等 max_wait 秒，否则抛出 RateLimitExceededError"""
+    deadline = time.monotonic() + max_wait
+    while True:
+        wait = max((bucket.wait_time(n) for bucket, n in zip(buckets, amounts)), default=0.0)
+        if wait == 0:
+            for bucket, n in zip(buckets, amounts):
+                bucket.take(n)
+            return
+        if time.monotonic() + wait > deadline:
+            raise RateLimitExceededError(f"Rate limit exceeded for {what}", retry_after=wait)
+        await asyncio.sleep(wait)
+
+
+# 清理空闲调用方状态的间隔（秒）
+_CLIENT_EVICT_INTERVAL = 60.0
+
+
+def _bucket(per_minute: int) -> TokenBucket:
+    # 容量为一分钟的配额，允许短时突发
+    return TokenBucket(per_minute / 60.0, per_minute)
+
+
+class RateLimiter:
+    """准入控制
+
+    - 供应商 / 模型：请求数（rpm）和 token 数（tpm）令牌桶，配置在 settings.rate_limits，
+      key 为 "供应商" 或 "供应商:模型"，两者都配置时同时生效
+    - 调用方（配置过的 X-API-Key，否则为 IP）：请求数令牌桶和并发上限，空闲调用方的状态定期删除
+    超出配额时最多排队 settings.admission_max_wait 秒，仍然不够则抛出 RateLimitExceededError。
+    """
+
+    def __init__(self):
+        self._provider_buckets: Dict[str, Dict[str, TokenBucket]] = {}
+        self._client_buckets: Dict[str, TokenBucket] = {}
+        self._client_semaphores: Dict[str, asyncio.Semaphore] = {}
+        # 每个调用方正在进行和排队的请求数
+        self._client_users: Dict[str, int] = {}
+        self._evicted_at = time.monotonic()
+        self.stats = {"admitted": 0, "rejected": 0, "queued": 0}
+
+    def _buckets_for(self, key: str) -> Dict[str, TokenBucket]:
+        if key not in self._provider_buckets:
+            limit = settings.rate_limits.get(key)
+            buckets = {}
+            if limit is not None and limit.rpm:
+                buckets["rpm"] = _bucket(limit.rpm)
+            if limit is not None and limit.tpm:
+                buckets["tpm"] = _bucket(limit.tpm)
+            self._provider_buckets[key] = buckets
+        return self._provider_buckets[key]
+
+    async def acquire_provider(self, provider: str, model: str, tokens: int) -> None:
+        """发往上游之前调用，tokens 为预估的 token 数"""
+        buckets, amounts = [], []
+        for key in (provider, f"{provider}:{model}"):
+            group = self._buckets_for(key)
+            if "rpm" in group:
+                buckets.append(group["rpm"])
+                amounts.append(1)
+            if "tpm" in group:
+                buckets.append(group["tpm"])
+                amounts.append(tokens)
+        if buckets:
+            await self._acquire(buckets, amounts, f"provider {provider}:{model}")
+
+    def wait_time(self, provider: str, model: str, tokens: int = 0) -> float:
+        """不取令牌，只查询当前需要等待的时间，用于路由判断"""
+        wait = 0.0
+        for key in (provider, f"{provider}:{model}"):
+            group = self._buckets_for(key)
+            if "rpm" in group:
+                wait = max(wait, group["rpm"].wait_time(1))
+            if "tpm" in group and tokens:
+                wait = max(wait, group["tpm"].wait_time(tokens))
+        return wait
+
+    def record_usage(self, provider: str, model: str, estimated: int, actual: Optional[int]) -> None:
+        """拿到响应中的实际 token 用量后修正 tpm 桶"""
+        if actual is None:
+            return
+        for key in (provider, f"{provider}:{model}"):
+            bucket = self._buckets_for(key).get("tpm")
+            if bucket is not None:
+                bucket.adjust(actual - estimated)
+
+    async def acquire_client(self, client: str, rpm: int) -> None:
+        """调用方准入，rpm 为 0 时不限制请求频率；通过后需要在请求结束时调用 release_client"""
+        self._evict_idle()
+        if rpm:
+            bucket = self._client_buckets.get(client)
+            if bucket is None:
+                bucket = self._client_buckets[client] = _bucket(rpm)
+            await self._acquire([bucket], [1], f"client {client}")
+        sem = self._client_semaphores.get(client)
+        if sem is None:
+            sem = self._client_semaphores[client] = asyncio.Semaphore(settings.client_max_concurrency)
+        self._client_users[client] = self._client_users.get(client, 0) + 1
+        try:
+            await asyncio.wait_for(sem.acquire(), timeout=settings.admission_max_wait)
+        except BaseException as e:
+            self._client_users[client] -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats["rejected"] += 1
+                raise RateLimitExceededError(f"Too many concurrent requests for client {client}", retry_after=1)
+            raise
+
+    def release_client(self, client: str) -> None:
+        self._client_semaphores[client].release()
+        self._client_users[client] -= 1
+
+    def _evict_idle(self) -> None:
+        """定期删除空闲调用方的状态：令牌桶已经补满、没有进行中的请求时删除和重新创建没有区别"""
+        now = time.monotonic()
+        if now - self._evicted_at < _CLIENT_EVICT_INTERVAL:
+            return
+        self._evicted_at = now
+        for client, bucket in list(self._client_buckets.items()):
+            if bucket.wait_time(bucket.capacity) == 0:
+                del self._client_buckets[client]
+        for client in [client for client, users in self._client_users.items() if users == 0]:
+            del self._client_users[client]
+            del self._client_semaphores[client]
+
+    async def _acquire(self, buckets: List[TokenBucket], amounts: List[float], what: str) -> None:
+        if any(bucket.wait_time(n) > 0 for bucket, n in zip(buckets, amounts)):
+            self.stats["queued"] += 1
+        try:
+            await acquire_all(buckets, amounts, settings.admission_max_wait, what)
+        except RateLimitExceededError:
+            self.stats["rejected"] += 1
+            raise
+        self.stats["admitted"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "clients": len(self._client_semaphores),
+            "providers": {
+                key: {name: round(bucket.tokens, 1) for name, bucket in group.items()}
+                for key, group in self._provider_buckets.items() if group
+            },
+        }
+
+
+def estimate_tokens(messages: List[Dict[str, str]], completion_tokens: int = None) -> int:
+    """粗略估算：每 3 个字符约 1 个 token，再加上预留的输出 token"""
+    prompt = sum(len(m.get("content") or "") for m in messages) // 3
+    return prompt + (completion_tokens if completion_tokens is not None else settings.rate_limit_completion_tokens)
+
+
+rate_limiter = RateLimiter()
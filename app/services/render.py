@@ -0,0 +1,72 @@
+"""视频渲染
+
+这里的函数在进程池中执行，只依赖 moviepy / Pillow，不要引入服务层的模块，
+避免子进程导入时初始化客户端等全局状态。
+"""
+import wave
+from typing import Tuple
+
+
+def parse_resolution(resolution: str) -> Tuple[int, int]:
+    """'1024*1024' / '1280x720' -> (宽, 高)"""
+    w, h = resolution.replace("x", "*").split("*")
+    return int(w), int(h)
+
+
+def render_segment_clip(image_path: str, audio_path: str, output_path: str, size: Tuple[int, int], fps: int = 24) -> float:
+    """把一张图片和一段音频合成为一个视频片段
+
+    Returns:
+        float: 片段时长（秒）
+    """
+    from moviepy import AudioFileClip, ImageClip
+
+    audio = AudioFileClip(audio_path)
+    clip = ImageClip(image_path).resized(new_size=size).with_duration(audio.duration).with_audio(audio)
+    try:
+        clip.write_videofile(
+            output_path,
+            fps=fps,
+            codec="libx264",
+            audio_codec="aac",
+            preset="veryfast",
+            threads=1,
+            logger=None,
+        )
+        return audio.duration
+    finally:
+        clip.close()
+        audio.close()
+
+
+def concat_clips(clip_paths: list, output_path: str, fps: int = 24) -> None:
+    """按顺序拼接视频片段"""
+    from moviepy import VideoFileClip, concatenate_videoclips
+
+    clips = [VideoFileClip(path) for path in clip_paths]
+    try:
+        final = concatenate_videoclips(clips)
+        final.write_videofile(output_path, fps=fps, codec="libx264", audio_codec="aac", preset="veryfast", logger=None)
+    finally:
+        for clip in clips:
+            clip.close()
+
+
+def write_stub_image(path: str, size: Tuple[int, int], index: int, text: str = "") -> None:
+    """测试模式使用的占位图"""
+    from PIL import Image, ImageDraw
+
+    colors = [(244, 162, 97), (42, 157, 143), (233, 196, 106), (38, 70, 83), (231, 111, 81)]
+    image = Image.new("RGB", size, colors[index % len(colors)])
+    ImageDraw.Draw(image).text((20, 20), f"#{index + 1} {text[:40]}", fill=(255, 255, 255))
+    image.save(path)
+
+
+def write_stub_audio(path: str, duration: float, sample_rate: int = 16000) -> None:
+    """测试模式使用的静音音频（wav）"""
+    frames = int(duration * sample_rate)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(b"\x00\x00" * frames)
@@ -0,0 +1,246 @@
+import asyncio
+import random
+import sys
+import time
+from collections import deque
+from contextlib import AsyncExitStack
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+from loguru import logger
+
+from app.config import get_settings
+from app.exceptions import LLMProviderUnavailableError, RateLimitExceededError
+
+settings = get_settings()
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+Call = Callable[[], Awaitable[Any]]
+# 发起请求之前需要进入的上下文（限流令牌、并发信号量），等待时间不计入单次尝试的超时和延迟
+Slot = Callable[[], AsyncContextManager]
+
+
+def is_retryable(e: BaseException) -> bool:
+    """超时、连接错误、限流和 5xx 可以重试，其余错误（参数错误、鉴权失败等）直接抛出"""
+    if isinstance(e, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    # openai 在第一次创建客户端时才导入，没有导入时不可能出现它的异常
+    openai = sys.modules.get("openai")
+    if openai is not None and isinstance(e, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    status = getattr(e, "status_code", None)
+    return status in RETRYABLE_STATUS
+
+
+def retry_after(e: BaseException) -> Optional[float]:
+    """从 429/503 的 Retry-After 头中取等待秒数"""
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """熔断器：连续失败达到阈值后打开，冷却时间过后放一个探测请求（半开），成功则关闭"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> Tuple[bool, bool]:
+        """
+        Returns:
+            Tuple[bool, bool]: (是否放行, 是否为半开状态下的探测请求)；探测请求没有结论时需要调用 release_probe
+        """
+        if self.state == self.CLOSED:
+            return True, False
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True, True
+        return False, False
+
+    def remaining(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def release_probe(self) -> None:
+        """探测请求被取消或失败原因与供应商无关，没有结论，下一个请求可以重新探测"""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self, probe: bool = False) -> None:
+        """probe 为 True 表示失败的是探测请求；其他请求的失败不影响正在进行的探测"""
+        if probe:
+            self._probing = False
+        self.failures += 1
+        if self.state == self.OPEN:
+            # 已经打开时不重新计时，打开前发出的请求陆续失败不会推迟恢复
+            return
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            logger.warning(f"circuit opened after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class ProviderHealth:
+    """单个供应商的熔断器、延迟窗口和计数"""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(settings.breaker_failure_threshold, settings.breaker_reset_timeout)
+        self.latencies: deque = deque(maxlen=200)
+        self.stats = {"calls": 0, "successes": 0, "failures": 0, "retries": 0, "timeouts": 0, "rejected": 0, "hedges": 0, "hedge_wins": 0}
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < settings.hedge_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "breaker": self.breaker.state, "p95_ms": int(self.p95() * 1000) if self.p95() else None}
+
+
+class Resilience:
+    """供应商调用的超时、重试、熔断和对冲请求
+
+    - 每次尝试的超时不超过剩余的截止时间，排队等待限流和并发的时间不计入单次尝试
+    - 可重试错误按带抖动的指数退避重试，优先使用 Retry-After
+    - 每个供应商一个熔断器，打开期间直接拒绝，不再占用 worker
+    - 配置了对冲供应商时，主请求耗时超过 p95 仍未返回就向对冲供应商并发一个请求，先成功的生效
+    """
+
+    def __init__(self):
+        self._health: Dict[str, ProviderHealth] = {}
+
+    def health(self, provider: str) -> ProviderHealth:
+        if provider not in self._health:
+            self._health[provider] = ProviderHealth()
+        return self._health[provider]
+
+    async def call(self, provider: str, fn: Call, *, slot: Optional[Slot] = None, hedge: Optional[Tuple[str, Call, Optional[Slot]]] = None, deadline: Optional[float] = None) -> Any:
+        """
+        Args:
+            provider: 供应商名称
+            fn: 发起一次请求的函数，每次重试都会重新调用
+            slot: 每次尝试之前进入的上下文，如限流和并发控制
+            hedge: (对冲供应商, 请求函数, slot)
+            deadline: time.monotonic() 截止时间，默认 settings.llm_deadline 秒后
+        """
+        deadline = deadline or time.monotonic() + settings.llm_deadline
+        primary = asyncio.ensure_future(self._call_with_retry(provider, fn, deadline, slot=slot))
+        tasks = [primary]
+        try:
+            p95 = self.health(provider).p95() if hedge is not None else None
+            if p95 is None:
+                return await primary
+            done, _ = await asyncio.wait({primary}, timeout=p95)
+            if done:
+                return primary.result()
+
+            hedge_provider, hedge_fn, hedge_slot = hedge
+            logger.info(f"{provider} slower than p95 ({p95:.2f}s), hedging to {hedge_provider}")
+            self.health(provider).stats["hedges"] += 1
+            secondary = asyncio.ensure_future(self._call_with_retry(hedge_provider, hedge_fn, deadline, slot=hedge_slot, retries=0))
+            tasks.append(secondary)
+            pending = {primary, secondary}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            self.health(provider).stats["hedge_wins"] += 1
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # 已经有结果、出错或调用方被取消（如客户端断开）时停止还在进行的请求
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _call_with_retry(self, provider: str, fn: Call, deadline: float, slot: Optional[Slot] = None, retries: int = None) -> Any:
+        health = self.health(provider)
+        retries = settings.llm_max_retries if retries is None else retries
+        attempt = 0
+        while True:
+            allowed, probe = health.breaker.allow()
+            if not allowed:
+                health.stats["rejected"] += 1
+                raise LLMProviderUnavailableError(f"Provider {provider} circuit is open", retry_after=health.breaker.remaining())
+            try:
+                async with AsyncExitStack() as stack:
+                    if slot is not None:
+                        # 排队等待限流和并发不计入单次尝试的超时，只受总截止时间约束
+                        try:
+                            await asyncio.wait_for(stack.enter_async_context(slot()), timeout=max(0.0, deadline - time.monotonic()))
+                        except asyncio.TimeoutError:
+                            raise LLMProviderUnavailableError(f"Provider {provider} deadline exceeded while queued") from None
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise LLMProviderUnavailableError(f"Provider {provider} deadline exceeded")
+                    health.stats["calls"] += 1
+                    start = time.monotonic()
+                    result = await asyncio.wait_for(fn(), timeout=min(settings.llm_attempt_timeout, remaining))
+                    # 只统计上游调用本身的耗时，用于对冲阈值
+                    latency = time.monotonic() - start
+            except (asyncio.CancelledError, RateLimitExceededError, LLMProviderUnavailableError):
+                # 对冲中被取消、本地限流或超过截止时间，与供应商健康无关
+                if probe:
+                    health.breaker.release_probe()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    # 请求本身的问题（参数错误等），不能说明供应商已经恢复，也不计入失败
+                    if probe:
+                        health.breaker.release_probe()
+                    raise
+                health.stats["failures"] += 1
+                if isinstance(e, asyncio.TimeoutError):
+                    health.stats["timeouts"] += 1
+                health.breaker.record_failure(probe)
+                if attempt >= retries:
+                    raise
+                delay = retry_after(e) or random.uniform(0, min(settings.llm_backoff_max, settings.llm_backoff_base * 2 ** attempt))
+                if time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                health.stats["retries"] += 1
+                logger.warning(f"{provider} call failed ({type(e).__name__}: {e}), retry {attempt}/{retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            health.latencies.append(latency)
+            health.stats["successes"] += 1
+            health.breaker.record_success()
+            return result
+
+    def hedge_target(self, provider: str) -> Optional[Tuple[str, Optional[str]]]:
+        """settings.hedge_providers 中配置的对冲目标 (供应商, 模型)"""
+        target = settings.hedge_providers.get(provider)
+        if not target:
+            return None
+        name, _, model = target.partition(":")
+        return name, model or None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {provider: health.snapshot() for provider, health in self._health.items()}
+
+
+resilience = Resilience()
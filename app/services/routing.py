@@ -0,0 +1,146 @@
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.config import get_settings
+from app.exceptions import LLMProviderError, LLMProviderUnavailableError
+from app.services.provider import provider_registry
+from app.services.ratelimit import rate_limiter
+from app.services.resilience import CircuitBreaker, resilience
+
+settings = get_settings()
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class ProviderScore:
+    """单个供应商的延迟 / 错误率 EWMA 和延迟直方图"""
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, latency: float, error: bool) -> None:
+        alpha = settings.routing_ewma_alpha
+        self.error_rate = (1 - alpha) * self.error_rate + alpha * (1.0 if error else 0.0)
+        if error:
+            return
+        self.latency = latency if self.latency is None else (1 - alpha) * self.latency + alpha * latency
+        self.count += 1
+        self.sum += latency
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def score(self) -> float:
+        """越小越好；没有样本时视为 0，让新供应商有机会被选中"""
+        return (self.latency or 0.0) * (1 + 4 * self.error_rate)
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative, histogram = 0, {}
+        for bound, n in zip(list(LATENCY_BUCKETS) + ["+Inf"], self.buckets):
+            cumulative += n
+            histogram[str(bound)] = cumulative
+        return {
+            "ewma_latency_ms": int(self.latency * 1000) if self.latency is not None else None,
+            "ewma_error_rate": round(self.error_rate, 4),
+            "count": self.count,
+            "sum_seconds": round(self.sum, 3),
+            "histogram": histogram,
+        }
+
+
+class ProviderRouter:
+    """供应商池路由
+
+    请求中的供应商名称是 settings.provider_pools 中的池名时，按以下顺序挑选成员，失败自动切换到下一个：
+    1. 熔断中的排最后，错误率 EWMA 超过 routing_max_error_rate 的次之
+    2. 限流配额不足的、并发已满的往后排（本地便宜的供应商用满后溢出到付费供应商）
+    3. routing_strategy 为 priority 时按池中配置的顺序，为 latency 时按延迟 / 错误率 EWMA
+    """
+
+    def __init__(self):
+        self._scores: Dict[str, ProviderScore] = {}
+        self._decisions: deque = deque(maxlen=100)
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def is_pool(self, name: Optional[str]) -> bool:
+        return bool(name) and name in settings.provider_pools
+
+    def pools(self) -> List[str]:
+        return list(settings.provider_pools)
+
+    def members(self, pool: str) -> List[Tuple[str, Optional[str]]]:
+        members = []
+        for member in settings.provider_pools[pool]:
+            provider, _, model = member.partition(":")
+            members.append((provider, model or None))
+        return members
+
+    def score(self, provider: str) -> ProviderScore:
+        if provider not in self._scores:
+            self._scores[provider] = ProviderScore()
+        return self._scores[provider]
+
+    def candidates(self, pool: str, default_model: str) -> List[Tuple[str, str]]:
+        ranked = []
+        for position, (provider, model) in enumerate(self.members(pool)):
+            model = model or default_model
+            try:
+                provider_registry.config(provider)
+            except LLMProviderError:
+                continue
+            unavailable = resilience.health(provider).breaker.state == CircuitBreaker.OPEN
+            over_budget = rate_limiter.wait_time(provider, model) > 0
+            saturated = provider_registry.semaphore(provider).locked()
+            degraded = self.score(provider).error_rate >= settings.routing_max_error_rate
+            order = position if settings.routing_strategy == "priority" else self.score(provider).score()
+            ranked.append(((unavailable, degraded, over_budget or saturated, order), provider, model))
+        ranked.sort(key=lambda item: item[0])
+        return [(provider, model) for _, provider, model in ranked]
+
+    async def call(self, pool: str, fn: Callable[[str, str], Awaitable[Any]], default_model: str) -> Any:
+        """依次尝试池中的供应商，fn(provider, model) 发起一次调用"""
+        candidates = self.candidates(pool, default_model)
+        if not candidates:
+            raise LLMProviderError(f"No configured provider in pool {pool}")
+        errors = []
+        for attempt, (provider, model) in enumerate(candidates):
+            self._decide(pool, provider, model, "primary" if attempt == 0 else "fallback")
+            start = time.monotonic()
+            try:
+                result = await fn(provider, model)
+            except Exception as e:
+                self.score(provider).record(time.monotonic() - start, error=True)
+                logger.warning(f"pool {pool}: {provider} failed ({type(e).__name__}: {e}), trying next provider")
+                errors.append(f"{provider}: {e}")
+                continue
+            self.score(provider).record(time.monotonic() - start, error=False)
+            return result
+        raise LLMProviderUnavailableError(f"All providers in pool {pool} failed: {'; '.join(errors)}")
+
+    def _decide(self, pool: str, provider: str, model: str, reason: str) -> None:
+        counters = self.stats.setdefault(pool, {})
+        key = f"{provider}:{reason}"
+        counters[key] = counters.get(key, 0) + 1
+        self._decisions.append({"time": time.time(), "pool": pool, "provider": provider, "model": model, "reason": reason})
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "strategy": settings.routing_strategy,
+            "pools": settings.provider_pools,
+            "decisions": self.stats,
+            "recent": list(self._decisions)[-20:],
+            "providers": {provider: score.snapshot() for provider, score in self._scores.items()},
+        }
+
+
+provider_router = ProviderRouter()
@@ -0,0 +1,234 @@
+"""故事会话
+
+生成的故事连同请求参数保存为会话，每个场景有固定的 ID。用户只对个别场景不满意时，
+只重新生成这些场景的文本和 / 或配图，其他场景和它们的配图原样保留：
+改写文本是一次文本模型调用（只发送选中场景和相邻场景），配图每个选中场景一次调用。
+
+会话保存在 tasks/sessions/<hh>/<session_id>.json，持有其中配图的引用，
+超过 story_session_ttl 没有修改的会话由 StorageManager 清理。
+同一进程内对同一会话的修改按顺序执行；多个 worker 进程之间在写入时持有文件锁，
+重新读取并比较版本，文件已被其他进程修改时放弃本次修改。
+"""
+import asyncio
+import json
+import os
+import re
+import time
+import weakref
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from loguru import logger
+
+from app.config import get_settings
+from app.exceptions import StorySessionConflictError, StorySessionNotFoundError
+from app.models.const import RegenerateTarget, SegmentStatus
+from app.schemas.llm import StoryGenerationRequest
+from app.services.asset import asset_store
+from app.services.llm import images_status, llm_service
+from app.services.storage import storage_manager
+from app.utils.utils import get_uuid
+
+settings = get_settings()
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# 会话中每个场景保存的字段
+_SEGMENT_FIELDS = ("id", "text", "image_prompt", "url", "thumbnail_url", "status", "error")
+
+
+class StorySessionStore:
+    """故事会话的保存和部分场景重新生成，见模块说明"""
+
+    def __init__(self):
+        # 本进程内同一会话的修改按顺序执行，跨进程的并发修改由 _save 中的文件锁和版本比较发现
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.stats = {"created": 0, "regenerations": 0, "segments_regenerated": 0, "segments_reused": 0}
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(storage_manager.shard_dir("sessions", session_id), f"{session_id}.json")
+
+    async def create(self, request: StoryGenerationRequest, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        把 generate_story_with_images 的结果保存为会话
+
+        Args:
+            request (StoryGenerationRequest): 生成请求
+            result (Dict[str, Any]): generate_story_with_images 的返回值
+
+        Returns:
+            Dict[str, Any]: 会话，segments 中每个场景带 id，status 和 timings 与生成结果相同
+        """
+        now = time.time()
+        session = {
+            "session_id": get_uuid(True),
+            "version": 1,
+            "created_at": now,
+            "updated_at": now,
+            "request": request.model_dump(mode="json"),
+            "segments": [
+                {**{key: segment.get(key) for key in _SEGMENT_FIELDS}, "id": get_uuid(True)[:12]}
+                for segment in result["segments"]
+            ],
+        }
+        await self._save(session)
+        self.stats["created"] += 1
+        return {**session, "status": result["status"], "timings": result["timings"]}
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """读取会话，不存在或已被清理时返回 None"""
+        session = await self._load(session_id)
+        return {**session, "status": images_status(session["segments"])} if session is not None else None
+
+    async def regenerate(self, session_id: str, segment_ids: List[str], target: RegenerateTarget, instruction: Optional[str] = None, version: Optional[int] = None) -> Dict[str, Any]:
+        """
+        重新生成会话中的部分场景
+
+        - text: 改写文本，保留图片描述和配图
+        - image: 按原来的图片描述重新生成配图（不读缓存）
+        - both: 改写文本和图片描述，再按新的描述生成配图
+        配图失败的场景保留原来的配图，status 为 failed；文本改写失败时抛出异常，会话不变。
+
+        Args:
+            session_id (str): 会话ID
+            segment_ids (List[str]): 要重新生成的场景ID
+            target (RegenerateTarget): 重新生成哪一部分
+            instruction (Optional[str]): 改写要求，只用于文本
+            version (Optional[int]): 客户端看到的会话版本，为空时不检查
+
+        Returns:
+            Dict[str, Any]: 修改后的会话，regenerated 为重新生成的场景ID，timings 为各阶段耗时（毫秒）
+
+        Raises:
+            StorySessionNotFoundError: 会话或场景不存在
+            StorySessionConflictError: version 与当前版本不一致
+        """
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        async with lock:
+            return await self._regenerate(session_id, segment_ids, target, instruction, version)
+
+    async def _regenerate(self, session_id: str, segment_ids: List[str], target: RegenerateTarget, instruction: Optional[str], version: Optional[int]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        session = await self._load(session_id)
+        if session is None:
+            raise StorySessionNotFoundError(f"Story session {session_id} not found")
+        if version is not None and version != session["version"]:
+            raise StorySessionConflictError(f"Story session {session_id} is at version {session['version']}, not {version}")
+        positions = {segment["id"]: index for index, segment in enumerate(session["segments"])}
+        unknown = [segment_id for segment_id in segment_ids if segment_id not in positions]
+        if unknown:
+            raise StorySessionNotFoundError(f"Segments {', '.join(unknown)} not found in story session {session_id}")
+
+        request = StoryGenerationRequest(**session["request"])
+        segments = session["segments"]
+        indexes = sorted({positions[segment_id] for segment_id in segment_ids})
+        timings = {}
+
+        if target in (RegenerateTarget.text, RegenerateTarget.both):
+            t = time.perf_counter()
+            scenes = await llm_service.rewrite_segments(request, [segment["text"] for segment in segments], indexes, instruction)
+            for index, scene in zip(indexes, scenes):
+                segments[index]["text"] = scene["text"]
+                if target == RegenerateTarget.both:
+                    segments[index]["image_prompt"] = scene["image_prompt"]
+            timings["text_ms"] = int((time.perf_counter() - t) * 1000)
+
+        if target in (RegenerateTarget.image, RegenerateTarget.both):
+            t = time.perf_counter()
+            # 只换图时图片描述没变，跳过缓存才能得到不同的图片
+            use_cache = target == RegenerateTarget.both and request.use_cache
+            await asyncio.gather(*[self._regenerate_image(request, segments[index], use_cache) for index in indexes])
+            timings["image_ms"] = int((time.perf_counter() - t) * 1000)
+
+        session["version"] += 1
+        session["updated_at"] = time.time()
+        await self._save(session, expected_version=session["version"] - 1)
+        self.stats["regenerations"] += 1
+        self.stats["segments_regenerated"] += len(indexes)
+        self.stats["segments_reused"] += len(segments) - len(indexes)
+        timings["total_ms"] = int((time.perf_counter() - start) * 1000)
+        return {**session, "status": images_status(segments), "regenerated": [segments[index]["id"] for index in indexes], "timings": timings}
+
+    async def _regenerate_image(self, request: StoryGenerationRequest, segment: Dict[str, Any], use_cache: bool) -> None:
+        try:
+            url = await llm_service.generate_image(prompt=segment["image_prompt"], image_llm_provider=request.image_llm_provider or None, image_llm_model=request.image_llm_model or None, resolution=request.resolution, use_cache=use_cache)
+        except Exception as e:
+            logger.error(f"Failed to regenerate image for segment {segment['id']}: {e}")
+            segment.update(status=SegmentStatus.failed, error=str(e))
+            return
+        thumbnail_url = asset_store.thumbnail_url(url, settings.asset_thumbnail_widths[0]) if settings.asset_thumbnail_widths else None
+        segment.update(url=url, thumbnail_url=thumbnail_url, status=SegmentStatus.success, error=None)
+
+    async def _load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if not _SESSION_ID.match(session_id):
+            return None
+        path = self._path(session_id)
+        try:
+            session = json.loads(await asyncio.to_thread(_read_text, path))
+        except FileNotFoundError:
+            return None
+        storage_manager.touch(path)
+        return session
+
+    async def _save(self, session: Dict[str, Any], expected_version: Optional[int] = None) -> None:
+        """
+        写入会话
+
+        Args:
+            session (Dict[str, Any]): 会话
+            expected_version (Optional[int]): 修改前读到的版本，文件中的版本不同（被其他进程修改过）时不写入
+
+        Raises:
+            StorySessionConflictError: 会话已被其他进程修改
+        """
+        session_id = session["session_id"]
+        path = self._path(session_id)
+        text = json.dumps(session, ensure_ascii=False)
+        if not await asyncio.to_thread(_write_if_version, path, text, expected_version):
+            raise StorySessionConflictError(f"Story session {session_id} was modified concurrently")
+        # 替换会话持有的配图引用：不再使用的旧配图可以被清理
+        owner = f"session:{session_id}"
+        storage_manager.release(owner)
+        storage_manager.retain_all(session["segments"], owner, settings.story_session_ttl)
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self.stats)
+
+
+def _read_text(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _write_if_version(path: str, text: str, expected_version: Optional[int]) -> bool:
+    """持有 <session_id>.lock 的文件锁，文件中的版本仍是 expected_version 时原子替换，返回是否写入"""
+    tmp = f"{path}.{get_uuid(True)}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    lock_path = f"{os.path.splitext(path)[0]}.lock"
+    with open(lock_path, "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if expected_version is not None:
+                try:
+                    current = json.loads(_read_text(path))["version"]
+                except FileNotFoundError:
+                    current = None
+                if current != expected_version:
+                    os.remove(tmp)
+                    return False
+            os.replace(tmp, path)
+            return True
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+story_sessions = StorySessionStore()
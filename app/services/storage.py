@@ -0,0 +1,436 @@
+"""tasks 目录的存储管理：分片目录、引用计数、按容量 / 时间的 LRU 清理
+
+目录按 key 的前两位分片，避免单个目录下文件过多：
+- assets/<hh>/<sha256>.*            内容去重的图片（含缩略图、WebP 变体）
+- clips/<hh>/<key>.mp4, audio-*     可复用的视频片段和配音
+- cache/<kind>/<hh>/<key>.json      生成结果的磁盘缓存
+- outputs/<hh>/<task_id>/           每个视频任务的输出
+- sessions/<hh>/<session_id>.json   故事会话
+
+清理以「单元」为单位：一个资源哈希的所有文件、一个缓存条目、一个任务输出目录等。
+资源可能被多个缓存条目、任务结果共享，引用记录在 data/storage.db 中，仍被引用的资源不会被清理；
+缓存条目或任务输出被清理时释放它持有的引用。请求路径上只在内存中记录访问和引用变化，
+由后台任务批量写入数据库，清理在单独的线程中执行，多个 worker 进程通过文件锁保证同一时间只有一个在清理。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+from app.config import get_settings
+from app.utils.utils import state_path, task_dir, task_path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+settings = get_settings()
+
+_HEX_KEY = re.compile(r"^[0-9a-f]{32,}$")
+# 任务ID用作目录名，只允许字母、数字、下划线和连字符
+_TASK_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS access (unit TEXT PRIMARY KEY, last_access REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS refs (
+    unit TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (unit, owner)
+);
+CREATE INDEX IF NOT EXISTS idx_refs_owner ON refs (owner);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+# 只按时间清理、不因容量不足被淘汰的区域：故事会话是用户的编辑状态
+_AGE_ONLY_AREAS = ("sessions",)
+# 按单元整体（目录）清理的区域和单元所在的层级
+_DIR_UNITS = {"outputs": 3}
+_KNOWN_AREAS = ("assets", "clips", "cache", "outputs", "sessions")
+# 通过 /tasks 对外提供的区域，缓存、片段、会话等内部数据不对外访问
+_PUBLIC_AREAS = ("assets", "outputs")
+
+
+def shard(key: str) -> str:
+    """分片目录名：内容哈希取前两位，其他 key（任务 ID 等）先做哈希"""
+    if _HEX_KEY.match(key):
+        return key[:2]
+    return hashlib.md5(key.encode("utf-8")).hexdigest()[:2]
+
+
+def unit_of(rel: str) -> Optional[str]:
+    """tasks 下相对路径所属的清理单元，不属于任何区域的文件返回 None"""
+    parts = rel.replace(os.sep, "/").split("/")
+    area = parts[0]
+    if len(parts) == 1 or area not in _KNOWN_AREAS:
+        return None
+    depth = _DIR_UNITS.get(area)
+    if depth is not None:
+        return "/".join(parts[:depth]) if len(parts) > depth else None
+    # 文件单元：同一个 key 的文件（资源的缩略图、片段的元数据）一起清理
+    return "/".join(parts[:-1] + [parts[-1].split(".")[0]])
+
+
+def is_public(rel: str) -> bool:
+    """tasks 下相对路径是否可以通过 /tasks 访问：只有资源和任务输出"""
+    parts = rel.replace(os.sep, "/").split("/")
+    if len(parts) < 2 or any(part in ("", ".", "..") for part in parts):
+        return False
+    return parts[0] in _PUBLIC_AREAS
+
+
+def area_of(unit: str) -> str:
+    """单元所在的区域"""
+    return unit.split("/")[0]
+
+
+def owner_of(unit: str) -> Optional[str]:
+    """单元被清理时需要释放的引用持有者"""
+    parts = unit.split("/")
+    if parts[0] == "cache" and len(parts) >= 3:
+        return f"cache:{parts[1]}:{parts[-1]}"
+    if parts[0] == "outputs" and len(parts) == 3:
+        return f"task:{parts[2]}"
+    if parts[0] == "sessions" and len(parts) == 3:
+        return f"session:{parts[2]}"
+    return None
+
+
+def iter_task_urls(data: Any) -> Iterator[str]:
+    """遍历数据中所有 /tasks 地址"""
+    if isinstance(data, str):
+        if task_path(data) is not None:
+            yield data
+    elif isinstance(data, dict):
+        for value in data.values():
+            yield from iter_task_urls(value)
+    elif isinstance(data, list):
+        for item in data:
+            yield from iter_task_urls(item)
+
+
+class StorageManager:
+    """tasks 目录的存储管理，见模块说明"""
+
+    def __init__(self, root: str, db_path: str, lock_path: str):
+        self.root = root
+        # 引用数据库和清理锁放在 root 之外，不会通过 /tasks 被访问
+        self.db_path = db_path
+        self.lock_path = lock_path
+        self._db: Optional[sqlite3.Connection] = None
+        # 数据库读写和清理都在这个线程中执行
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self._touches: Dict[str, float] = {}
+        self._ref_ops: deque = deque()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"runs": 0, "skipped": 0, "evicted_units": 0, "evicted_bytes": 0, "errors": 0}
+        self.evictions: Dict[str, int] = {}
+        # 最近一次清理的扫描结果，可能由其他 worker 进程完成
+        self.last_gc: Optional[Dict[str, Any]] = None
+
+    def shard_dir(self, area: str, key: str) -> str:
+        """area 下 key 对应的分片目录（不存在时创建）"""
+        d = os.path.join(self.root, area, shard(key))
+        os.makedirs(d, exist_ok=True)
+        return d
+
+    def task_output_dir(self, task_id: str) -> str:
+        """任务输出目录，task_id 不是合法的任务ID（如包含路径分隔符）时抛出 ValueError"""
+        if not _TASK_ID.match(task_id):
+            raise ValueError(f"Invalid task id {task_id!r}")
+        return os.path.join(self.shard_dir("outputs", task_id), task_id)
+
+    def touch(self, path: str) -> None:
+        """记录一次访问（只写内存，后台批量写入），用于最近最少访问淘汰"""
+        unit = unit_of(os.path.relpath(path, self.root))
+        if unit is not None:
+            self._touches[unit] = time.time()
+
+    def touch_key(self, area: str, key: str) -> None:
+        """记录 shard_dir(area, key) 下以 key 命名的单元的一次访问，不访问文件系统"""
+        self._touches[f"{area}/{shard(key)}/{key}"] = time.time()
+
+    def retain(self, url: str, owner: str, ttl: float) -> None:
+        """
+        owner 引用了 url 指向的资源，ttl 秒内或 owner 被释放之前资源不会被清理
+
+        Args:
+            url (str): /tasks 地址，不是 /tasks 地址时忽略
+            owner (str): 引用持有者，如 cache:image:<key>、task:<task_id>
+            ttl (float): 引用的有效期（秒）
+        """
+        path = task_path(url)
+        unit = unit_of(os.path.relpath(path, self.root)) if path else None
+        # 任务结果引用自己的输出目录时不计数，输出目录随任务一起按 LRU 清理
+        if unit is not None and owner_of(unit) != owner:
+            self._ref_ops.append(("retain", unit, owner, time.time() + ttl))
+
+    def retain_all(self, data: Any, owner: str, ttl: float) -> None:
+        """数据中的所有 /tasks 地址都由 owner 引用"""
+        for url in iter_task_urls(data):
+            self.retain(url, owner, ttl)
+
+    def release(self, owner: str) -> None:
+        """释放 owner 持有的所有引用"""
+        self._ref_ops.append(("release", owner))
+
+    async def start(self) -> None:
+        await self._run(self._open)
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._run(self._flush)
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def collect(self) -> Dict[str, Any]:
+        """立即执行一次清理，其他进程正在清理时跳过"""
+        return await self._run(self._collect)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """磁盘占用（最近一次扫描）和本进程的清理统计"""
+        return {
+            **self.stats,
+            "evictions": dict(self.evictions),
+            "max_bytes": settings.storage_max_bytes,
+            "max_age": settings.storage_max_age,
+            "last_gc": self.last_gc,
+        }
+
+    async def _loop(self) -> None:
+        # 启动后先扫描一次，统计数据立即可用
+        while True:
+            try:
+                await self.collect()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"storage gc failed: {e}")
+            await asyncio.sleep(settings.storage_gc_interval)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # 以下方法在 storage 线程中执行
+
+    def _open(self) -> None:
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+
+    def _flush(self) -> None:
+        """把内存中的访问记录和引用变化写入数据库"""
+        if self._db is None:
+            return
+        touches, self._touches = self._touches, {}
+        ops = []
+        while self._ref_ops:
+            ops.append(self._ref_ops.popleft())
+        if not touches and not ops:
+            return
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT INTO access (unit, last_access) VALUES (?, ?) "
+                "ON CONFLICT(unit) DO UPDATE SET last_access = max(last_access, excluded.last_access)",
+                touches.items(),
+            )
+            for op in ops:
+                if op[0] == "retain":
+                    self._db.execute(
+                        "INSERT INTO refs (unit, owner, expires_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT(unit, owner) DO UPDATE SET expires_at = max(expires_at, excluded.expires_at)",
+                        op[1:],
+                    )
+                else:
+                    self._db.execute("DELETE FROM refs WHERE owner = ?", (op[1],))
+
+    def _read_meta(self, key: str) -> Optional[Any]:
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _collect(self) -> Dict[str, Any]:
+        self._open()
+        self._flush()
+        with _GcLock(self.lock_path) as locked:
+            if not locked:
+                self.stats["skipped"] += 1
+                self.last_gc = self._read_meta("last_gc")
+                return {"skipped": True}
+            self.last_gc = self._gc()
+            return self.last_gc
+
+    def _scan(self, now: float) -> Dict[str, Dict[str, Any]]:
+        """按单元汇总文件大小和最后修改时间，顺便删除写入中断留下的临时文件"""
+        units: Dict[str, Dict[str, Any]] = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                unit = unit_of(os.path.relpath(path, self.root))
+                if unit is None:
+                    continue
+                try:
+                    st = os.stat(path)
+                    if ".tmp" in name and now - st.st_mtime >= settings.storage_min_age:
+                        os.remove(path)
+                        self._count_eviction(unit, "orphan", st.st_size)
+                        continue
+                except OSError:
+                    continue
+                item = units.setdefault(unit, {"bytes": 0, "files": 0, "mtime": 0.0, "paths": []})
+                item["bytes"] += st.st_size
+                item["files"] += 1
+                item["mtime"] = max(item["mtime"], st.st_mtime)
+                item["paths"].append(path)
+        return units
+
+    def _count_eviction(self, unit: str, reason: str, size: int) -> None:
+        key = f"{area_of(unit)}:{reason}"
+        self.evictions[key] = self.evictions.get(key, 0) + 1
+        self.stats["evicted_units"] += 1
+        self.stats["evicted_bytes"] += size
+
+    def _evict(self, unit: str, item: Dict[str, Any], reason: str) -> None:
+        """删除单元的所有文件，释放它持有的引用"""
+        for path in item["paths"]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.stats["errors"] += 1
+                logger.warning(f"storage gc failed to remove {path}: {e}")
+        _remove_empty_dirs(item["paths"], self.root)
+        owner = owner_of(unit)
+        if owner is not None:
+            self._db.execute("DELETE FROM refs WHERE owner = ?", (owner,))
+        self._db.execute("DELETE FROM access WHERE unit = ?", (unit,))
+        self._count_eviction(unit, reason, item["bytes"])
+
+    def _gc(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        now = time.time()
+        units = self._scan(now)
+        access = dict(self._db.execute("SELECT unit, last_access FROM access").fetchall())
+        self._db.execute("DELETE FROM refs WHERE expires_at < ?", (now,))
+        usage: Dict[str, Dict[str, int]] = {}
+        for unit, item in units.items():
+            item["last_access"] = max(item["mtime"], access.get(unit, 0.0))
+            area = usage.setdefault(area_of(unit), {"bytes": 0, "files": 0, "units": 0})
+            area["bytes"] += item["bytes"]
+            area["files"] += item["files"]
+            area["units"] += 1
+        total = sum(item["bytes"] for item in units.values())
+        evicted = 0
+
+        def candidates() -> List[str]:
+            """未被引用、已过保护期的单元"""
+            referenced = {row[0] for row in self._db.execute("SELECT DISTINCT unit FROM refs")}
+            return [
+                unit for unit, item in units.items()
+                if unit not in referenced and now - item["mtime"] >= settings.storage_min_age
+            ]
+
+        def evict(unit: str, reason: str) -> None:
+            nonlocal total, evicted
+            item = units.pop(unit)
+            self._evict(unit, item, reason)
+            total -= item["bytes"]
+            evicted += 1
+
+        # 过期：缓存条目超过缓存 TTL，故事会话超过 story_session_ttl 没有修改，其他单元超过 storage_max_age 未被访问
+        for unit in candidates():
+            item = units[unit]
+            if unit.startswith("cache/") and item["mtime"] + settings.cache_ttl < now:
+                evict(unit, "expired")
+            elif unit.startswith("sessions/") and item["mtime"] + settings.story_session_ttl < now:
+                evict(unit, "expired")
+            elif settings.storage_max_age and item["last_access"] < now - settings.storage_max_age:
+                evict(unit, "age")
+
+        # 超出容量：按最后访问时间淘汰到低水位；缓存条目和任务输出被清理后释放的资源在下一轮参与淘汰
+        if settings.storage_max_bytes and total > settings.storage_max_bytes:
+            target = settings.storage_max_bytes * settings.storage_low_watermark
+            for _ in range(3):
+                ranked = sorted(
+                    (unit for unit in candidates() if area_of(unit) not in _AGE_ONLY_AREAS),
+                    key=lambda unit: units[unit]["last_access"],
+                )
+                for unit in ranked:
+                    if total <= target:
+                        break
+                    evict(unit, "size")
+                if total <= target or not ranked:
+                    break
+            if total > settings.storage_max_bytes:
+                logger.warning(f"storage usage {total} bytes still exceeds quota {settings.storage_max_bytes}, remaining files are referenced or too recent")
+
+        self.stats["runs"] += 1
+        result = {
+            "at": now,
+            "duration_ms": int((time.perf_counter() - start) * 1000),
+            "total_bytes": total,
+            "usage": usage,
+            "units": len(units),
+            "evicted": evicted,
+            "referenced": self._db.execute("SELECT COUNT(DISTINCT unit) FROM refs").fetchone()[0],
+        }
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_gc', ?)", (json.dumps(result),))
+        if evicted:
+            logger.info(f"storage gc evicted {evicted} units, {total} bytes in use, took {result['duration_ms']}ms")
+        return result
+
+
+class _GcLock:
+    """跨进程的非阻塞文件锁，拿不到锁时说明其他 worker 正在清理"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self) -> bool:
+        if fcntl is None:
+            return True
+        self._file = open(self.path, "a")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self._file.close()
+            self._file = None
+            return False
+
+    def __exit__(self, *exc) -> None:
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+
+
+def _remove_empty_dirs(paths: List[str], root: str) -> None:
+    """删除清理后变空的目录（任务输出目录、分片目录），不删除 root"""
+    for directory in sorted({os.path.dirname(path) for path in paths}, key=len, reverse=True):
+        while directory != root and directory.startswith(root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+
+storage_manager = StorageManager(task_dir(), db_path=state_path("storage.db"), lock_path=state_path("storage.lock"))
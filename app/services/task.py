@@ -0,0 +1,256 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+from loguru import logger
+from pydantic import BaseModel
+
+from app.config import get_settings
+from app.models.const import (
+    SERVER_STARTED_AT_ENV,
+    TASK_STATE_CANCELLED,
+    TASK_STATE_COMPLETE,
+    TASK_STATE_FAILED,
+    TASK_STATE_PENDING,
+    TASK_STATE_PROCESSING,
+    TaskKind,
+)
+from app.schemas.llm import StoryGenerationRequest
+from app.schemas.video import VideoGenerateRequest
+from app.services.llm import llm_service
+from app.services.storage import storage_manager
+from app.services.video import generate_video
+from app.utils.utils import get_uuid, state_path
+
+settings = get_settings()
+
+TaskHandler = Callable[[str, BaseModel], Awaitable[Any]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    tenant TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_pending ON tasks (state, tenant, priority DESC, created_at);
+"""
+
+_COLUMNS = ("id", "kind", "tenant", "priority", "state", "params", "result", "error", "created_at", "started_at", "finished_at")
+
+
+class TaskManager:
+    """后台任务队列
+
+    任务持久化在 data/tasks.db（SQLite），重启后未完成的任务会重新排队。
+    多个 worker 进程共享同一个任务库，认领任务时以数据库中的状态为准，同一个任务只会被一个进程执行。
+    固定数量的 worker 从队列取任务执行：优先级高的先执行，同优先级时在租户之间轮转，
+    并限制单个租户同时运行的任务数，避免一个租户占满全部 worker。
+    """
+
+    def __init__(self, db_path: str, workers: int, max_running_per_tenant: int):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_running_per_tenant = max_running_per_tenant
+        self._handlers: Dict[str, Tuple[Type[BaseModel], TaskHandler]] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        # 所有数据库操作在同一个线程中执行
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-db")
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._workers: list = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancelled: set = set()
+        self._running_per_tenant: Dict[str, int] = {}
+        self._last_served: Dict[str, float] = {}
+
+    def register(self, kind: str, schema: Type[BaseModel], handler: TaskHandler) -> None:
+        """注册任务类型，handler(task_id, params) 的返回值需要能被 JSON 序列化"""
+        self._handlers[kind] = (schema, handler)
+
+    def validate(self, kind: str, params: Dict[str, Any]) -> BaseModel:
+        schema, _ = self._handlers[kind]
+        return schema(**params)
+
+    async def start(self) -> None:
+        await self._call(self._open)
+        # 上次退出时正在执行的任务重新排队；多 worker 时只处理服务启动之前开始的任务，不影响其他 worker 刚认领的任务
+        started_at = float(os.environ.get(SERVER_STARTED_AT_ENV) or time.time())
+        await self._execute(
+            "UPDATE tasks SET state = ?, started_at = NULL WHERE state = ? AND (started_at IS NULL OR started_at < ?)",
+            (TASK_STATE_PENDING, TASK_STATE_PROCESSING, started_at),
+        )
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._wakeup.set()
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def submit(self, kind: str, params: BaseModel, *, tenant: str = "default", priority: int = 0) -> str:
+        task_id = get_uuid(True)
+        await self._execute(
+            "INSERT INTO tasks (id, kind, tenant, priority, state, params, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (task_id, kind, tenant, priority, TASK_STATE_PENDING, params.model_dump_json(), time.time()),
+        )
+        self._wakeup.set()
+        return task_id
+
+    async def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        rows = await self._query(f"SELECT {', '.join(_COLUMNS)} FROM tasks WHERE id = ?", (task_id,))
+        if not rows:
+            return None
+        task = dict(zip(_COLUMNS, rows[0]))
+        task["result"] = json.loads(task["result"]) if task["result"] else None
+        return task
+
+    async def cancel(self, task_id: str) -> bool:
+        """取消排队中或执行中的任务，任务已结束时返回 False"""
+        async with self._lock:
+            task = await self.get(task_id)
+            if task is None or task["state"] not in (TASK_STATE_PENDING, TASK_STATE_PROCESSING):
+                return False
+            await self._finish(task_id, TASK_STATE_CANCELLED, error="cancelled")
+        running = self._running.get(task_id)
+        if running is not None:
+            self._cancelled.add(task_id)
+            running.cancel()
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "running": len(self._running), "running_per_tenant": dict(self._running_per_tenant)}
+
+    async def _worker(self) -> None:
+        while True:
+            claimed = await self._claim()
+            if claimed is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(*claimed)
+
+    async def _claim(self) -> Optional[Tuple[str, str, str, str]]:
+        """按 优先级 > 租户当前运行数 > 租户上次被调度时间 选出下一个任务并标记为处理中"""
+        async with self._lock:
+            # 每个租户排在最前面的任务
+            heads = await self._query(
+                "SELECT id, kind, tenant, params, priority FROM ("
+                " SELECT id, kind, tenant, params, priority,"
+                " ROW_NUMBER() OVER (PARTITION BY tenant ORDER BY priority DESC, created_at ASC) AS rn"
+                " FROM tasks WHERE state = ?"
+                ") WHERE rn = 1",
+                (TASK_STATE_PENDING,),
+            )
+            candidates = [
+                row for row in heads
+                if self._running_per_tenant.get(row[2], 0) < self.max_running_per_tenant
+            ]
+            if not candidates:
+                return None
+            candidates.sort(key=lambda row: (-row[4], self._running_per_tenant.get(row[2], 0), self._last_served.get(row[2], 0)))
+            for task_id, kind, tenant, params, _ in candidates:
+                # 其他 worker 进程可能已经认领了这个任务
+                claimed = await self._update(
+                    "UPDATE tasks SET state = ?, started_at = ? WHERE id = ? AND state = ?",
+                    (TASK_STATE_PROCESSING, time.time(), task_id, TASK_STATE_PENDING),
+                )
+                if claimed:
+                    self._running_per_tenant[tenant] = self._running_per_tenant.get(tenant, 0) + 1
+                    self._last_served[tenant] = time.monotonic()
+                    return task_id, kind, tenant, params
+            return None
+
+    async def _run(self, task_id: str, kind: str, tenant: str, params: str) -> None:
+        try:
+            if kind not in self._handlers:
+                raise ValueError(f"Unknown task kind: {kind}")
+            schema, handler = self._handlers[kind]
+            runner = asyncio.create_task(handler(task_id, schema.model_validate_json(params)))
+            self._running[task_id] = runner
+            result = await runner
+            await self._finish(task_id, TASK_STATE_COMPLETE, result=result)
+        except asyncio.CancelledError:
+            # 任务被取消时状态已在 cancel 中更新；worker 自身被取消（关闭服务）时任务留在处理中，重启后重新排队
+            if task_id not in self._cancelled:
+                raise
+        except Exception as e:
+            logger.error(f"Task {task_id} ({kind}) failed: {e}")
+            await self._finish(task_id, TASK_STATE_FAILED, error=str(e))
+        finally:
+            self._running.pop(task_id, None)
+            self._cancelled.discard(task_id)
+            self._running_per_tenant[tenant] -= 1
+            self._wakeup.set()
+
+    async def _finish(self, task_id: str, state: int, *, result: Any = None, error: str = None) -> None:
+        # 已取消的任务不再覆盖状态
+        await self._execute(
+            "UPDATE tasks SET state = ?, result = ?, error = ?, finished_at = ? WHERE id = ? AND state != ?",
+            (state, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(), task_id, TASK_STATE_CANCELLED),
+        )
+        if result is not None:
+            # 结果中引用的图片等资源至少保留 storage_task_ref_ttl
+            storage_manager.retain_all(result, f"task:{task_id}", settings.storage_task_ref_ttl)
+
+    def _open(self) -> None:
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    async def _call(self, fn: Callable[[], Any]) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, fn)
+
+    async def _execute(self, sql: str, args: tuple = ()) -> None:
+        await self._call(lambda: self._db.execute(sql, args))
+
+    async def _update(self, sql: str, args: tuple = ()) -> int:
+        """执行更新，返回影响的行数"""
+        return await self._call(lambda: self._db.execute(sql, args).rowcount)
+
+    async def _query(self, sql: str, args: tuple = ()) -> list:
+        return await self._call(lambda: self._db.execute(sql, args).fetchall())
+
+
+task_manager = TaskManager(
+    db_path=state_path("tasks.db"),
+    workers=settings.task_workers,
+    max_running_per_tenant=settings.task_max_running_per_tenant,
+)
+
+
+async def _run_story(task_id: str, request: StoryGenerationRequest) -> Dict[str, Any]:
+    return {"segments": await llm_service.generate_story(request)}
+
+
+async def _run_story_with_images(task_id: str, request: StoryGenerationRequest) -> Dict[str, Any]:
+    return await llm_service.generate_story_with_images(request)
+
+
+async def _run_video(task_id: str, request: VideoGenerateRequest) -> Dict[str, Any]:
+    # 视频输出到 tasks/outputs/<hh>/<task_id>/，目录名只使用服务端生成的任务ID
+    request.task_id = task_id
+    return await generate_video(request)
+
+
+task_manager.register(TaskKind.story, StoryGenerationRequest, _run_story)
+task_manager.register(TaskKind.story_with_images, StoryGenerationRequest, _run_story_with_images)
+task_manager.register(TaskKind.video, VideoGenerateRequest, _run_video)
@@ -1,13 +1,289 @@
 import app.schemas.video as video_schema
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import os
 import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
 
-async def generate_video(request: video_schema.VideoGenerateRequest):
+from loguru import logger
+
+from app.config import get_settings
+from app.models.const import ImageStyle
+from app.schemas.llm import StoryGenerationRequest
+from app.services import render, voice
+from app.services.llm import llm_service
+from app.services.provider import provider_registry
+from app.services.storage import is_public, storage_manager
+from app.utils.subtitle import build_srt
+from app.utils.utils import get_uuid, task_path, task_url
+
+settings = get_settings()
+
+IMAGE_STYLE_PROMPTS = {
+    ImageStyle.realistic: "photorealistic style",
+    ImageStyle.cartoon: "cartoon style",
+    ImageStyle.watercolor: "watercolor painting style",
+    ImageStyle.oil_painting: "oil painting style",
+}
+
+_render_pool: ProcessPoolExecutor = None
+
+
+def render_pool() -> ProcessPoolExecutor:
+    """视频编码在独立进程中执行，不占用事件循环所在进程的 GIL"""
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(max_workers=settings.video_render_workers, mp_context=multiprocessing.get_context("spawn"))
+    return _render_pool
+
+
+def shutdown_render_pool() -> None:
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+
+
+def _elapsed_ms(since: float) -> int:
+    return int((time.perf_counter() - since) * 1000)
+
+
+async def generate_video(request: video_schema.VideoGenerateRequest) -> Dict[str, Any]:
     """
-    生成视频
+    生成视频：故事 -> 每个场景并发生成配图和配音 -> 每个场景在进程池中编码 -> 拼接
     Args:
         request (video_schema.VideoGenerateRequest): 视频生成请求
+
+    Returns:
+        Dict[str, Any]: 视频、字幕和低码率版本（video_variants）的地址，场景列表和各阶段耗时（毫秒）
     """
-    try:
-        # 测试模式下，从 story.json 中读取请求参数
-        if request.test_mode:
-            request.task_id or str(int(time.time()))
\ No newline at end of file
+    start = time.perf_counter()
+    task_id = request.task_id or get_uuid()
+    output_dir = storage_manager.task_output_dir(task_id)
+    os.makedirs(output_dir, exist_ok=True)
+    size = render.parse_resolution(request.resolution or "1024*1024")
+    loop = asyncio.get_running_loop()
+
+    segments = await _story_segments(request, output_dir)
+    story_ms = _elapsed_ms(start)
+
+    async def build_segment(index: int, segment: Dict[str, Any]) -> Dict[str, Any]:
+        image_path = os.path.join(output_dir, f"segment-{index}.png")
+        timings = {}
+
+        async def timed(name, coro):
+            t = time.perf_counter()
+            result = await coro
+            timings[name] = _elapsed_ms(t)
+            return result
+
+        _, audio_path = await asyncio.gather(
+            timed("image_ms", _segment_image(request, index, segment, image_path, size)),
+            timed("tts_ms", _segment_audio(request, segment)),
+        )
+        # 文本、图片、配音参数、分辨率、风格都没变时直接复用之前渲染的片段
+        image_bytes = await asyncio.to_thread(_read_bytes, image_path)
+        clip_key = _clip_key(request, segment["text"], image_bytes)
+        clip_path = os.path.join(storage_manager.shard_dir("clips", clip_key), f"{clip_key}.mp4")
+        meta_path = f"{clip_path}.json"
+        t = time.perf_counter()
+        if os.path.exists(clip_path) and os.path.exists(meta_path):
+            duration = json.loads(await asyncio.to_thread(_read_text, meta_path))["duration"]
+            storage_manager.touch(clip_path)
+            reused = True
+        else:
+            tmp_path = clip_path.replace(".mp4", f".{get_uuid(True)}.tmp.mp4")
+            duration = await loop.run_in_executor(render_pool(), render.render_segment_clip, image_path, audio_path, tmp_path, size, settings.video_fps)
+            os.replace(tmp_path, clip_path)
+            await asyncio.to_thread(_write_text, meta_path, json.dumps({"duration": duration}))
+            reused = False
+        timings["render_ms"] = _elapsed_ms(t)
+        return {**segment, "duration": duration, "clip_path": clip_path, "reused": reused, "timings": timings}
+
+    segments_start = time.perf_counter()
+    built = await asyncio.gather(*[build_segment(i, segment) for i, segment in enumerate(segments)])
+    segments_ms = _elapsed_ms(segments_start)
+    reused = sum(1 for item in built if item["reused"])
+
+    t = time.perf_counter()
+    video_path = os.path.join(output_dir, "final.mp4")
+    clip_paths = [item["clip_path"] for item in built]
+    # 所有片段编码参数一致，直接流复制拼接；失败时退回重新编码
+    if not await _concat_copy(clip_paths, video_path, output_dir):
+        logger.warning(f"stream copy concat failed for {task_id}, re-encoding")
+        await loop.run_in_executor(render_pool(), render.concat_clips, clip_paths, video_path, settings.video_fps)
+    concat_ms = _elapsed_ms(t)
+
+    subtitle_path = os.path.join(output_dir, "subtitles.srt")
+    await asyncio.to_thread(_write_text, subtitle_path, build_srt([(item["text"], item["duration"]) for item in built]))
+
+    t = time.perf_counter()
+    variants = {}
+    for height in settings.video_variants:
+        variant_path = os.path.join(output_dir, f"final.{height}p.mp4")
+        if await _transcode_variant(video_path, variant_path, height):
+            variants[f"{height}p"] = task_url(variant_path)
+    variants_ms = _elapsed_ms(t)
+
+    timings = {"story_ms": story_ms, "segments_ms": segments_ms, "concat_ms": concat_ms, "variants_ms": variants_ms, "total_ms": _elapsed_ms(start)}
+    logger.info(f"video {task_id} generated, reused {reused}/{len(built)} segments, timings: {timings}")
+    return {
+        "task_id": task_id,
+        "video_url": task_url(video_path),
+        "subtitle_url": task_url(subtitle_path),
+        "variants": variants,
+        "reused_segments": reused,
+        "segments": [
+            {"text": item["text"], "image_prompt": item["image_prompt"], "duration": item["duration"], "reused": item["reused"], "timings": item["timings"]}
+            for item in built
+        ],
+        "timings": timings,
+    }
+
+
+async def _story_segments(request: video_schema.VideoGenerateRequest, output_dir: str) -> List[Dict[str, Any]]:
+    """故事场景：优先使用请求中的场景，测试模式下使用占位文本，否则调用大模型生成；结果写入任务目录下的 story.json"""
+    story_path = os.path.join(output_dir, "story.json")
+    if request.story_segments:
+        segments = [segment.model_dump(include={"text", "image_prompt", "url"}, exclude_none=True) for segment in request.story_segments]
+    elif request.test_mode:
+        prompt = request.story_prompt or "测试故事"
+        segments = [
+            {"text": f"{prompt}，第{i + 1}幕。这是测试模式的占位文本，用于离线验证视频流水线。", "image_prompt": f"placeholder scene {i + 1}"}
+            for i in range(request.segments)
+        ]
+    else:
+        segments = await llm_service.generate_story(StoryGenerationRequest(
+            text_llm_provider=request.text_llm_provider,
+            text_llm_model=request.text_llm_model,
+            segments=request.segments,
+            story_prompt=request.story_prompt,
+            language=request.language,
+            story_type=request.story_type,
+            resolution=request.resolution,
+        ))
+    await asyncio.to_thread(_write_text, story_path, json.dumps(segments, ensure_ascii=False, indent=2))
+    return segments
+
+
+async def _segment_image(request: video_schema.VideoGenerateRequest, index: int, segment: Dict[str, Any], path: str, size: Tuple[int, int]) -> None:
+    if segment.get("url"):
+        # 客户端传入的地址只能是本服务生成的 /tasks 资源，直接读本地文件，不向任意地址发起请求
+        local = task_path(segment["url"])
+        if local is None or not is_public(os.path.relpath(local, storage_manager.root)):
+            raise ValueError(f"Image url of segment {index} is not a generated asset: {segment['url']}")
+        data = await asyncio.to_thread(_read_bytes, local)
+        await asyncio.to_thread(_save_image, data, path, size)
+        return
+    if request.test_mode:
+        await asyncio.to_thread(render.write_stub_image, path, size, index, segment["image_prompt"])
+        return
+    else:
+        url = await llm_service.generate_image(
+            prompt=f"{segment['image_prompt']}, {IMAGE_STYLE_PROMPTS[request.image_style]}",
+            image_llm_provider=request.image_llm_provider,
+            image_llm_model=request.image_llm_model,
+            resolution=request.resolution,
+        )
+    local = task_path(url)
+    if local is not None:
+        data = await asyncio.to_thread(_read_bytes, local)
+    else:
+        # 配图下载到本地失败时 generate_image 返回供应商的地址
+        resp = await provider_registry.download_client().get(url)
+        resp.raise_for_status()
+        data = resp.content
+    await asyncio.to_thread(_save_image, data, path, size)
+
+
+async def _segment_audio(request: video_schema.VideoGenerateRequest, segment: Dict[str, Any]) -> str:
+    """配音按 文本 + 语音 + 语速 缓存在 tasks/clips/<hh>/ 下，返回音频路径"""
+    raw = json.dumps([segment["text"], request.voice_name, request.voice_rate, request.test_mode], ensure_ascii=False)
+    key = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    path = os.path.join(storage_manager.shard_dir("clips", key), f"audio-{key}.{'wav' if request.test_mode else 'mp3'}")
+    if os.path.exists(path):
+        storage_manager.touch(path)
+        return path
+    tmp_path = f"{path}.{get_uuid(True)}.tmp"
+    if request.test_mode:
+        # 按字数估算朗读时长
+        duration = max(2.0, len(segment["text"]) * 0.2 / request.voice_rate)
+        await asyncio.to_thread(render.write_stub_audio, tmp_path, duration)
+    else:
+        await voice.synthesize(segment["text"], request.voice_name, request.voice_rate, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _clip_key(request: video_schema.VideoGenerateRequest, text: str, image_bytes: bytes) -> str:
+    digest = hashlib.sha256()
+    digest.update(json.dumps([text, request.voice_name, request.voice_rate, request.resolution, request.image_style, request.test_mode, settings.video_fps], ensure_ascii=False).encode("utf-8"))
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+
+async def _transcode_variant(video_path: str, output_path: str, height: int) -> bool:
+    """生成指定高度、低码率的版本，供带宽有限的客户端使用"""
+    import imageio_ffmpeg
+
+    tmp_path = output_path.replace(".mp4", f".{get_uuid(True)}.tmp.mp4")
+    proc = await asyncio.create_subprocess_exec(
+        imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error", "-i", video_path,
+        "-vf", f"scale=-2:{height}", "-c:v", "libx264", "-preset", "veryfast", "-b:v", settings.video_variant_bitrate,
+        "-c:a", "aac", "-b:a", "64k", "-movflags", "+faststart", tmp_path,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        logger.warning(f"ffmpeg transcode to {height}p failed: {stderr.decode(errors='ignore')}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, output_path)
+    return True
+
+
+async def _concat_copy(clip_paths: List[str], output_path: str, work_dir: str) -> bool:
+    """ffmpeg concat demuxer 流复制拼接，不重新编码"""
+    import imageio_ffmpeg
+
+    list_path = os.path.join(work_dir, "concat.txt")
+    await asyncio.to_thread(_write_text, list_path, "".join(f"file '{path}'\n" for path in clip_paths))
+    proc = await asyncio.create_subprocess_exec(
+        imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-c", "copy", "-movflags", "+faststart", output_path,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        logger.warning(f"ffmpeg concat failed: {stderr.decode(errors='ignore')}")
+        return False
+    return True
+
+
+def _save_image(data: bytes, path: str, size: Tuple[int, int]) -> None:
+    from PIL import Image
+
+    Image.open(io.BytesIO(data)).convert("RGB").resize(size).save(path)
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _read_text(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _write_text(path: str, text: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
@@ -0,0 +1,23 @@
+import asyncio
+
+
+def edge_rate(voice_rate: float) -> str:
+    """1.0 -> '+0%'，1.25 -> '+25%'，0.8 -> '-20%'"""
+    return f"{round((voice_rate - 1) * 100):+d}%"
+
+
+async def synthesize(text: str, voice_name: str, voice_rate: float, output_path: str) -> None:
+    """使用 edge_tts 合成语音，输出 mp3"""
+    import edge_tts
+
+    communicate = edge_tts.Communicate(text, voice_name, rate=edge_rate(voice_rate))
+    audio = bytearray()
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            audio.extend(chunk["data"])
+    await asyncio.to_thread(_write, output_path, bytes(audio))
+
+
+def _write(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
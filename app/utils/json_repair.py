@@ -0,0 +1,76 @@
+"""修复模型输出中接近合法的 JSON
+
+只处理常见的小问题：Markdown 代码块、JSON 前后的说明文字、多余的逗号、被截断的结尾。
+"""
+import json
+import re
+from typing import Any
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.S)
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+
+def _strip_to_json(text: str) -> str:
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise ValueError("no JSON object or array found")
+    return text[min(starts):]
+
+
+def _close(text: str) -> str:
+    """去掉结尾不完整的部分并补齐未闭合的字符串和括号"""
+    stack, in_string, escaped = [], False, False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = text.rstrip()
+    # 截断在键或逗号之后时丢掉不完整的键值对
+    text = re.sub(r'(,\s*"[^"]*"\s*:?\s*|,\s*|:\s*)$', "", text)
+    return text + "".join(reversed(stack))
+
+
+def repair_json(text: str) -> Any:
+    """
+    尝试修复并解析接近合法的 JSON
+
+    Args:
+        text (str): 模型输出
+
+    Returns:
+        Any: 解析结果
+
+    Raises:
+        ValueError: 无法修复
+    """
+    if not text:
+        raise ValueError("empty output")
+    candidate = _strip_to_json(text)
+    # 只解析第一个完整的 JSON 值，丢掉之后的说明文字
+    for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+        try:
+            return json.JSONDecoder().raw_decode(attempt)[0]
+        except json.JSONDecodeError:
+            pass
+    closed = _close(candidate)
+    for attempt in (closed, _TRAILING_COMMA.sub(r"\1", closed)):
+        try:
+            return json.loads(attempt)
+        except json.JSONDecodeError as e:
+            error = e
+    raise ValueError(f"unable to repair JSON: {error}")
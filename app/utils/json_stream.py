@@ -0,0 +1,112 @@
+import json
+import re
+from typing import Any, List
+
+from app.utils.json_repair import repair_json
+
+_LIST_START = re.compile(r'"list"\s*:\s*\[')
+
+
+class StoryListParser:
+    """增量解析 LLM 流式输出中的 `list` 数组
+
+    每次 feed 一段文本，返回这段文本中新出现的、已经完整的数组元素。
+    兼容根节点直接是数组的输出；单个元素不是合法 JSON 时用 repair_json 修复，仍无法解析的元素跳过。
+    流结束后调用 close 取回被截断的最后一个元素；没有找到数组（started 为 False，根节点用了其他键名等）时
+    由调用方对 text 中的完整输出做修复。
+    """
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._buf = ""
+        self._pos = 0
+        self._in_array = False
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+        self._start = 0
+        self.done = False
+        # 无法解析而跳过的元素数
+        self.errors = 0
+
+    @property
+    def started(self) -> bool:
+        """是否已经找到数组的开头"""
+        return self._in_array
+
+    @property
+    def text(self) -> str:
+        """到目前为止收到的完整输出"""
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> List[Any]:
+        self._chunks.append(chunk)
+        self._buf += chunk
+        items = []
+        if self.done:
+            return items
+        if not self._in_array:
+            stripped = self._buf.lstrip()
+            if stripped.startswith("["):
+                self._pos = len(self._buf) - len(stripped) + 1
+            else:
+                m = _LIST_START.search(self._buf)
+                if not m:
+                    return items
+                self._pos = m.end()
+            self._in_array = True
+
+        buf = self._buf
+        while self._pos < len(buf):
+            ch = buf[self._pos]
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_str = False
+            elif ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                if self._depth == 0:
+                    self._start = self._pos
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:
+                    # 数组结束
+                    self.done = True
+                    self._pos += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    item = self._parse(buf[self._start:self._pos + 1])
+                    if item is not None:
+                        items.append(item)
+            self._pos += 1
+
+        # 丢掉已经解析过的内容，避免缓冲区无限增长
+        keep = self._start if self._depth > 0 else self._pos
+        self._buf = buf[keep:]
+        self._start -= keep
+        self._pos -= keep
+        return items
+
+    def close(self) -> List[Any]:
+        """流结束时调用：数组没有正常结束时修复并返回被截断的最后一个元素"""
+        if self.done or self._depth == 0:
+            return []
+        self.done = True
+        item = self._parse(self._buf[self._start:])
+        return [item] if item is not None else []
+
+    def _parse(self, fragment: str) -> Any:
+        try:
+            return json.loads(fragment)
+        except json.JSONDecodeError:
+            pass
+        try:
+            return repair_json(fragment)
+        except ValueError:
+            self.errors += 1
+            return None
@@ -0,0 +1,109 @@
+"""日志配置和大块内容（prompt、模型响应）的记录
+
+大块内容只在日志真正输出时才序列化（loguru 的 lazy 模式），默认只记录摘要和长度，
+需要排查问题时把 log_prompts 设为 full，并按 log_payload_sample_rate 采样记录完整内容。
+"""
+import atexit
+import hashlib
+import json
+import queue
+import random
+import sys
+import threading
+from typing import Any, TextIO
+
+from loguru import logger
+
+from app.config import get_settings
+
+settings = get_settings()
+
+LOG_FORMAT = "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+
+
+class BackgroundSink:
+    """把格式化好的日志放入进程内队列，由后台线程批量写入
+
+    loguru 自带的 enqueue 经过 multiprocessing 管道并 pickle 每条记录，调用方的开销比直接写文件还大，
+    这里只做一次入队，事件循环线程上没有 I/O。
+    """
+
+    def __init__(self, stream: TextIO, batch_size: int = 512):
+        self._stream = stream
+        self._batch_size = batch_size
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._drain, name="log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, message: str) -> None:
+        self._queue.put(message)
+
+    def _drain(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closed = None in batch
+            self._stream.write("".join(item for item in batch if item is not None))
+            self._stream.flush()
+            if closed:
+                return
+
+    def close(self) -> None:
+        """写完队列中剩余的日志"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+
+def setup_logging() -> None:
+    """
+    配置日志输出
+
+    log_enqueue 时由后台线程写入（BackgroundSink）；log_json 时每行输出一个 JSON，bind 的字段在 record.extra 中。
+    """
+    logger.remove()
+    options = dict(level=settings.log_level, serialize=settings.log_json, backtrace=False, diagnose=False)
+    streams = [sys.stderr]
+    if settings.log_file:
+        streams.append(open(settings.log_file, "a", encoding="utf-8"))
+    for stream in streams:
+        colorize = stream.isatty()
+        logger.add(BackgroundSink(stream) if settings.log_enqueue else stream, format=LOG_FORMAT, colorize=colorize, **options)
+
+
+def _dumps(payload: Any) -> str:
+    if hasattr(payload, "model_dump"):
+        payload = payload.model_dump(mode="json")
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _render(message: str, payload: Any, full: bool, fields: dict) -> str:
+    body = _dumps(payload)
+    parts = [message, *(f"{key}={value}" for key, value in fields.items())]
+    if full:
+        parts.append(body)
+    else:
+        parts.append(f"sha256={hashlib.sha256(body.encode('utf-8')).hexdigest()[:16]} chars={len(body)}")
+    return " ".join(parts)
+
+
+def log_payload(message: str, payload: Any, level: str = "DEBUG", **fields: Any) -> None:
+    """
+    记录 prompt / 响应等大块内容
+
+    Args:
+        message (str): 日志说明
+        payload (Any): 要记录的内容，可以是 pydantic 模型
+        level (str): 日志级别，低于配置级别时不会序列化 payload
+        fields: 附加的结构化字段
+    """
+    mode = settings.log_prompts
+    if mode == "off":
+        return
+    full = mode == "full" and random.random() < settings.log_payload_sample_rate
+    logger.opt(lazy=True, depth=1).bind(**fields).log(level, "{}", lambda: _render(message, payload, full, fields))
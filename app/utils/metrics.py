@@ -0,0 +1,270 @@
+"""进程内指标和阶段耗时
+
+指标按 Prometheus 文本格式导出（/api/metrics），不依赖 prometheus_client；
+配置了 otel_endpoint 且安装了 opentelemetry-sdk 时，span() 同时导出 OpenTelemetry trace。
+所有更新都在事件循环线程上进行，不加锁，一次更新只是一次字典查找和加法。
+"""
+import asyncio
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from app.config import get_settings
+
+settings = get_settings()
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# 抓取时由 collector 生成的样本：(指标名, 类型, 说明, [(标签, 值)])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, value: float = 1) -> None:
+        self.inc(*labels, value=-value)
+
+    def set(self, *labels: str, value: float) -> None:
+        self._values[labels] = value
+
+    @contextmanager
+    def track(self, *labels: str) -> Iterator[None]:
+        """进入时加一，退出时减一"""
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # 每组标签：[各桶计数..., +Inf 计数, 总和]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self._values.get(labels)
+        if counts is None:
+            counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, counts in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(counts[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], List[Sample]]] = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def _register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def collector(self, fn: Callable[[], List[Sample]]) -> None:
+        """注册抓取时才计算的指标，用于导出各服务已有的统计"""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            try:
+                samples = collect()
+            except Exception as e:
+                logger.warning(f"metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+                continue
+            for name, kind, help, values in samples:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values:
+                    lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.counter("http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+HTTP_DURATION = registry.histogram("http_request_duration_seconds", "HTTP request latency by route", ["method", "route"])
+UPSTREAM_REQUESTS = registry.counter("llm_upstream_requests_total", "Upstream provider calls by outcome", ["kind", "provider", "model", "outcome"])
+UPSTREAM_DURATION = registry.histogram("llm_upstream_duration_seconds", "Upstream provider call latency, one observation per attempt", ["kind", "provider", "model"])
+UPSTREAM_INFLIGHT = registry.gauge("llm_upstream_inflight", "Upstream provider calls in flight", ["kind", "provider"])
+TOKENS = registry.counter("llm_tokens_total", "Token usage reported by completion responses", ["provider", "model", "type"])
+STAGE_DURATION = registry.histogram("story_stage_duration_seconds", "Latency of each generation stage", ["stage"])
+STAGE_ERRORS = registry.counter("story_stage_errors_total", "Generation stages that raised", ["stage", "error"])
+STORY_OUTPUTS = registry.counter("story_outputs_total", "Story generations by how a valid output was obtained (clean, repaired, regenerated, incomplete, failed)", ["outcome"])
+OUTPUT_REPAIRS = registry.counter("story_output_repairs_total", "Local repairs and partial regenerations of model output", ["kind"])
+IMAGE_FAILURES = registry.counter("image_failures_total", "Failed image generations", ["provider", "error"])
+
+_tracer = None
+
+
+def setup_tracing() -> None:
+    """配置了 otel_endpoint 时启用 OpenTelemetry trace 导出（OTLP/HTTP），未安装 SDK 时只打印警告"""
+    global _tracer
+    if not settings.otel_endpoint:
+        return
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("otel_endpoint is set but opentelemetry-sdk / opentelemetry-exporter-otlp-proto-http is not installed, tracing disabled")
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": settings.otel_service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=settings.otel_endpoint)))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("story-generate")
+    logger.info(f"tracing exported to {settings.otel_endpoint}")
+
+
+@contextmanager
+def span(stage: str, **attributes) -> Iterator[None]:
+    """
+    记录一个阶段的耗时，异常时计入 story_stage_errors_total，启用 trace 时同时生成一个 span
+
+    Args:
+        stage (str): 阶段名，作为 story_stage_duration_seconds 的 stage 标签
+        attributes: trace span 的属性，不进入指标标签
+    """
+    start = time.perf_counter()
+    otel_span = _tracer.start_as_current_span(stage, attributes=attributes) if _tracer is not None else None
+    if otel_span is not None:
+        otel_span.__enter__()
+    try:
+        yield
+    except BaseException as e:
+        STAGE_ERRORS.inc(stage, type(e).__name__)
+        if otel_span is not None:
+            otel_span.__exit__(type(e), e, e.__traceback__)
+            otel_span = None
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage)
+        if otel_span is not None:
+            otel_span.__exit__(None, None, None)
+
+
+@contextmanager
+def upstream_call(kind: str, provider: str, model: Optional[str]) -> Iterator[None]:
+    """一次上游请求的计数、耗时和并发数"""
+    model = model or ""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        with UPSTREAM_INFLIGHT.track(kind, provider):
+            yield
+        outcome = "success"
+    except asyncio.CancelledError:
+        # 对冲请求中落败的一方、调用方断开
+        outcome = "cancelled"
+        raise
+    finally:
+        UPSTREAM_REQUESTS.inc(kind, provider, model, outcome)
+        UPSTREAM_DURATION.observe(time.perf_counter() - start, kind, provider, model)
+
+
+class MetricsMiddleware:
+    """按路由模板统计 HTTP 请求数和耗时（纯 ASGI 中间件，不缓冲响应体）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # 静态文件等挂载的子应用没有路由模板，按挂载路径统计，避免每个文件一个标签
+            path = route.path if route is not None else scope.get("root_path") or "unmatched"
+            HTTP_REQUESTS.inc(scope["method"], path, status)
+            HTTP_DURATION.observe(time.perf_counter() - start, scope["method"], path)
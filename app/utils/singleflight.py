@@ -0,0 +1,59 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """合并并发的相同请求
+
+    同一个 key 同时只会有一个上游调用，其余调用方等待并共享它的结果或异常。
+    调用方被取消（如客户端断开）时只退出等待，只有最后一个等待者离开时才取消共享的调用。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.stats = {"calls": 0, "shared": 0, "cancelled": 0}
+
+    @property
+    def inflight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.stats["calls"] += 1
+        else:
+            self.stats["shared"] += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done():
+                # 当前调用方被取消，共享的调用仍在进行
+                call.waiters -= 1
+                if call.waiters == 0:
+                    # 立即移除，之后到达的相同请求发起新的调用，而不是加入已取消的调用
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+                    call.task.cancel()
+                    self.stats["cancelled"] += 1
+            raise
+        else:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call) -> None:
+        # 只移除这一次调用，key 可能已经对应新的调用
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # 没有人等待时取出异常，避免 "exception was never retrieved" 警告
+        if not call.task.cancelled():
+            call.task.exception()
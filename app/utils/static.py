@@ -0,0 +1,225 @@
+"""/tasks 下生成结果（图片、视频、字幕）的访问
+
+- 以内容哈希命名的资源使用文件名作为强 ETag，并返回一年的 immutable 缓存头，其他文件每次向服务端确认
+- 支持单个区间的 Range 请求（视频拖动进度），服务器支持 ASGI zerocopysend / pathsend 扩展时由服务器直接发送文件
+- 配置了 asset_signing_key 时只能通过 sign_url 生成的带签名、未过期的地址访问
+- 客户端支持 WebP 且存在预生成的同名 .webp 时返回 WebP
+- 只提供资源和任务输出，缓存、片段、会话等内部文件返回 404
+"""
+import hashlib
+import hmac
+import os
+import re
+import time
+from typing import Any, Optional, Tuple
+from urllib.parse import parse_qs, urlencode
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, PlainTextResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Receive, Scope, Send
+
+from app.config import get_settings
+from app.services.asset import ASSET_NAME
+from app.services.storage import is_public, storage_manager
+
+settings = get_settings()
+
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _signature(path: str, expires: int) -> str:
+    message = f"{path}:{expires}".encode("utf-8")
+    return hmac.new(settings.asset_signing_key.encode("utf-8"), message, hashlib.sha256).hexdigest()[:32]
+
+
+def sign_url(url: str) -> str:
+    """
+    给 /tasks 地址加上过期时间和签名，未配置 asset_signing_key 或不是 /tasks 地址时原样返回
+
+    过期时间对齐到 asset_url_ttl 的时间窗口（剩余有效期在 ttl 到 2 倍 ttl 之间），
+    同一窗口内同一个文件的地址相同，CDN 和浏览器缓存仍然可以命中。
+    """
+    prefix = f"{settings.asset_base_url}/tasks/"
+    if not settings.asset_signing_key or not url.startswith(prefix) or "?" in url:
+        return url
+    ttl = settings.asset_url_ttl
+    expires = (int(time.time()) // ttl + 2) * ttl
+    path = url[len(prefix):]
+    return f"{url}?{urlencode({'expires': expires, 'sig': _signature(path, expires)})}"
+
+
+def sign_urls(data: Any) -> Any:
+    """对响应数据中所有 /tasks 地址签名（dict / list 递归处理）"""
+    if not settings.asset_signing_key:
+        return data
+    if isinstance(data, str):
+        return sign_url(data)
+    if isinstance(data, dict):
+        return {key: sign_urls(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [sign_urls(item) for item in data]
+    return data
+
+
+def verify_signature(path: str, query_string: bytes) -> bool:
+    """校验 /tasks 下相对路径 path 的签名和过期时间"""
+    query = parse_qs(query_string.decode("latin-1"))
+    try:
+        expires = int(query["expires"][0])
+        sig = query["sig"][0]
+    except (KeyError, IndexError, ValueError):
+        return False
+    return expires >= time.time() and hmac.compare_digest(sig, _signature(path, expires))
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单个区间的 Range 头
+
+    Returns:
+        Optional[Tuple[int, int]]: [start, end] 闭区间；没有 Range 头或格式不支持（多个区间等）时返回 None，按完整文件返回
+
+    Raises:
+        ValueError: 区间超出文件大小，应返回 416
+    """
+    match = RANGE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N：最后 N 个字节
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+class RangeFileResponse(FileResponse):
+    """支持 Range 的文件响应
+
+    服务器支持 http.response.zerocopysend 时交给服务器发送（sendfile），
+    支持 http.response.pathsend 时完整文件交给服务器发送，否则按 256KB 分块读取。
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.headers["accept-ranges"] = "bytes"
+        self.byte_range: Optional[Tuple[int, int]] = None
+
+    def set_range(self, start: int, end: int) -> None:
+        """只返回 [start, end] 区间，状态码改为 206"""
+        self.byte_range = (start, end)
+        self.status_code = 206
+        self.headers["content-range"] = f"bytes {start}-{end}/{self.stat_result.st_size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        start, end = self.byte_range or (0, self.stat_result.st_size - 1)
+        extensions = scope.get("extensions") or {}
+        if "http.response.pathsend" in extensions and self.byte_range is None:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+        with open(self.path, "rb") as file:
+            if "http.response.zerocopysend" in extensions:
+                await send({"type": "http.response.zerocopysend", "file": file, "offset": start, "count": end - start + 1, "more_body": False})
+                return
+            remaining = end - start + 1
+            position = start
+            while True:
+                chunk = await anyio.to_thread.run_sync(os.pread, file.fileno(), min(self.chunk_size, remaining), position)
+                position += len(chunk)
+                remaining -= len(chunk)
+                more_body = remaining > 0 and len(chunk) > 0
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                if not more_body:
+                    break
+
+
+class TaskStaticFiles(StaticFiles):
+    """/tasks 静态目录
+
+    以内容哈希命名的资源（tasks/assets/ 下）内容不会变化：使用文件名作为强 ETag，
+    并返回一年的 immutable 缓存头；其他文件需要每次向服务端确认。
+    响应支持 Range，配置了 asset_signing_key 时校验签名。
+    只提供 is_public 允许的文件，其他路径返回 404。
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if not is_public(path):
+            return PlainTextResponse("Not Found", status_code=404)
+        if settings.asset_signing_key and not verify_signature(path.replace(os.sep, "/"), scope.get("query_string", b"")):
+            return PlainTextResponse("Invalid or expired signature", status_code=403)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        # 最近被访问的文件在容量不足时最后清理
+        storage_manager.touch(full_path)
+        full_path, stat_result, vary = self._variant(full_path, stat_result, request_headers)
+        name = os.path.basename(full_path)
+        headers = {}
+        if vary:
+            headers["vary"] = "Accept"
+        if ASSET_NAME.match(name):
+            headers["etag"] = f'"{name}"'
+            headers["cache-control"] = IMMUTABLE
+        else:
+            # 其他文件按修改时间和大小生成强 ETag，文件被重新生成后 ETag 随之变化
+            version = hashlib.md5(f"{stat_result.st_mtime_ns}-{stat_result.st_size}".encode("utf-8"), usedforsecurity=False).hexdigest()
+            headers["etag"] = f'"{version}"'
+            headers["cache-control"] = "no-cache"
+        response = RangeFileResponse(full_path, status_code=status_code, stat_result=stat_result, method=scope["method"], headers=headers)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        if status_code == 200 and self._if_range_matches(response.headers, request_headers):
+            try:
+                byte_range = parse_range(request_headers.get("range"), stat_result.st_size)
+            except ValueError:
+                return Response(status_code=416, headers={"content-range": f"bytes */{stat_result.st_size}", "accept-ranges": "bytes"})
+            if byte_range is not None:
+                response.set_range(*byte_range)
+        return response
+
+    def _variant(self, full_path: str, stat_result: os.stat_result, request_headers: Headers) -> Tuple[str, os.stat_result, bool]:
+        """支持 WebP 的客户端请求 PNG / JPEG 资源时，存在预生成的同名 .webp 则返回它"""
+        stem, ext = os.path.splitext(full_path)
+        if ext.lower() not in (".png", ".jpg", ".jpeg") or not ASSET_NAME.match(os.path.basename(full_path)):
+            return full_path, stat_result, False
+        if "image/webp" in request_headers.get("accept", ""):
+            try:
+                return f"{stem}.webp", os.stat(f"{stem}.webp"), True
+            except OSError:
+                pass
+        return full_path, stat_result, settings.asset_webp_variant
+
+    def _if_range_matches(self, response_headers: Headers, request_headers: Headers) -> bool:
+        """If-Range 与当前版本不一致时忽略 Range，返回完整文件"""
+        if_range = request_headers.get("if-range")
+        if not if_range:
+            return True
+        return if_range in (response_headers.get("etag"), response_headers.get("last-modified"))
+
+    def is_not_modified(self, response_headers: Headers, request_headers: Headers) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        etag = response_headers.get("etag")
+        if if_none_match and etag:
+            candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return etag.removeprefix("W/") in candidates or "*" in candidates
+        return super().is_not_modified(response_headers, request_headers)
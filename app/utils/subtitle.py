@@ -0,0 +1,51 @@
+import re
+from typing import List, Tuple
+
+from app.models.const import PUNCTUATIONS
+
+# 多字符的标点（如 ...）优先匹配
+_SPLIT = re.compile("(" + "|".join(re.escape(p) for p in sorted(set(PUNCTUATIONS), key=len, reverse=True)) + ")")
+
+
+def split_sentences(text: str) -> List[str]:
+    """按 PUNCTUATIONS 切分字幕，标点保留在前一句末尾"""
+    parts = _SPLIT.split(text)
+    sentences = []
+    for part in parts:
+        if not part:
+            continue
+        if _SPLIT.fullmatch(part) and sentences:
+            sentences[-1] += part
+        elif part.strip():
+            sentences.append(part.strip())
+    return sentences
+
+
+def _srt_time(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    h, ms = divmod(ms, 3600000)
+    m, ms = divmod(ms, 60000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def build_srt(segments: List[Tuple[str, float]]) -> str:
+    """生成 srt 字幕
+
+    Args:
+        segments: (场景文本, 场景时长) 列表，每个场景内按句子字数平均分配时长
+    """
+    lines = []
+    start = 0.0
+    index = 1
+    for text, duration in segments:
+        sentences = split_sentences(text) or [text]
+        total = sum(len(s) for s in sentences) or 1
+        cursor = start
+        for sentence in sentences:
+            end = cursor + duration * len(sentence) / total
+            lines.append(f"{index}\n{_srt_time(cursor)} --> {_srt_time(end)}\n{sentence}\n")
+            index += 1
+            cursor = end
+        start += duration
+    return "\n".join(lines)
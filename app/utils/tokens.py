@@ -0,0 +1,52 @@
+"""token 计数
+
+安装了 tiktoken 时使用 o200k_base 编码精确计数，否则按字符估算：
+中日韩字符每个约 1 个 token，其余文本每 4 个字符约 1 个 token。
+"""
+import math
+import re
+from functools import lru_cache
+
+_CJK = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿＀-￯]")
+
+
+@lru_cache()
+def _encoding():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # 离线环境下可能无法下载编码文件
+        return None
+
+
+def tokenizer_name() -> str:
+    return "tiktoken/o200k_base" if _encoding() is not None else "estimate"
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """截断到不超过 max_tokens 个 token"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text)[:max_tokens])
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
@@ -15,4 +15,48 @@ def resource_dir(sub_dir: str = ""):
     d = os.path.join(get_root_dir(), "resource")
     if sub_dir:
         d = os.path.join(d, sub_dir)
-    return d
\ No newline at end of file
+    return d
+
+def task_dir(sub_dir: str = ""):
+    d = os.path.join(get_root_dir(), "tasks")
+    if sub_dir:
+        d = os.path.join(d, sub_dir)
+    if not os.path.exists(d):
+        os.makedirs(d, exist_ok=True)
+    return d
+
+
+def state_dir(sub_dir: str = ""):
+    """内部状态（数据库、锁、离线批处理清单）所在的目录，不通过 /tasks 对外提供"""
+    d = os.path.join(get_root_dir(), "data")
+    if sub_dir:
+        d = os.path.join(d, sub_dir)
+    if not os.path.exists(d):
+        os.makedirs(d, exist_ok=True)
+    return d
+
+
+def state_path(name: str) -> str:
+    """state_dir 下的文件路径"""
+    return os.path.join(state_dir(), name)
+
+
+def task_url(path: str) -> str:
+    """tasks 目录下文件对应的访问地址（/tasks 静态目录）"""
+    from app.config import get_settings
+    rel = os.path.relpath(path, task_dir()).replace(os.sep, "/")
+    return f"{get_settings().asset_base_url}/tasks/{rel}"
+
+
+def task_path(url: str):
+    """task_url / sign_url 的逆过程，非 /tasks 地址返回 None"""
+    from app.config import get_settings
+    prefix = f"{get_settings().asset_base_url}/tasks/"
+    if not url.startswith(prefix):
+        return None
+    # 签名地址带有查询参数
+    url = url.split("?", 1)[0]
+    path = os.path.realpath(os.path.join(task_dir(), url[len(prefix):]))
+    if not path.startswith(task_dir() + os.sep):
+        return None
+    return path
@@ -0,0 +1,70 @@
+"""并发基准：N 个并发 /api/llm/story-with-images 请求的总耗时
+
+用法: python -m benchmarks.bench_concurrency --requests 10 --latency 0.5
+
+上游换成本地固定延迟的假服务后，如果事件循环没有被阻塞，
+N 个并发请求的总耗时应接近一次请求的耗时（文本 + 图片，约 2 个延迟），而不是 N 倍；
+超过单次耗时的 --max-ratio 倍时以非零状态退出。
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Tuple
+
+from benchmarks.fake_server import FakeServer
+
+
+async def run(n: int, segments: int) -> Tuple[float, float]:
+    """先预热，再发一个请求作为单次耗时基线，最后同时发 n 个请求，返回 (单次耗时, 并发总耗时)"""
+    import httpx
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+        async def burst(count: int, label: str) -> float:
+            payload = {"segments": segments, "story_prompt": f"a little fox finds a lantern ({label})", "use_cache": False}
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[client.post("/api/llm/story-with-images", json=payload) for _ in range(count)])
+            elapsed = time.perf_counter() - start
+            failed = [r for r in responses if r.status_code != 200]
+            if failed:
+                raise SystemExit(f"{len(failed)} requests failed: {failed[0].text}")
+            return elapsed
+
+        # 第一次请求包含导入和建连，不计入基线
+        await burst(1, "warmup")
+        single = await burst(1, "baseline")
+        return single, await burst(n, "concurrent")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--segments", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.5)
+    # 并发总耗时超过单次请求耗时的倍数时判定为失败
+    parser.add_argument("--max-ratio", type=float, default=1.5)
+    args = parser.parse_args()
+
+    with FakeServer(latency=args.latency) as server:
+        os.environ.update({
+            "text_provider": "openai",
+            "image_provider": "openai",
+            "openai_api_key": "fake",
+            "openai_base_url": server.base_url,
+            # 所有请求来自同一个 IP，放开调用方限额，只测并发本身
+            "client_rpm": "0",
+            "client_max_concurrency": str(max(args.requests, 8)),
+        })
+        single, elapsed = asyncio.run(run(args.requests, args.segments))
+
+    print(f"requests={args.requests} segments={args.segments} upstream_latency={args.latency}s")
+    print(f"total={elapsed:.2f}s  single_request={single:.2f}s  serial~={single * args.requests:.2f}s")
+    if elapsed > single * args.max_ratio:
+        raise SystemExit(f"{args.requests} concurrent requests took {elapsed:.2f}s, more than {args.max_ratio}x a single request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""启动导入耗时：python -X importtime -c "import main"
+
+用法: python -m benchmarks.bench_importtime --runs 5 --top 15 [--max-ms 1500]
+
+每次在新的解释器中导入 main，按顶层包汇总各模块自身的导入耗时（self time，取多次运行的中位数），
+并列出启动时就被导入的重型依赖（供应商 SDK、视频处理相关的包），这些包应在第一次使用时才导入。
+设置 --max-ms 时总耗时超过预算返回非零退出码，可以放在 CI 中跟踪回归。
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, Tuple
+
+# 应当延迟导入的包
+LAZY_PACKAGES = ("openai", "dashscope", "edge_tts", "aiohttp", "moviepy", "numpy", "imageio", "imageio_ffmpeg", "PIL", "tiktoken")
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure() -> Tuple[int, Dict[str, int]]:
+    """运行一次，返回 (main 的累计耗时, 顶层包 -> 自身耗时之和)，单位微秒"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=root, capture_output=True, text=True, env={**os.environ, "log_level": "WARNING"},
+    )
+    if result.returncode != 0:
+        raise SystemExit(result.stderr[-2000:])
+    total, packages = 0, defaultdict(int)
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, _, module = match.groups()
+        packages[module.split(".")[0]] += int(self_us)
+        if module == "main":
+            total = int(cumulative_us)
+    return total, packages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--max-ms", type=float, default=0, help="总耗时预算（毫秒），0 表示不检查")
+    args = parser.parse_args()
+
+    # 第一次运行可能要编译 .pyc，不计入结果
+    measure()
+    totals, packages = [], defaultdict(list)
+    for _ in range(args.runs):
+        total, by_package = measure()
+        totals.append(total)
+        for name, value in by_package.items():
+            packages[name].append(value)
+
+    total_ms = statistics.median(totals) / 1000
+    print(f"import main: median {total_ms:.0f}ms over {args.runs} runs (min {min(totals) / 1000:.0f}ms, max {max(totals) / 1000:.0f}ms)")
+    print(f"\n{'package':<24} {'self ms':>8}")
+    ranked = sorted(packages.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, values in ranked[:args.top]:
+        print(f"{name:<24} {statistics.median(values) / 1000:>8.1f}")
+
+    eager = [name for name in LAZY_PACKAGES if name in packages]
+    print(f"\nheavy packages imported at startup: {', '.join(eager) if eager else 'none'}")
+    if args.max_ms and total_ms > args.max_ms:
+        raise SystemExit(f"import time {total_ms:.0f}ms exceeds budget {args.max_ms:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""日志开销基准：故事生成热路径上每个请求记录 prompt 和响应的耗时
+
+用法: python -m benchmarks.bench_logging --iterations 2000
+
+对比原来的写法（json.dumps(indent=4) 格式化完整内容后同步写文件）和 log_payload 的几种配置，
+输出调用方线程上每个请求的平均耗时，enqueue 模式下文件写入由后台线程完成。
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from loguru import logger
+
+from app.config import get_settings
+from app.models.const import Language
+from app.schemas.llm import StoryGenerationRequest
+from app.services.llm import llm_service
+from app.utils.log import BackgroundSink, log_payload
+
+settings = get_settings()
+
+
+def legacy(messages, response) -> None:
+    logger.info(f"prompt messages: {json.dumps(messages, indent=4, ensure_ascii=False)}")
+    logger.info(f"Generate story: {json.dumps(response, indent=4, ensure_ascii=False)}")
+
+
+def current(messages, response) -> None:
+    log_payload("story prompt", messages, provider="openai")
+    log_payload("story response", response, segments=len(response))
+
+
+def measure(name: str, fn, messages, response, iterations: int, path: str, *, enqueue: bool, level: str = "INFO", prompts: str = "hash") -> None:
+    logger.remove()
+    stream = open(path, "a", encoding="utf-8")
+    sink = BackgroundSink(stream) if enqueue else stream
+    logger.add(sink, level=level)
+    settings.log_prompts = prompts
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(messages, response)
+    caller = time.perf_counter() - start
+    if enqueue:
+        sink.close()
+    total = time.perf_counter() - start
+    logger.remove()
+    stream.close()
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    print(f"{name:<38} caller={caller / iterations * 1e6:8.1f}us/req  incl_flush={total / iterations * 1e6:8.1f}us/req  log={size / iterations:8.0f}B/req")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--segments", type=int, default=5)
+    args = parser.parse_args()
+
+    request = StoryGenerationRequest(story_prompt="a little fox finds a lantern in the forest", segments=args.segments, language=Language.ENGLISH_US)
+    messages = llm_service._build_story_messages(request)
+    response = [{"text": f"scene {i} " * 40, "image_prompt": f"a calm illustration of scene {i} " * 5} for i in range(args.segments)]
+    sample_rate = settings.log_payload_sample_rate
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = [
+            ("before: full body, sync, INFO", legacy, dict(enqueue=False)),
+            ("after: hash, enqueue, INFO", lambda m, r: (log_payload("story prompt", m, level="INFO"), log_payload("story response", r, level="INFO")), dict(enqueue=True)),
+            (f"after: full sampled {sample_rate:.0%}, enqueue, DEBUG", current, dict(enqueue=True, level="DEBUG", prompts="full")),
+            ("after: default (DEBUG payloads off)", current, dict(enqueue=True)),
+        ]
+        print(f"iterations={args.iterations} prompt_chars={len(json.dumps(messages, ensure_ascii=False))}")
+        for i, (name, fn, options) in enumerate(cases):
+            measure(name, fn, messages, response, args.iterations, os.path.join(tmp, f"{i}.log"), **options)
+
+
+if __name__ == "__main__":
+    main()
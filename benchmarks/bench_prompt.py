@@ -0,0 +1,50 @@
+"""提示词大小基准：各模板版本每个请求的 prompt token 数和可被供应商缓存的前缀长度
+
+用法: python -m benchmarks.bench_prompt --segments 3
+
+cacheable_prefix 为两个主题不同的请求序列化后相同的前缀 token 数，供应商的前缀缓存只对这部分生效；
+安装 tiktoken 时按 o200k_base 精确计数，否则按字符估算。
+"""
+import argparse
+import json
+import os
+import time
+
+from app.models.const import Language, StoryType
+from app.services.prompt import TEMPLATES
+from app.utils.tokens import count_tokens, tokenizer_name
+
+TOPICS = ["a little fox finds a lantern in the forest", "两个机器人在月球上种花"]
+
+
+def serialize(messages) -> str:
+    return "".join(f"<{message['role']}>{message['content']}" for message in messages)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--segments", type=int, default=3)
+    parser.add_argument("--iterations", type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"tokenizer={tokenizer_name()} segments={args.segments}")
+    print(f"{'version':<8}{'language':<10}{'story_type':<12}{'system':>8}{'user':>8}{'total':>8}{'cacheable_prefix':>18}{'render_us':>11}")
+    for version, template in TEMPLATES.items():
+        for language in (Language.CHINESE_CN, Language.ENGLISH_US):
+            for story_type in (StoryType.custom, StoryType.bedtime):
+                compiled = template.compile(language, story_type)
+                first, second = (compiled.messages(topic, args.segments) for topic in TOPICS)
+                a, b = serialize(first), serialize(second)
+                prefix = os.path.commonprefix([a, b])
+                start = time.perf_counter()
+                for _ in range(args.iterations):
+                    compiled.messages(TOPICS[0], args.segments)
+                render_us = (time.perf_counter() - start) / args.iterations * 1e6
+                system, user = count_tokens(first[0]["content"]), count_tokens(first[1]["content"])
+                print(f"{version:<8}{language.value:<10}{story_type.value:<12}{system:>8}{user:>8}{system + user:>8}{count_tokens(prefix):>18}{render_us:>11.1f}")
+    print("example (latest version):")
+    print(json.dumps(list(TEMPLATES.values())[-1].compile(Language.CHINESE_CN, StoryType.bedtime).messages(TOPICS[0], args.segments), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
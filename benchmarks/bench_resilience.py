@@ -0,0 +1,62 @@
+"""容错基准：上游注入延迟和错误时的成功率、重试和熔断情况
+
+用法: python -m benchmarks.bench_resilience --requests 50 --error-rate 0.3
+
+第一轮按给定错误率请求 /api/llm/story；第二轮把错误率调到 100%，观察熔断器打开后请求被快速拒绝（503）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+
+from benchmarks.fake_server import FakeServer
+
+
+async def run(server: FakeServer, n: int, error_rate: float) -> None:
+    import httpx
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client, httpx.AsyncClient() as control:
+
+        async def burst(label: str) -> None:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[
+                client.post("/api/llm/story", json={"segments": 2, "story_prompt": f"story number {i}", "use_cache": False})
+                for i in range(n)
+            ])
+            elapsed = time.perf_counter() - start
+            print(f"[{label}] {dict(Counter(r.status_code for r in responses))} in {elapsed:.2f}s")
+
+        await control.post(f"http://{server.host}:{server.port}/_control", json={"error_rate": error_rate})
+        await burst(f"error_rate={error_rate}")
+        await control.post(f"http://{server.host}:{server.port}/_control", json={"error_rate": 1.0})
+        await burst("error_rate=1.0")
+        print(json.dumps((await client.get("/api/llm/resilience/stats")).json(), indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.3)
+    args = parser.parse_args()
+
+    with FakeServer(latency=args.latency, jitter=args.jitter) as server:
+        os.environ.update({
+            "text_provider": "openai",
+            "openai_api_key": "fake",
+            "openai_base_url": server.base_url,
+            "llm_backoff_base": "0.05",
+            # 所有请求来自同一个 IP，放开调用方限额，第二轮的结果只反映熔断
+            "client_rpm": "0",
+            "client_max_concurrency": str(max(args.requests, 8)),
+        })
+        asyncio.run(run(server, args.requests, args.error_rate))
+
+
+if __name__ == "__main__":
+    main()
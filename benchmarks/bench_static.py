@@ -0,0 +1,117 @@
+"""/tasks 文件服务基准：原来的 StaticFiles 挂载 vs TaskStaticFiles
+
+用法: python -m benchmarks.bench_static --size-mb 20 --concurrency 8 --requests 64
+
+两个应用都通过 uvicorn 在本地端口上运行，比较：
+- full: 完整下载一个视频文件的吞吐（MB/s）
+- seek: 播放器拖动进度，随机读取 1MB 区间（StaticFiles 不支持 Range，每次都返回完整文件）
+- revalidate: 带 If-None-Match 的重复请求（内容哈希命名的资源返回 304）
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.staticfiles import StaticFiles
+
+
+class Server:
+    def __init__(self, app, port: int):
+        self.port = port
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+async def run_case(base_url: str, path: str, requests: int, concurrency: int, headers_fn) -> dict:
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    received = 0
+    statuses = {}
+
+    async def one(client):
+        nonlocal received
+        async with semaphore:
+            response = await client.get(path, headers=headers_fn())
+            received += len(response.content)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=None) as client:
+        await client.get(path)
+        start = time.perf_counter()
+        await asyncio.gather(*[one(client) for _ in range(requests)])
+        elapsed = time.perf_counter() - start
+    return {"rps": requests / elapsed, "mb_s": received / elapsed / 2 ** 20, "statuses": statuses}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench-static-")
+    os.environ["asset_signing_key"] = ""
+    from app.utils.static import TaskStaticFiles
+
+    data = os.urandom(args.size_mb * 2 ** 20)
+    digest = hashlib.sha256(data).hexdigest()
+    os.makedirs(os.path.join(root, "assets", digest[:2]))
+    video = f"assets/{digest[:2]}/{digest}.mp4"
+    with open(os.path.join(root, video), "wb") as f:
+        f.write(data)
+    size = len(data)
+
+    def no_headers():
+        return {}
+
+    def random_range():
+        start = random.randrange(0, size - 2 ** 20)
+        return {"range": f"bytes={start}-{start + 2 ** 20 - 1}"}
+
+    apps = {"StaticFiles": StaticFiles(directory=root), "TaskStaticFiles": TaskStaticFiles(directory=root)}
+    results = {}
+    try:
+        for port, (name, static) in enumerate(apps.items(), start=18781):
+            app = FastAPI()
+            app.mount("/tasks", static)
+            with Server(app, port):
+                base_url = f"http://127.0.0.1:{port}"
+                import httpx
+                etag = httpx.get(f"{base_url}/tasks/{video}", headers={"range": "bytes=0-0"}).headers.get("etag", "")
+                results[name] = {
+                    "full": asyncio.run(run_case(base_url, f"/tasks/{video}", args.requests, args.concurrency, no_headers)),
+                    "seek": asyncio.run(run_case(base_url, f"/tasks/{video}", args.requests * 4, args.concurrency, random_range)),
+                    "revalidate": asyncio.run(run_case(base_url, f"/tasks/{video}", args.requests * 4, args.concurrency, lambda: {"if-none-match": etag})),
+                }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(f"file={args.size_mb}MB requests={args.requests} concurrency={args.concurrency}")
+    print(f"{'':<16} {'full MB/s':>10} {'seek req/s':>11} {'seek MB/s':>10} {'reval req/s':>12}  statuses (full / seek / revalidate)")
+    for name, cases in results.items():
+        print(f"{name:<16} {cases['full']['mb_s']:>10.0f} {cases['seek']['rps']:>11.1f} {cases['seek']['mb_s']:>10.0f} {cases['revalidate']['rps']:>12.1f}  "
+              f"{cases['full']['statuses']} / {cases['seek']['statuses']} / {cases['revalidate']['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
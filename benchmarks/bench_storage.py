@@ -0,0 +1,84 @@
+"""tasks 目录清理的开销
+
+用法: python -m benchmarks.bench_storage --assets 20000 --cache 20000 --outputs 500
+
+在临时目录中按分片布局生成资源、缓存条目和任务输出，一半的资源被缓存条目引用，
+设置容量为当前占用的一半后执行一次清理，输出扫描 + 淘汰耗时、淘汰的单元数，
+以及请求路径上 touch / retain 的单次开销（只写内存）。
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--assets", type=int, default=20000)
+    parser.add_argument("--cache", type=int, default=20000)
+    parser.add_argument("--outputs", type=int, default=500)
+    args = parser.parse_args()
+
+    os.environ["storage_min_age"] = "0"
+    from app.config import get_settings
+    from app.services.storage import StorageManager, shard
+
+    settings = get_settings()
+    root = tempfile.mkdtemp(prefix="bench-storage-")
+    state = tempfile.mkdtemp(prefix="bench-storage-state-")
+    manager = StorageManager(root, db_path=os.path.join(state, "storage.db"), lock_path=os.path.join(state, "storage.lock"))
+
+    def write(path: str, size: int) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"\0" * size)
+
+    start = time.perf_counter()
+    digests = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(args.assets)]
+    for digest in digests:
+        write(os.path.join(root, "assets", digest[:2], f"{digest}.png"), 2048)
+        write(os.path.join(root, "assets", digest[:2], f"{digest}.256.webp"), 512)
+    for i in range(args.outputs):
+        task_id = f"task{i}"
+        for name in ("final.mp4", "segment-0.png", "subtitles.srt"):
+            write(os.path.join(root, "outputs", shard(task_id), task_id, name), 4096)
+    print(f"created {args.assets} assets, {args.cache} cache entries, {args.outputs} outputs in {time.perf_counter() - start:.1f}s")
+
+    async def run():
+        await asyncio.get_running_loop().run_in_executor(manager._executor, manager._open)
+        keys = [hashlib.sha256(f"cache{i}".encode()).hexdigest() for i in range(args.cache)]
+        for i, key in enumerate(keys):
+            if i % 2 == 0:
+                digest = digests[i % len(digests)]
+                manager._ref_ops.append(("retain", f"assets/{digest[:2]}/{digest}", f"cache:image:{key}", time.time() + 3600))
+            write(os.path.join(root, "cache", "image", key[:2], f"{key}.json"), 128)
+        t = time.perf_counter()
+        for i in range(100000):
+            manager.touch_key("cache/image", keys[i % len(keys)])
+        touch_us = (time.perf_counter() - t) / 100000 * 1e6
+
+        first = await manager.collect()
+        settings.storage_max_bytes = first["total_bytes"] // 2
+        t = time.perf_counter()
+        second = await manager.collect()
+        gc_ms = (time.perf_counter() - t) * 1000
+        settings.storage_max_bytes = 0
+        await manager.stop()
+        return first, second, gc_ms, touch_us
+
+    try:
+        first, second, gc_ms, touch_us = asyncio.run(run())
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(state, ignore_errors=True)
+
+    print(f"scan only: {first['duration_ms']}ms for {first['units']} units, {first['total_bytes'] / 2 ** 20:.1f}MB")
+    print(f"quota = half: {gc_ms:.0f}ms, evicted {second['evicted']} units, {second['total_bytes'] / 2 ** 20:.1f}MB left, {second['referenced']} assets still referenced")
+    print(f"touch on the request path: {touch_us:.2f}us")
+
+
+if __name__ == "__main__":
+    main()
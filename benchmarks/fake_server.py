@@ -0,0 +1,192 @@
+"""本地假的 OpenAI 兼容服务，用于压测和基准测试
+
+提供 /v1/chat/completions、/v1/images/generations 和离线批处理（/v1/files、/v1/batches）接口，
+按固定延迟返回合法的故事 JSON 和图片地址，不依赖任何外部网络。
+"""
+import asyncio
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from PIL import Image
+
+
+# 与 app.services.fake.placeholder_png 相同；这里不导入 app，导入 app 会提前读取配置，
+# 之后基准脚本再设置的环境变量就不会生效
+def placeholder_png(seed: str, size: int = 64) -> bytes:
+    """按 seed 生成纯色占位图"""
+    digest = hashlib.md5(seed.encode("utf-8")).digest()
+    buf = io.BytesIO()
+    Image.new("RGB", (size, size), tuple(digest[:3])).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def create_fake_app(latency: float = 0.5, jitter: float = 0.0, error_rate: float = 0.0) -> FastAPI:
+    """
+    Args:
+        latency: 固定延迟（秒）
+        jitter: 在固定延迟上叠加 [0, jitter) 的随机延迟
+        error_rate: 随机返回 429 / 500 的比例
+    运行中可以通过 POST /_control 修改这三个参数。
+    """
+    app = FastAPI()
+    app.state.latency = latency
+    app.state.jitter = jitter
+    app.state.error_rate = error_rate
+
+    def delay() -> float:
+        return app.state.latency + random.random() * app.state.jitter
+
+    def injected_error():
+        if random.random() < app.state.error_rate:
+            status = random.choice([429, 500])
+            headers = {"retry-after": "0.1"} if status == 429 else None
+            return JSONResponse({"error": {"message": "injected error", "type": "fake"}}, status_code=status, headers=headers)
+        return None
+
+    @app.post("/_control")
+    async def control(request: Request):
+        body = await request.json()
+        for name in ("latency", "jitter", "error_rate"):
+            if name in body:
+                setattr(app.state, name, float(body[name]))
+        return {"latency": app.state.latency, "jitter": app.state.jitter, "error_rate": app.state.error_rate}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        # 流式请求把延迟平摊到各个分片上
+        if not body.get("stream"):
+            await asyncio.sleep(delay())
+        error = injected_error()
+        if error is not None:
+            return error
+        if body.get("stream"):
+            return StreamingResponse(stream_chunks(body, story_content(body)), media_type="text/event-stream")
+        return completion(body)
+
+    def story_content(body) -> str:
+        match = re.search(r"divided into (\d+) scenes", body["messages"][-1]["content"])
+        segments = int(match.group(1)) if match else 3
+        return json.dumps({
+            "list": [
+                {"text": f"scene {i}", "image_prompt": f"a calm illustration of scene {i}"}
+                for i in range(segments)
+            ]
+        })
+
+    def completion(body):
+        prompt = body["messages"][-1]["content"]
+        content = story_content(body)
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4, "total_tokens": (len(prompt) + len(content)) // 4},
+        }
+
+    async def stream_chunks(body, content: str, size: int = 16):
+        pieces = [content[i:i + size] for i in range(0, len(content), size)]
+        total = delay()
+        for piece in pieces:
+            await asyncio.sleep(total / len(pieces))
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    @app.post("/v1/images/generations")
+    async def images_generations(request: Request):
+        body = await request.json()
+        await asyncio.sleep(delay())
+        error = injected_error()
+        if error is not None:
+            return error
+        seed = hashlib.md5(body["prompt"].encode("utf-8")).hexdigest()
+        return {"created": int(time.time()), "data": [{"url": f"{request.base_url}v1/files/{seed}.png"}]}
+
+    @app.get("/v1/files/{seed}.png")
+    async def files(seed: str):
+        return Response(content=placeholder_png(seed), media_type="image/png")
+
+    # 离线批处理：上传的输入文件在创建批处理时立即全部处理完
+    app.state.files = {}
+    app.state.batches = {}
+
+    @app.post("/v1/files")
+    async def upload_file(request: Request):
+        form = await request.form()
+        file_id = f"file-{len(app.state.files)}"
+        app.state.files[file_id] = await form["file"].read()
+        return {"id": file_id, "object": "file", "bytes": len(app.state.files[file_id]), "created_at": int(time.time()), "filename": form["file"].filename, "purpose": form["purpose"]}
+
+    @app.get("/v1/files/{file_id}/content")
+    async def file_content(file_id: str):
+        return Response(content=app.state.files[file_id], media_type="application/jsonl")
+
+    def batch_object(batch_id: str):
+        return {
+            "id": batch_id, "object": "batch", "endpoint": "/v1/chat/completions", "completion_window": "24h",
+            "created_at": int(time.time()), **app.state.batches[batch_id],
+        }
+
+    @app.post("/v1/batches")
+    async def create_batch(request: Request):
+        body = await request.json()
+        lines = []
+        for line in app.state.files[body["input_file_id"]].decode("utf-8").splitlines():
+            item = json.loads(line)
+            lines.append(json.dumps({"id": f"req-{len(lines)}", "custom_id": item["custom_id"], "response": {"status_code": 200, "body": completion(item["body"])}, "error": None}))
+        output_file_id = f"file-{len(app.state.files)}"
+        app.state.files[output_file_id] = "\n".join(lines).encode("utf-8")
+        batch_id = f"batch-{len(app.state.batches)}"
+        app.state.batches[batch_id] = {"input_file_id": body["input_file_id"], "status": "completed", "output_file_id": output_file_id}
+        return batch_object(batch_id)
+
+    @app.get("/v1/batches/{batch_id}")
+    async def retrieve_batch(batch_id: str):
+        return batch_object(batch_id)
+
+    return app
+
+
+class FakeServer:
+    """在后台线程中运行假服务"""
+
+    def __init__(self, latency: float = 0.5, host: str = "127.0.0.1", port: int = 18765, **options):
+        self.host = host
+        self.port = port
+        self.server = uvicorn.Server(uvicorn.Config(create_fake_app(latency, **options), host=host, port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
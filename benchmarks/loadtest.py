@@ -0,0 +1,285 @@
+"""压测：按目标 RPS 驱动 /api/llm/story、/api/llm/image、/api/llm/story-with-images
+
+用法:
+    python -m benchmarks.loadtest --rps 20 --duration 30
+    python -m benchmarks.loadtest --mode uvicorn --workers 2 --rps 50 --endpoints story
+    python -m benchmarks.loadtest --rps 20 --error-rate 0.05 --malformed-rate 0.1 --compare benchmarks/results/<之前的结果>.json
+
+上游使用内置的 fake 供应商（app/services/fake.py），不需要任何 API key；延迟分布、错误率和格式错误比例通过参数设置，
+相同参数下注入的延迟和错误可以复现。
+- inprocess: 通过 httpx.ASGITransport 在同一进程内调用应用，内存为本进程的 RSS
+- uvicorn: 在子进程中启动 uvicorn 并通过本地 TCP 调用，内存为服务进程（含 worker）的 RSS 之和
+按固定间隔发出请求（开环），不等前一个请求返回，延迟包含服务端排队时间。
+结果写入 benchmarks/results/<时间>-<mode>.json，--compare 时与之前的结果逐项对比。
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+ENDPOINTS: Dict[str, Callable[[int, argparse.Namespace], Dict[str, Any]]] = {
+    "story": lambda i, args: {"segments": args.segments, "story_prompt": f"load test story number {i}", "use_cache": False},
+    "image": lambda i, args: {"prompt": f"load test illustration number {i}, a quiet forest", "use_cache": False},
+    "story-with-images": lambda i, args: {"segments": args.segments, "story_prompt": f"load test illustrated story {i}", "use_cache": False},
+}
+
+
+def server_env(args: argparse.Namespace) -> Dict[str, str]:
+    """被测服务的配置：fake 供应商，关闭调用方限流和生成缓存"""
+    return {
+        "text_provider": "fake",
+        "image_provider": "fake",
+        "fake_latency_distribution": args.distribution,
+        "fake_latency": str(args.latency),
+        "fake_latency_spread": str(args.spread),
+        "fake_image_latency": str(args.image_latency),
+        "fake_error_rate": str(args.error_rate),
+        "fake_malformed_rate": str(args.malformed_rate),
+        "fake_seed": str(args.seed),
+        "client_rpm": "0",
+        "client_max_concurrency": "100000",
+        "cache_enabled": "false",
+        "log_level": "WARNING",
+    }
+
+
+def rss_bytes(pid: int) -> int:
+    """进程当前的 RSS，读不到 /proc 时返回 0"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def tree_pids(pid: int) -> List[int]:
+    """进程及其所有子进程（uvicorn 多 worker）"""
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+class MemorySampler:
+    """定期采样 RSS，记录峰值"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self) -> int:
+        rss = sum(rss_bytes(pid) for pid in tree_pids(self.pid))
+        self.peak = max(self.peak, rss)
+        return rss
+
+    async def _run(self) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = 0
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+        self.sample()
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+async def run_endpoint(client, endpoint: str, args: argparse.Namespace, sampler: MemorySampler) -> Dict[str, Any]:
+    """按目标 RPS 发压 duration 秒，等待所有请求完成后统计"""
+    path = f"/api/llm/{endpoint}"
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    async def one(i: int) -> None:
+        start = time.perf_counter()
+        try:
+            response = await client.post(path, json=ENDPOINTS[endpoint](i, args))
+            status = str(response.status_code)
+        except Exception as e:
+            status = type(e).__name__
+        if status == "200":
+            latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    # 预热一次，不计入结果
+    await client.post(path, json=ENDPOINTS[endpoint](-1, args))
+
+    total = int(args.rps * args.duration)
+    tasks = []
+    rss_start = sampler.sample()
+    with sampler:
+        start = time.perf_counter()
+        for i in range(total):
+            delay = start + i / args.rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(one(i)))
+        sent = time.perf_counter() - start
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    ms = lambda value: round(value * 1000, 1) if value is not None else None
+    return {
+        "requests": total,
+        "ok": len(latencies),
+        "statuses": statuses,
+        "offered_rps": round(total / sent, 2) if sent > 0 else None,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+        "rss_start_mb": round(rss_start / 2 ** 20, 1),
+        "rss_peak_mb": round(sampler.peak / 2 ** 20, 1),
+    }
+
+
+async def run_inprocess(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+    os.environ.update(server_env(args))
+    from main import app
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+        for endpoint in args.endpoints:
+            results[endpoint] = await run_endpoint(client, endpoint, args, MemorySampler(os.getpid()))
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_uvicorn(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+
+    port = _free_port()
+    env = {**os.environ, **server_env(args)}
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"]
+    server = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    results = {}
+    try:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=1000)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    await client.get("/")
+                    break
+                except httpx.TransportError:
+                    if server.poll() is not None or time.monotonic() > deadline:
+                        raise SystemExit("uvicorn failed to start")
+                    await asyncio.sleep(0.2)
+            for endpoint in args.endpoints:
+                results[endpoint] = await run_endpoint(client, endpoint, args, MemorySampler(server.pid))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return results
+
+
+COMPARED = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "rss_peak_mb")
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]) -> None:
+    print(f"\ncompared with {previous['label']} ({previous['started_at']})")
+    for endpoint, stats in current["results"].items():
+        before = previous["results"].get(endpoint)
+        if before is None:
+            continue
+        cells = []
+        for name in COMPARED:
+            old, new = before.get(name), stats.get(name)
+            if old and new is not None:
+                cells.append(f"{name}={new} ({(new - old) / old:+.1%})")
+        print(f"  {endpoint:<18} " + "  ".join(cells))
+
+
+def report(results: Dict[str, Any]) -> None:
+    print(f"{'endpoint':<18} {'ok/total':>11} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'rss peak':>9}  statuses")
+    for endpoint, stats in results.items():
+        print(f"{endpoint:<18} {stats['ok']:>5}/{stats['requests']:<5} {stats['throughput_rps']:>7} "
+              f"{stats['p50_ms'] or '-':>8} {stats['p95_ms'] or '-':>8} {stats['p99_ms'] or '-':>8} "
+              f"{stats['rss_peak_mb']:>7}MB  {stats['statuses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess")
+    parser.add_argument("--endpoints", type=lambda value: value.split(","), default=list(ENDPOINTS))
+    parser.add_argument("--rps", type=float, default=20)
+    parser.add_argument("--duration", type=float, default=10, help="每个接口的发压时长（秒）")
+    parser.add_argument("--segments", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn 模式的 worker 进程数")
+    parser.add_argument("--distribution", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--latency", type=float, default=0.5, help="文本生成延迟中位数（秒）")
+    parser.add_argument("--spread", type=float, default=0.3)
+    parser.add_argument("--image-latency", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="", help="结果名称，默认为 mode")
+    parser.add_argument("--output", default="", help="结果文件路径，默认写入 benchmarks/results/")
+    parser.add_argument("--compare", default="", help="与之前保存的结果对比")
+    args = parser.parse_args()
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+    results = asyncio.run(run_uvicorn(args) if args.mode == "uvicorn" else run_inprocess(args))
+    label = args.label or args.mode
+    output = {
+        "label": label,
+        "started_at": started_at,
+        "config": {name: value for name, value in vars(args).items() if name not in ("output", "compare", "label")},
+        "results": results,
+    }
+
+    report(results)
+    path = args.output or os.path.join(RESULTS_DIR, f"{started_at.replace(':', '')}-{label}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"\nsaved to {path}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(output, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,21 @@
-import os
 from fastapi import FastAPI, APIRouter
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from loguru import logger
 from app.api import router as api
+from app.config import get_settings
+from app.services.llm import llm_service
+from app.services.provider import provider_registry
+from app.services.storage import storage_manager
+from app.services.task import task_manager
+from app.services.video import shutdown_render_pool
+from app.utils.static import TaskStaticFiles
+from app.utils.utils import task_dir
+from app.utils.log import setup_logging
+from app.utils.metrics import MetricsMiddleware, setup_tracing
+
+settings = get_settings()
+
+setup_logging()
 
 app = FastAPI(
     title="StoryFlicks Backend API",
@@ -19,12 +32,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-if not os.path.exists("tasks"):
-    os.mkdir("tasks")
+app.add_middleware(MetricsMiddleware)
 
-app.mount("/tasks", StaticFiles(directory=os.path.abspath("tasks")),name="tasks")
+app.mount("/tasks", TaskStaticFiles(directory=task_dir()),name="tasks")
 app.include_router(api)
 
+@app.on_event("startup")
+async def startup():
+    setup_tracing()
+    await task_manager.start()
+    await storage_manager.start()
+    if settings.warmup:
+        await llm_service.warmup()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await task_manager.stop()
+    await storage_manager.stop()
+    await provider_registry.aclose()
+    shutdown_render_pool()
+    await logger.complete()
+
 @app.get("/")
 async def root():
     return {
@@ -33,5 +61,6 @@ async def root():
     }
     
 if __name__=="__main__":
+    # 开发用：单进程，debug 时代码修改后自动重载；生产环境使用 serve.py
     import uvicorn
-    uvicorn.run("main:app", host="127.0.0.1", port=18000, reload=True)
\ No newline at end of file
+    uvicorn.run("main:app", host="127.0.0.1", port=settings.server_port, reload=settings.debug)
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""生产环境启动入口：多个 worker 进程，不自动重载
+
+用法: python serve.py
+地址、端口和 worker 数见 Settings 的 server_host / server_port / server_workers，
+开启 warmup 时每个 worker 启动后先导入供应商 SDK 并建立连接再接收请求。
+开发时使用 python main.py。
+"""
+import os
+import time
+
+import uvicorn
+
+from app.config import get_settings
+from app.models.const import SERVER_STARTED_AT_ENV
+
+
+def main():
+    settings = get_settings()
+    workers = settings.server_workers or os.cpu_count() or 1
+    # worker 进程据此区分上次退出时遗留的任务和其他 worker 刚开始执行的任务
+    os.environ[SERVER_STARTED_AT_ENV] = str(time.time())
+    uvicorn.run(
+        "main:app",
+        host=settings.server_host,
+        port=settings.server_port,
+        workers=workers,
+        reload=False,
+        # 请求数和耗时由 /api/metrics 统计，不逐条打印访问日志
+        access_log=False,
+        log_level=settings.log_level.lower(),
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import pytest
+
+
+@pytest.fixture
+def anyio_backend():
+    # 只使用 asyncio，项目中的服务都基于 asyncio
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def storage_root(tmp_path, monkeypatch):
+    """tasks 和 data 目录指向临时目录，测试不写入项目下的真实目录"""
+    from app.services.storage import storage_manager
+    from app.services.task import task_manager
+    from app.utils import utils
+
+    monkeypatch.setattr(utils, "get_root_dir", lambda: str(tmp_path))
+    monkeypatch.setattr(storage_manager, "root", utils.task_dir())
+    monkeypatch.setattr(storage_manager, "db_path", utils.state_path("storage.db"))
+    monkeypatch.setattr(storage_manager, "lock_path", utils.state_path("storage.lock"))
+    monkeypatch.setattr(task_manager, "db_path", utils.state_path("tasks.db"))
+    return tmp_path
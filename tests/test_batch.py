@@ -0,0 +1,20 @@
+import json
+
+import pytest
+
+from app.services.batch import _parse_batch_output
+
+
+def output_line(key: str, content: str) -> str:
+    body = {"choices": [{"message": {"content": content}}]}
+    return json.dumps({"custom_id": key, "response": {"status_code": 200, "body": body}})
+
+
+@pytest.mark.anyio
+async def test_bad_line_marks_only_that_item_failed():
+    good = output_line("good", json.dumps({"list": [{"text": "a", "image_prompt": "b"}]}))
+    lines = [good, '{"custom_id": "broken", "response": {"status_code": 200, "bo', "not json at all"]
+    outputs = await _parse_batch_output("\n".join(lines), {"good": 1, "broken": 1})
+    assert outputs["good"] == {"segments": [{"text": "a", "image_prompt": "b"}]}
+    assert "error" in outputs["broken"]
+    assert set(outputs) == {"good", "broken"}
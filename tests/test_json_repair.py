@@ -0,0 +1,37 @@
+import pytest
+
+from app.utils.json_repair import repair_json
+
+STORY = {"list": [{"text": "a", "image_prompt": "b"}]}
+
+
+@pytest.mark.parametrize("text", [
+    '{"list": [{"text": "a", "image_prompt": "b"}]}',
+    '```json\n{"list": [{"text": "a", "image_prompt": "b"}]}\n```',
+    '```\n{"list": [{"text": "a", "image_prompt": "b"}]}',
+    'Here is your story:\n{"list": [{"text": "a", "image_prompt": "b"}]}\nEnjoy!',
+    '{"list": [{"text": "a", "image_prompt": "b",},]}',
+    '{"list": [{"text": "a", "image_prompt": "b"}]} {"extra": 1}',
+])
+def test_repairs_common_problems(text):
+    assert repair_json(text) == STORY
+
+
+@pytest.mark.parametrize("text, expected", [
+    # 截断在字符串中间：补齐引号和括号
+    ('{"list": [{"text": "a", "image_prompt": "b', {"list": [{"text": "a", "image_prompt": "b"}]}),
+    # 截断在逗号或键之后：丢掉不完整的键值对
+    ('{"list": [{"text": "a",', {"list": [{"text": "a"}]}),
+    ('{"list": [{"text": "a", "image_prompt"', {"list": [{"text": "a"}]}),
+    ('{"list": [{"text": "a", "image_prompt":', {"list": [{"text": "a"}]}),
+    ('{"list": [{"text": "a", "image_prompt": "b"}, ', {"list": [{"text": "a", "image_prompt": "b"}]}),
+    ('[{"text": "a \\" [x"', [{"text": 'a " [x'}]),
+])
+def test_repairs_truncated_output(text, expected):
+    assert repair_json(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "no json here", "{text: a}"])
+def test_unrepairable_raises_value_error(text):
+    with pytest.raises(ValueError):
+        repair_json(text)
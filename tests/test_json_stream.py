@@ -0,0 +1,62 @@
+import json
+
+from app.utils.json_stream import StoryListParser
+
+SCENES = [{"text": f"scene {i}", "image_prompt": f"prompt {i}"} for i in range(3)]
+
+
+def feed_all(parser, text, size):
+    items = []
+    for i in range(0, len(text), size):
+        items.extend(parser.feed(text[i:i + size]))
+    return items
+
+
+def test_incremental_parse_any_chunk_size():
+    text = json.dumps({"list": SCENES}, ensure_ascii=False)
+    for size in (1, 3, 7, len(text)):
+        parser = StoryListParser()
+        assert feed_all(parser, text, size) == SCENES
+        assert parser.done
+        assert parser.close() == []
+
+
+def test_items_returned_as_soon_as_complete():
+    parser = StoryListParser()
+    assert parser.feed('{"list": [{"text": "a", "image_prompt": "b"}, {"text": "c"') == [{"text": "a", "image_prompt": "b"}]
+    assert parser.feed(', "image_prompt": "d"}]}') == [{"text": "c", "image_prompt": "d"}]
+
+
+def test_root_array_and_braces_inside_strings():
+    parser = StoryListParser()
+    items = feed_all(parser, '[{"text": "a } [ \\" b", "image_prompt": "{x}"}]', 4)
+    assert items == [{"text": 'a } [ " b', "image_prompt": "{x}"}]
+
+
+def test_bad_element_is_repaired_without_aborting_the_stream():
+    parser = StoryListParser()
+    text = '{"list": [{"text": "a", "image_prompt": "b",}, {"text": "c", "image_prompt": "d"}]}'
+    assert feed_all(parser, text, 5) == [{"text": "a", "image_prompt": "b"}, {"text": "c", "image_prompt": "d"}]
+    assert parser.errors == 0
+
+
+def test_unrepairable_element_is_skipped():
+    parser = StoryListParser()
+    text = '{"list": [{text: a b}, {"text": "c", "image_prompt": "d"}]}'
+    assert feed_all(parser, text, 5) == [{"text": "c", "image_prompt": "d"}]
+    assert parser.errors == 1
+
+
+def test_truncated_stream_returns_last_element_on_close():
+    parser = StoryListParser()
+    assert feed_all(parser, '{"list": [{"text": "a", "image_prompt": "b"}, {"text": "c", "image_pro', 6) == [{"text": "a", "image_prompt": "b"}]
+    assert parser.close() == [{"text": "c"}]
+    assert parser.close() == []
+
+
+def test_alias_root_key_keeps_raw_text():
+    parser = StoryListParser()
+    text = json.dumps({"scenes": SCENES})
+    assert feed_all(parser, text, 8) == []
+    assert not parser.started
+    assert parser.text == text
@@ -0,0 +1,63 @@
+import pytest
+
+from app.config import get_settings
+from app.schemas.llm import StoryGenerationRequest
+from app.services import fake
+from app.services.provider import provider_registry
+from app.utils.metrics import OUTPUT_REPAIRS, STORY_OUTPUTS
+
+
+@pytest.fixture
+def fake_text(monkeypatch):
+    settings = get_settings()
+    for name, value in {"fake_provider": True, "text_provider": "fake", "fake_latency": 0.0, "fake_error_rate": 0.0, "fake_malformed_rate": 1.0}.items():
+        monkeypatch.setattr(settings, name, value)
+    monkeypatch.setattr(provider_registry, "_configs", settings.provider_configs())
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("kind", ["aliases", "trailing_comma", "truncated", "fence"])
+async def test_stream_story_repairs_malformed_output(fake_text, monkeypatch, kind):
+    from app.services.llm import llm_service
+
+    monkeypatch.setattr(fake, "MALFORMED_KINDS", (kind,))
+    calls = fake.fake_provider.stats["calls"]
+    request = StoryGenerationRequest(text_llm_provider="fake", text_llm_model="fake-model", story_prompt=f"a fox {kind}", segments=4, strict=False, use_cache=False)
+    segments = [segment async for segment in llm_service.stream_story(request)]
+    assert len(segments) == 4
+    assert all(set(segment) == {"text", "image_prompt"} for segment in segments)
+    # 修复流中的输出即可，不需要补生成；截断时缺少的场景补生成一次
+    assert fake.fake_provider.stats["calls"] - calls == (2 if kind == "truncated" else 1)
+
+
+@pytest.mark.anyio
+async def test_stream_story_alias_root_counted_once_as_repaired(fake_text, monkeypatch):
+    from app.services.llm import llm_service
+
+    monkeypatch.setattr(fake, "MALFORMED_KINDS", ("aliases",))
+    repairs, repaired = OUTPUT_REPAIRS._values.get(("structure",), 0), STORY_OUTPUTS._values.get(("repaired",), 0)
+    request = StoryGenerationRequest(text_llm_provider="fake", text_llm_model="fake-model", story_prompt="a counted fox", segments=4, strict=False, use_cache=False)
+    assert len([segment async for segment in llm_service.stream_story(request)]) == 4
+    assert OUTPUT_REPAIRS._values[("structure",)] - repairs == 1
+    assert STORY_OUTPUTS._values[("repaired",)] - repaired == 1
+
+
+@pytest.mark.anyio
+async def test_concurrent_story_with_images_coalesced(fake_text, monkeypatch):
+    import asyncio
+
+    from app.services.llm import llm_service
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "fake_malformed_rate", 0.0)
+    monkeypatch.setattr(settings, "image_provider", "fake")
+    monkeypatch.setattr(settings, "fake_image_latency", 0.0)
+    calls, images = fake.fake_provider.stats["calls"], fake.fake_provider.stats["images"]
+    request = StoryGenerationRequest(text_llm_provider="fake", text_llm_model="fake-model", image_llm_provider="fake", image_llm_model="fake-image", story_prompt="a coalesced fox", segments=3, use_cache=False)
+    results = await asyncio.gather(*[llm_service.generate_story_with_images(request) for _ in range(5)])
+    # 一次故事请求和三次配图请求
+    assert fake.fake_provider.stats["calls"] - calls == 4
+    assert fake.fake_provider.stats["images"] - images == 3
+    assert all(result["segments"] == results[0]["segments"] for result in results)
+    results[0]["segments"][0]["text"] = "changed"
+    assert results[1]["segments"][0]["text"] != "changed"
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.api.deps import client_identity
+from app.config import get_settings
+from app.exceptions import RateLimitExceededError
+from app.services import ratelimit
+from app.services.ratelimit import RateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+
+def test_token_bucket_refills_at_rate(clock):
+    bucket = TokenBucket(rate=2.0, capacity=10)
+    bucket.take(10)
+    assert bucket.wait_time(1) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.wait_time(1) == 0
+    clock.now += 2
+    assert bucket.wait_time(5) == 0
+    assert bucket.wait_time(6) == pytest.approx(0.5)
+
+
+def test_token_bucket_never_exceeds_capacity(clock):
+    bucket = TokenBucket(rate=2.0, capacity=10)
+    bucket.take(3)
+    clock.now += 3600
+    assert bucket.wait_time(10) == 0
+    assert bucket.tokens == 10
+    # 超过容量的请求按容量计算，不会永远等待
+    assert bucket.wait_time(50) == 0
+
+
+def test_token_bucket_adjust(clock):
+    bucket = TokenBucket(rate=1.0, capacity=10)
+    bucket.take(4)
+    bucket.adjust(3)
+    assert bucket.tokens == pytest.approx(3)
+    bucket.adjust(-20)
+    assert bucket.tokens == 10
+
+
+def fake_request(host: str):
+    return SimpleNamespace(client=SimpleNamespace(host=host))
+
+
+def test_unknown_api_key_is_keyed_on_ip(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "client_quotas", {"known-key": 600})
+    monkeypatch.setattr(settings, "client_rpm", 60)
+    assert client_identity(fake_request("10.0.0.1"), "random-1") == ("ip:10.0.0.1", 60)
+    assert client_identity(fake_request("10.0.0.1"), "random-2") == ("ip:10.0.0.1", 60)
+    assert client_identity(fake_request("10.0.0.1"), None) == ("ip:10.0.0.1", 60)
+    client, rpm = client_identity(fake_request("10.0.0.1"), "known-key")
+    assert client.startswith("key:") and "known-key" not in client
+    assert rpm == 600
+
+
+@pytest.mark.anyio
+async def test_client_quota_shared_across_api_keys(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "admission_max_wait", 0.05)
+    monkeypatch.setattr(settings, "client_quotas", {})
+    limiter = RateLimiter()
+    for key in ("a", "b"):
+        client, _ = client_identity(fake_request("10.0.0.2"), key)
+        await limiter.acquire_client(client, 2)
+        limiter.release_client(client)
+    client, _ = client_identity(fake_request("10.0.0.2"), "c")
+    with pytest.raises(RateLimitExceededError):
+        await limiter.acquire_client(client, 2)
+
+
+@pytest.mark.anyio
+async def test_idle_clients_evicted(monkeypatch):
+    monkeypatch.setattr(ratelimit, "_CLIENT_EVICT_INTERVAL", 0.0)
+    limiter = RateLimiter()
+    for i in range(100):
+        await limiter.acquire_client(f"ip:10.0.1.{i}", 0)
+        limiter.release_client(f"ip:10.0.1.{i}")
+    await limiter.acquire_client("ip:10.0.2.1", 0)
+    # 进行中的调用方保留，其余空闲的被删除
+    assert list(limiter._client_semaphores) == ["ip:10.0.2.1"]
+    await limiter.acquire_client("ip:10.0.2.2", 60)
+    limiter.release_client("ip:10.0.2.2")
+    await limiter.acquire_client("ip:10.0.2.3", 0)
+    # 令牌桶还没补满，不能删除
+    assert "ip:10.0.2.2" in limiter._client_buckets
@@ -0,0 +1,178 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app.config import get_settings
+from app.exceptions import LLMUpstreamError
+from app.services.resilience import CircuitBreaker, Resilience
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "llm_max_retries", 1)
+    monkeypatch.setattr(settings, "llm_backoff_base", 0.0)
+    monkeypatch.setattr(settings, "llm_attempt_timeout", 0.2)
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def test_breaker_opens_after_threshold_and_recovers(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() == (True, False)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow() == (False, False)
+    assert breaker.remaining() == 30
+
+    now[0] += 30
+    # 冷却后只放一个探测请求
+    assert breaker.allow() == (True, True)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow() == (False, False)
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+    assert breaker.allow() == (True, False)
+
+
+def test_breaker_half_open_failure_reopens(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    now[0] += 10
+    assert breaker.allow() == (True, True)
+    breaker.record_failure(probe=True)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.remaining() == 10
+    assert breaker.allow() == (False, False)
+
+
+def test_breaker_failures_while_open_do_not_extend_cooldown(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    now[0] += 8
+    # 打开前发出的请求陆续失败
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.remaining() == 2
+    now[0] += 2
+    assert breaker.allow() == (True, True)
+
+
+def test_breaker_cancelled_probe_is_released():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow() == (True, True)
+    assert breaker.allow() == (False, False)
+    breaker.release_probe()
+    assert breaker.allow() == (True, True)
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.anyio
+async def test_non_retryable_error_does_not_close_half_open_breaker(fast_retries):
+    resilience = Resilience()
+    breaker = resilience.health("p").breaker
+    breaker.reset_timeout = 0.0
+    open_breaker(breaker)
+
+    async def bad_request():
+        raise LLMUpstreamError("bad request", status_code=400)
+
+    with pytest.raises(LLMUpstreamError):
+        await resilience.call("p", bad_request)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # 探测请求没有结论，下一个请求仍可以探测
+    assert breaker.allow() == (True, True)
+
+
+@pytest.mark.anyio
+async def test_late_failure_does_not_release_probe_held_by_another(fast_retries):
+    resilience = Resilience()
+    breaker = resilience.health("p").breaker
+    breaker.reset_timeout = 0.0
+    started = asyncio.Event()
+    finish = asyncio.Event()
+
+    async def slow_bad_request():
+        started.set()
+        await finish.wait()
+        raise LLMUpstreamError("bad request", status_code=400)
+
+    # 熔断打开之前发出的请求
+    call = asyncio.ensure_future(resilience.call("p", slow_bad_request))
+    await started.wait()
+    open_breaker(breaker)
+    assert breaker.allow() == (True, True)
+    finish.set()
+    with pytest.raises(LLMUpstreamError):
+        await call
+    # 探测仍由另一个请求持有
+    assert breaker.allow() == (False, False)
+
+
+@pytest.mark.anyio
+async def test_slot_wait_not_counted_in_attempt_timeout(fast_retries):
+    resilience = Resilience()
+
+    @asynccontextmanager
+    async def slow_slot():
+        await asyncio.sleep(0.3)
+        yield
+
+    async def fast():
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    assert await resilience.call("p", fast, slot=slow_slot) == "ok"
+    health = resilience.health("p")
+    assert health.stats["timeouts"] == 0
+    assert health.latencies[-1] < 0.2
+
+
+@pytest.mark.anyio
+async def test_caller_cancellation_cancels_primary_and_hedge(fast_retries, monkeypatch):
+    monkeypatch.setattr(get_settings(), "hedge_min_samples", 1)
+    monkeypatch.setattr(get_settings(), "llm_attempt_timeout", 10.0)
+    resilience = Resilience()
+    resilience.health("p").latencies.append(0.01)
+    cancelled = []
+
+    async def hang(name):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(name)
+            raise
+
+    call = asyncio.ensure_future(resilience.call("p", lambda: hang("primary"), hedge=("h", lambda: hang("hedge"), None)))
+    await asyncio.sleep(0.1)
+    start = time.monotonic()
+    call.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await call
+    await asyncio.sleep(0)
+    assert sorted(cancelled) == ["hedge", "primary"]
+    assert time.monotonic() - start < 1
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from app.exceptions import StorySessionConflictError
+from app.models.const import RegenerateTarget
+from app.schemas.llm import StoryGenerationRequest
+from app.services import session as session_module
+from app.services.session import story_sessions
+
+
+async def new_session():
+    result = {
+        "segments": [{"text": f"scene {i}", "image_prompt": f"prompt {i}", "url": None, "status": "success"} for i in range(3)],
+        "status": "complete",
+        "timings": {},
+    }
+    return await story_sessions.create(StoryGenerationRequest(story_prompt="a fox", segments=3), result)
+
+
+@pytest.mark.anyio
+async def test_regenerate_bumps_version(monkeypatch):
+    session = await new_session()
+
+    async def rewrite(request, texts, indexes, instruction=None):
+        return [{"text": "rewritten", "image_prompt": "new prompt"} for _ in indexes]
+
+    monkeypatch.setattr(session_module.llm_service, "rewrite_segments", rewrite)
+    result = await story_sessions.regenerate(session["session_id"], [session["segments"][1]["id"]], RegenerateTarget.text, version=1)
+    assert result["version"] == 2
+    assert (await story_sessions.get(session["session_id"]))["segments"][1]["text"] == "rewritten"
+
+
+@pytest.mark.anyio
+async def test_concurrent_write_from_other_process_is_not_lost(monkeypatch):
+    session = await new_session()
+    path = story_sessions._path(session["session_id"])
+
+    async def rewrite(request, texts, indexes, instruction=None):
+        # 另一个 worker 进程在本次改写期间写入了新版本
+        with open(path, encoding="utf-8") as f:
+            other = json.load(f)
+        other.update(version=other["version"] + 1)
+        other["segments"][0]["text"] = "written by another worker"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(other, f)
+        return [{"text": "rewritten", "image_prompt": "new prompt"} for _ in indexes]
+
+    monkeypatch.setattr(session_module.llm_service, "rewrite_segments", rewrite)
+    with pytest.raises(StorySessionConflictError):
+        await story_sessions.regenerate(session["session_id"], [session["segments"][1]["id"]], RegenerateTarget.text)
+    stored = await story_sessions.get(session["session_id"])
+    assert stored["version"] == 2
+    assert stored["segments"][0]["text"] == "written by another worker"
+    assert stored["segments"][1]["text"] == "scene 1"
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from app.utils.singleflight import SingleFlight
+
+
+@pytest.mark.anyio
+async def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"value": calls}
+
+    results = await asyncio.gather(*[flight.do("k", work) for _ in range(5)])
+    assert calls == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats == {"calls": 1, "shared": 4, "cancelled": 0}
+    assert flight.inflight == 0
+    # 完成后再调用会重新执行
+    await flight.do("k", work)
+    assert calls == 2
+
+
+@pytest.mark.anyio
+async def test_different_keys_not_merged():
+    flight = SingleFlight()
+    results = await asyncio.gather(flight.do("a", lambda: asyncio.sleep(0, "a")), flight.do("b", lambda: asyncio.sleep(0, "b")))
+    assert results == ["a", "b"]
+    assert flight.stats["calls"] == 2
+
+
+@pytest.mark.anyio
+async def test_exception_shared_by_all_waiters():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(*[flight.do("k", fail) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.inflight == 0
+
+
+@pytest.mark.anyio
+async def test_cancelling_one_waiter_keeps_shared_call():
+    flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def work():
+        started.set()
+        await asyncio.sleep(0.05)
+        return "done"
+
+    first = asyncio.ensure_future(flight.do("k", work))
+    second = asyncio.ensure_future(flight.do("k", work))
+    await started.wait()
+    first.cancel()
+    assert await second == "done"
+    assert first.cancelled()
+    assert flight.stats["cancelled"] == 0
+
+
+@pytest.mark.anyio
+async def test_last_waiter_cancelled_cancels_shared_call():
+    flight = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    waiters = [asyncio.ensure_future(flight.do("k", work)) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    for waiter in waiters:
+        waiter.cancel()
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    assert flight.stats["cancelled"] == 1
+    await asyncio.sleep(0)
+    assert flight.inflight == 0
+
+
+@pytest.mark.anyio
+async def test_caller_after_last_waiter_cancelled_starts_new_call():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return calls
+
+    waiter = asyncio.ensure_future(flight.do("k", work))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    # 已取消的调用还没结束时到达的相同请求不会收到 CancelledError
+    assert flight.inflight == 0
+    assert await flight.do("k", work) == 2
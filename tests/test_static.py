@@ -0,0 +1,68 @@
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from app.services.storage import is_public
+from app.utils.static import TaskStaticFiles, parse_range
+
+ASSET = "ab" + "0" * 62
+
+
+@pytest.mark.parametrize("rel, public", [
+    (f"assets/ab/{ASSET}.png", True),
+    (f"assets/ab/{ASSET}.256.webp", True),
+    ("outputs/ab/task1/final-1.mp4", True),
+    ("task1/final-1.mp4", False),
+    ("tasks.db", False),
+    ("storage.db-wal", False),
+    ("storage.lock", False),
+    ("batches/batch-1.json", False),
+    ("sessions/ab/" + "0" * 32 + ".json", False),
+    ("cache/story/ab/key.json", False),
+    ("clips/ab/key.mp4", False),
+    ("../tasks.db", False),
+    ("assets/../tasks.db", False),
+])
+def test_is_public(rel, public):
+    assert is_public(rel) is public
+
+
+@pytest.mark.anyio
+async def test_internal_files_are_not_served(tmp_path):
+    for rel in ("tasks.db", "storage.db", "batches/batch-1.json", "cache/story/ab/key.json", f"assets/ab/{ASSET}.png"):
+        path = tmp_path / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"data")
+    app = Starlette(routes=[Mount("/tasks", TaskStaticFiles(directory=str(tmp_path)))])
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        for rel in ("tasks.db", "storage.db", "batches/batch-1.json", "cache/story/ab/key.json"):
+            assert (await client.get(f"/tasks/{rel}")).status_code == 404
+        response = await client.get(f"/tasks/assets/ab/{ASSET}.png")
+        assert response.status_code == 200
+        assert response.content == b"data"
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=999-999", (999, 999)),
+    (" bytes=0-0 ", (0, 0)),
+    # 不支持的格式按完整文件返回
+    ("bytes=-", None),
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=1000-2000", "bytes=5-4", "bytes=-0"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1000)
@@ -0,0 +1,79 @@
+import io
+
+import pytest
+from pydantic import ValidationError
+
+from app.schemas.video import VideoGenerateRequest
+from app.services.storage import storage_manager
+
+
+@pytest.mark.parametrize("task_id", ["../../../../../tmp/evil_out", "a/b", "..", "", "x" * 65, "a\\b"])
+def test_task_id_rejects_paths(task_id):
+    with pytest.raises(ValidationError):
+        VideoGenerateRequest(task_id=task_id)
+    with pytest.raises(ValueError):
+        storage_manager.task_output_dir(task_id)
+
+
+def test_task_id_plain_id_accepted():
+    request = VideoGenerateRequest(task_id="0f3a9c_task-1")
+    assert storage_manager.task_output_dir(request.task_id).endswith("/0f3a9c_task-1")
+
+
+@pytest.mark.anyio
+async def test_video_task_uses_server_task_id(monkeypatch):
+    from app.services import task
+
+    seen = {}
+
+    async def fake_generate_video(request):
+        seen["task_id"] = request.task_id
+        return {}
+
+    monkeypatch.setattr(task, "generate_video", fake_generate_video)
+    request = VideoGenerateRequest.model_construct(**{**VideoGenerateRequest().model_dump(), "task_id": "../../evil"})
+    await task._run_video("server1234", request)
+    assert seen["task_id"] == "server1234"
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("url", ["http://169.254.169.254/latest/meta-data/", "/tasks/cache/story/ab/key.json", "/tasks/../app/config.py"])
+async def test_segment_image_rejects_external_urls(monkeypatch, tmp_path, url):
+    from app.services import video
+
+    def download_client():
+        raise AssertionError("client-supplied urls must not be fetched")
+
+    monkeypatch.setattr(video.provider_registry, "download_client", download_client)
+    with pytest.raises(ValueError):
+        await video._segment_image(VideoGenerateRequest(), 0, {"url": url}, str(tmp_path / "0.png"), (8, 8))
+
+
+@pytest.mark.anyio
+async def test_segment_image_reads_local_asset(tmp_path):
+    from PIL import Image
+
+    from app.services import video
+    from app.services.asset import asset_store
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 16), "red").save(buffer, format="PNG")
+    url = await asset_store.store_bytes(buffer.getvalue(), ".png")
+    path = tmp_path / "0.png"
+    await video._segment_image(VideoGenerateRequest(), 0, {"url": url}, str(path), (8, 8))
+    assert Image.open(path).size == (8, 8)
+
+
+@pytest.mark.anyio
+async def test_story_segments_ignore_stale_story_file(tmp_path):
+    from app.services import video
+
+    (tmp_path / "story.json").write_text('[{"text": "stale", "image_prompt": "stale"}]', encoding="utf-8")
+    segments = await video._story_segments(VideoGenerateRequest(test_mode=True, segments=2, story_prompt="a fox"), str(tmp_path))
+    assert [segment["image_prompt"] for segment in segments] == ["placeholder scene 1", "placeholder scene 2"]
+
+
+@pytest.mark.parametrize("voice_rate", [0, -1, 3.5])
+def test_voice_rate_bounds(voice_rate):
+    with pytest.raises(ValidationError):
+        VideoGenerateRequest(voice_rate=voice_rate)